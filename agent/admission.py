@@ -0,0 +1,276 @@
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from breaker import get_health
+from metrics import rate_limited, shed_total
+
+# --------------------------------
+# Admission control settings
+# --------------------------------
+# Each provider gets at most AGENT_<PROVIDER>_CONCURRENCY calls in flight.
+# Up to AGENT_PROVIDER_QUEUE more wait for a slot, for at most
+# AGENT_PROVIDER_MAX_WAIT seconds (less if the request budget is shorter).
+# A call that cannot be admitted is shed: the request moves on to the next
+# provider or the fallback generator instead of piling onto a slow provider.
+PROVIDER_CONCURRENCY = {
+    "OpenAI": int(os.getenv("AGENT_OPENAI_CONCURRENCY", "16")),
+    "Hugging Face": int(os.getenv("AGENT_HF_CONCURRENCY", "8")),
+}
+PROVIDER_QUEUE = int(os.getenv("AGENT_PROVIDER_QUEUE", "32"))
+PROVIDER_MAX_WAIT = float(os.getenv("AGENT_PROVIDER_MAX_WAIT", "2.0"))
+
+# Per-client token bucket: AGENT_CLIENT_RATE requests per second with bursts
+# of AGENT_CLIENT_BURST. 0 disables client rate limiting.
+CLIENT_RATE = float(os.getenv("AGENT_CLIENT_RATE", "0"))
+CLIENT_BURST = float(os.getenv("AGENT_CLIENT_BURST", "20"))
+CLIENT_TRACKED = int(os.getenv("AGENT_CLIENT_TRACKED", "10000"))
+# When set (serve.py does this for its workers), the buckets live in this
+# memory-mapped file so the rate holds across all worker processes rather
+# than per worker.
+CLIENT_SHARED_PATH = os.getenv("AGENT_CLIENT_SHARED_PATH", "")
+
+
+class LoadShed(Exception):
+    """
+    Raised when a provider call is not admitted.
+    """
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider} call shed ({reason})")
+        self.provider = provider
+        self.reason = reason
+
+
+class ProviderLimiter:
+    """
+    Concurrency limit plus a bounded, time-limited wait queue for one provider.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _shed(self, reason: str) -> LoadShed:
+        self.shed += 1
+        shed_total.inc(self.name, reason)
+        return LoadShed(self.name, reason)
+
+    @asynccontextmanager
+    async def slot(self, budget: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Hold one concurrency slot for the duration of the block, waiting at
+        most min(max_wait, budget) seconds for it. Raises LoadShed when the
+        queue is full or the expected wait already exceeds that limit.
+        """
+        if self._semaphore.locked():
+            limit = self.max_wait if budget is None else min(self.max_wait, budget)
+            if self.waiting >= self.queue_size:
+                raise self._shed("queue_full")
+
+            # Slots free up about once per (latency / concurrency) seconds
+            latency = get_health(self.name).ewma_latency
+            if limit <= 0 or (latency is not None and (self.waiting + 1) * latency / self.concurrency > limit):
+                raise self._shed("budget")
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=limit)
+            except asyncio.TimeoutError:
+                raise self._shed("queue_timeout") from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+provider_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def get_limiter(name: str) -> ProviderLimiter:
+    limiter = provider_limiters.get(name)
+    if limiter is None:
+        concurrency = PROVIDER_CONCURRENCY.get(name, 8)
+        limiter = provider_limiters[name] = ProviderLimiter(name, concurrency, PROVIDER_QUEUE, PROVIDER_MAX_WAIT)
+    return limiter
+
+
+async def admitted_call(name: str, budget: Optional[float], fn, *args, **kwargs):
+    """
+    Run `fn` inside a concurrency slot for provider `name`. Time spent
+    queueing is not part of the call, so it does not skew provider latency.
+    """
+    async with get_limiter(name).slot(budget):
+        return await fn(*args, **kwargs)
+
+
+def admission_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in provider_limiters.items()}
+
+
+# --------------------------------
+# Per-client rate limiting
+# --------------------------------
+class SharedBucketTable:
+    """
+    Client token buckets in a memory-mapped file shared by worker processes.
+
+    A client hashes to a slot and may sit in any of the PROBE slots after it;
+    when all of those belong to other clients, the least recently seen one is
+    forgotten. Reads and updates happen under an exclusive flock, like
+    breaker.SharedHealthTable, and use the system-wide monotonic clock.
+    """
+
+    # client key hash (0 = empty), tokens, last seen
+    RECORD = struct.Struct("<Qdd")
+    PROBE = 8
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = max(slots, self.PROBE)
+        size = self.RECORD.size * self.slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(client: str) -> int:
+        # hash() is salted per process, so workers would disagree on slots
+        return int.from_bytes(hashlib.blake2b(client.encode("utf-8"), digest_size=8).digest(), "little") | 1
+
+    def load(self, client: str, burst: float, now: float) -> Tuple[int, int, List[float]]:
+        """
+        Caller holds the lock. The slot, key and [tokens, last seen] of
+        `client`, or a full bucket in a free (or reclaimed) slot.
+        """
+        key = self._key(client)
+        start = key % self.slots
+        victim, victim_seen = start, float("inf")
+        for i in range(self.PROBE):
+            slot = (start + i) % self.slots
+            stored, tokens, seen = self.RECORD.unpack_from(self._map, slot * self.RECORD.size)
+            if stored == key:
+                return slot, key, [tokens, seen]
+            # Empty slots first, then the least recently seen client
+            rank = float("-inf") if stored == 0 else seen
+            if rank < victim_seen:
+                victim, victim_seen = slot, rank
+        return victim, key, [burst, now]
+
+    def store(self, slot: int, key: int, bucket: List[float]) -> None:
+        self.RECORD.pack_into(self._map, slot * self.RECORD.size, key, bucket[0], bucket[1])
+
+    def __len__(self) -> int:
+        with self.locked():
+            return sum(
+                1 for slot in range(self.slots)
+                if self.RECORD.unpack_from(self._map, slot * self.RECORD.size)[0]
+            )
+
+
+class ClientRateLimiter:
+    """
+    Token buckets keyed by client, least recently seen clients forgotten first.
+    With a shared path the buckets are kept in a SharedBucketTable, so every
+    worker process draws from the same bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int, shared_path: str = ""):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._shared = SharedBucketTable(shared_path, max_clients) if shared_path and rate > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _take(self, bucket: List[float], now: float) -> Optional[float]:
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return None
+        return (1 - bucket[0]) / self.rate
+
+    def allow(self, client: str) -> Optional[float]:
+        """
+        Take a token for `client`. Returns None when allowed, otherwise the
+        seconds until a token is available (for Retry-After).
+        """
+        now = time.monotonic()
+        if self._shared is not None:
+            with self._shared.locked():
+                slot, key, bucket = self._shared.load(client, self.burst, now)
+                wait = self._take(bucket, now)
+                self._shared.store(slot, key, bucket)
+        else:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [self.burst, now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            wait = self._take(bucket, now)
+
+        if wait is not None:
+            self.limited += 1
+            rate_limited.inc()
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "shared": self._shared is not None,
+            "tracked_clients": len(self._shared) if self._shared is not None else len(self._buckets),
+            "limited": self.limited,
+        }
+
+
+client_limiter = ClientRateLimiter(CLIENT_RATE, CLIENT_BURST, CLIENT_TRACKED, CLIENT_SHARED_PATH)
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from admission import admitted_call
+from deadline import call_with_retries, remaining, start_budget
+from metrics import batch_size, batch_tokens_saved, batch_wait_seconds
+from providers import PROVIDER_BATCH_CALLS, PROVIDER_CALLS
+
+# --------------------------------
+# Micro-batching settings
+# --------------------------------
+# With AGENT_BATCH=on, provider prompts of the same kind that arrive within
+# AGENT_BATCH_WINDOW_MS of each other are sent as one call of up to
+# AGENT_BATCH_MAX requests. Providers with a native batch API get the
+# individual prompts in one request; the others get one combined prompt that
+# states the shared instructions once and numbers the per-request tasks. A
+# combined batch is closed early when one more request would push the sum of
+# the requests' answer sizes past AGENT_BATCH_MAX_TOKENS, so a full batch is
+# never cut off mid-answer.
+BATCH_ENABLED = os.getenv("AGENT_BATCH", "off") == "on"
+BATCH_WINDOW = float(os.getenv("AGENT_BATCH_WINDOW_MS", "15")) / 1000
+BATCH_MAX = int(os.getenv("AGENT_BATCH_MAX", "8"))
+BATCH_MAX_TOKENS = int(os.getenv("AGENT_BATCH_MAX_TOKENS", "4000"))
+
+# Rough prompt-size estimate for reporting savings, in characters per token
+CHARS_PER_TOKEN = 4
+
+
+def split_results(text: str, count: int) -> List[Optional[str]]:
+    """
+    Split a combined answer into per-request JSON texts. Entries are decoded
+    one at a time, so a malformed or truncated entry only loses itself and
+    the ones after it; requests with no usable entry get None.
+    """
+    results: List[Optional[str]] = [None] * count
+    start = text.find('"results"')
+    start = text.find("[", start) if start != -1 else -1
+    if start == -1:
+        return results
+
+    decoder = json.JSONDecoder()
+    position = start + 1
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text) or text[position] == "]":
+            break
+        try:
+            entry, position = decoder.raw_decode(text, position)
+        except ValueError:
+            break
+        if not isinstance(entry, dict):
+            continue
+        number = entry.get("request")
+        answer = entry.get("answer")
+        if isinstance(number, int) and 1 <= number <= count and answer is not None:
+            results[number - 1] = json.dumps(answer)
+    return results
+
+
+class _Item:
+    __slots__ = ("task", "prompt", "max_tokens", "future", "deadline", "queued_at")
+
+    def __init__(self, task: str, prompt: str, max_tokens: int, future: asyncio.Future):
+        self.task = task
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.deadline = self.queued_at + remaining()
+
+
+class MicroBatcher:
+    """
+    Collects provider prompts per (provider, kind) for a short window and
+    sends each collection as one provider call, then hands every waiting
+    request its own slice of the answer (or None, like a failed solo call).
+    """
+
+    def __init__(self, enabled: bool, window: float, max_size: int, max_tokens: int):
+        self.enabled = enabled
+        self.window = window
+        self.max_size = max(1, max_size)
+        self.max_tokens = max_tokens
+        self.batches = 0
+        self.items = 0
+        self.calls_saved = 0
+        self.tokens_saved = 0
+        self.failed_items = 0
+        self.wait_total = 0.0
+        self._builders: Dict[str, Callable[[List[str]], str]] = {}
+        self._pending: Dict[Tuple[str, str], List[_Item]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._sending: Set[asyncio.Task] = set()
+
+    def register(self, kind: str, build: Callable[[List[str]], str]) -> None:
+        """
+        Register the combined-prompt builder for a kind of request.
+        """
+        self._builders[kind] = build
+
+    async def submit(self, provider: str, kind: str, task: str, prompt: str, max_tokens: int) -> Optional[str]:
+        """
+        Queue one request: `task` is its part of a combined prompt and
+        `prompt` the full solo prompt. Returns the provider text for this
+        request, or None when the provider gave nothing usable for it.
+        """
+        loop = asyncio.get_running_loop()
+        key = (provider, kind)
+        item = _Item(task, prompt, max_tokens, loop.create_future())
+        batch = self._pending.get(key)
+        if (
+            batch and provider not in PROVIDER_BATCH_CALLS
+            and sum(queued.max_tokens for queued in batch) + max_tokens > self.max_tokens
+        ):
+            # The combined answer would not fit; send what is queued
+            self._timers.pop(key).cancel()
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._pending[key] = []
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        batch.append(item)
+        if len(batch) >= self.max_size:
+            self._timers.pop(key).cancel()
+            self._flush(key)
+        return await item.future
+
+    def _flush(self, key: Tuple[str, str]) -> None:
+        self._timers.pop(key, None)
+        batch = self._pending.pop(key, [])
+        # Requests that already gave up (lost a race, client left) are dropped
+        batch = [item for item in batch if not item.future.done()]
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(key, batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, key: Tuple[str, str], batch: List[_Item]) -> None:
+        provider, kind = key
+        now = time.monotonic()
+        for item in batch:
+            batch_wait_seconds.observe(now - item.queued_at, provider)
+            self.wait_total += now - item.queued_at
+        batch_size.observe(len(batch), provider)
+        self.batches += 1
+        self.items += len(batch)
+        self.calls_saved += len(batch) - 1
+        # The call may run only as long as the tightest budget in the batch
+        start_budget(max(0.0, min(item.deadline for item in batch) - now))
+
+        try:
+            texts = await self._call(provider, kind, batch)
+        except asyncio.CancelledError:
+            for item in batch:
+                item.future.cancel()
+            raise
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        for item, text in zip(batch, texts):
+            if text is None:
+                self.failed_items += 1
+            if not item.future.done():
+                item.future.set_result(text)
+
+    async def _call(self, provider: str, kind: str, batch: List[_Item]) -> List[Optional[str]]:
+        if len(batch) == 1:
+            item = batch[0]
+            text = await admitted_call(
+                provider, remaining(), call_with_retries, provider, PROVIDER_CALLS[provider],
+                item.prompt, max_tokens=item.max_tokens,
+            )
+            return [text]
+
+        max_tokens = max(item.max_tokens for item in batch)
+        native = PROVIDER_BATCH_CALLS.get(provider)
+        if native is not None:
+            texts = await admitted_call(
+                provider, remaining(), call_with_retries, provider, native,
+                [item.prompt for item in batch], max_tokens=max_tokens,
+            )
+            return texts if texts is not None else [None] * len(batch)
+
+        prompt = self._builders[kind]([item.task for item in batch])
+        saved = (sum(len(item.prompt) for item in batch) - len(prompt)) // CHARS_PER_TOKEN
+        self.tokens_saved += saved
+        batch_tokens_saved.inc(provider, amount=saved)
+        text = await admitted_call(
+            provider, remaining(), call_with_retries, provider, PROVIDER_CALLS[provider],
+            prompt, max_tokens=sum(item.max_tokens for item in batch),
+        )
+        if text is None:
+            return [None] * len(batch)
+        return split_results(text, len(batch))
+
+    async def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for batch in self._pending.values():
+            for item in batch:
+                item.future.cancel()
+        self._pending.clear()
+        for task in list(self._sending):
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": round(self.window * 1000, 1),
+            "max_size": self.max_size,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "avg_wait_ms": round(self.wait_total / self.items * 1000, 2) if self.items else 0.0,
+            "calls_saved": self.calls_saved,
+            "estimated_tokens_saved": self.tokens_saved,
+            "failed_items": self.failed_items,
+        }
+
+
+batcher = MicroBatcher(BATCH_ENABLED, BATCH_WINDOW, BATCH_MAX, BATCH_MAX_TOKENS)
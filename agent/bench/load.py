@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+# --------------------------------
+# Load driver
+# --------------------------------
+# Drives /agent/recipes and /agent/recipe/details at a fixed concurrency and
+# reports latency percentiles, throughput and fallback rate. Run the agent
+# against bench/stub_llm.py (with AGENT_CORPUS_MODE=off so every answer comes
+# from a provider or the fallback generator), then:
+#
+#   python bench/load.py run --concurrency 32 --requests 500 --label baseline
+#   python bench/load.py compare bench/results/baseline-*.json bench/results/new-*.json
+#
+# Results are written to bench/results/ as JSON.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+PANTRY_ITEMS = [
+    "eggs", "rice", "garlic", "chicken", "onion", "tomatoes", "pasta", "spinach",
+    "salmon", "bread", "cheese", "beef", "potatoes", "carrot", "broccoli", "tofu",
+    "beans", "pepper", "mushrooms", "lemon",
+]
+
+
+def make_pantries(count: int, distinct: int, seed: int) -> List[List[str]]:
+    """
+    Draw `count` pantries from a pool of `distinct` ones, Zipf-weighted so a
+    few popular pantries repeat the way they do in real traffic.
+    """
+    rng = random.Random(seed)
+    pool = [rng.sample(PANTRY_ITEMS, rng.randint(2, 5)) for _ in range(distinct)]
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return rng.choices(pool, weights=weights, k=count)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def summarize(samples: List[dict], elapsed: float) -> dict:
+    latencies = sorted(s["latency"] for s in samples if s["ok"])
+    ok = len(latencies)
+    fallbacks = sum(1 for s in samples if s["ok"] and s.get("fallback"))
+    return {
+        "requests": len(samples),
+        "ok": ok,
+        "errors": len(samples) - ok,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(sum(latencies) / ok * 1000, 1) if ok else 0.0,
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "fallback_rate": round(fallbacks / ok, 4) if ok else 0.0,
+    }
+
+
+async def run_load(base_url: str, endpoint: str, pantries: List[List[str]], concurrency: int, timeout: float) -> dict:
+    samples: List[dict] = []
+    queue = list(pantries)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+
+        async def one(pantry: List[str]) -> None:
+            if endpoint == "details":
+                path = "/agent/recipe/details"
+                body = {"recipe_id": f"stub_{pantry[0]}_0", "ingredients": pantry}
+            else:
+                path = "/agent/recipes"
+                body = {"ingredients": pantry}
+
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                latency = time.perf_counter() - started
+                sample = {"ok": response.status_code == 200, "latency": latency, "status": response.status_code}
+                if sample["ok"] and endpoint == "recipes":
+                    recipes = response.json().get("recipes", [])
+                    # Stub-generated recipes carry a stub_ prefix; anything else is fallback
+                    sample["fallback"] = not any(r["id"].startswith("stub_") for r in recipes)
+            except httpx.HTTPError as e:
+                sample = {"ok": False, "latency": time.perf_counter() - started, "status": type(e).__name__}
+            samples.append(sample)
+
+        async def worker() -> None:
+            while queue:
+                await one(queue.pop())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        try:
+            agent_health = (await client.get("/health")).json()
+        except Exception:
+            agent_health = None
+
+    summary = summarize(samples, elapsed)
+    summary["status_counts"] = {}
+    for s in samples:
+        key = str(s["status"])
+        summary["status_counts"][key] = summary["status_counts"].get(key, 0) + 1
+    summary["agent_health"] = agent_health
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def print_summary(endpoint: str, summary: dict) -> None:
+    print(f"\n/{endpoint}: {summary['requests']} requests, {summary['errors']} errors")
+    print(f"  throughput  {summary['throughput_rps']} req/s")
+    print(f"  latency     p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms  max {summary['max_ms']}ms")
+    if endpoint == "recipes":
+        print(f"  fallback    {summary['fallback_rate'] * 100:.1f}%")
+
+
+async def run(args) -> None:
+    endpoints = ["recipes", "details"] if args.endpoint == "both" else [args.endpoint]
+    if args.profile:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(f"{args.stub_url}/__profile", json={"profile": args.profile})
+            response.raise_for_status()
+        print(f"Stub profile: {args.profile}")
+
+    pantries = make_pantries(args.requests, args.distinct, args.seed)
+
+    report = {
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "distinct_pantries": args.distinct,
+            "seed": args.seed,
+            "stub_profile": args.profile,
+        },
+        "results": {},
+    }
+
+    for endpoint in endpoints:
+        summary = await run_load(args.url, endpoint, pantries, args.concurrency, args.timeout)
+        report["results"][endpoint] = summary
+        print_summary(endpoint, summary)
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(args.out, f"{args.label}-{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+def compare(args) -> None:
+    with open(args.before, "r", encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, "r", encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"{before['label']} ({before.get('git_revision')}) -> {after['label']} ({after.get('git_revision')})")
+    for endpoint, new in after["results"].items():
+        old = before["results"].get(endpoint)
+        if old is None:
+            continue
+        print(f"\n/{endpoint}")
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "fallback_rate", "errors"):
+            delta = new[metric] - old[metric]
+            change = f"{delta / old[metric] * 100:+.1f}%" if old[metric] else "n/a"
+            print(f"  {metric:<15} {old[metric]:>10} -> {new[metric]:>10}  ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the recipe agent")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run a load test and save the results")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--endpoint", choices=["recipes", "details", "both"], default="both")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--requests", type=int, default=200)
+    run_parser.add_argument("--distinct", type=int, default=50, help="Distinct pantries in the request mix")
+    run_parser.add_argument("--seed", type=int, default=7)
+    run_parser.add_argument("--timeout", type=float, default=60)
+    run_parser.add_argument("--profile", default=None, help="Switch the stub to this profile before running")
+    run_parser.add_argument("--stub-url", default="http://127.0.0.1:9000")
+    run_parser.add_argument("--label", default="run")
+    run_parser.add_argument("--out", default=RESULTS_DIR)
+
+    compare_parser = sub.add_parser("compare", help="Compare two saved result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
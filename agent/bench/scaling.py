@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import httpx
+
+from load import RESULTS_DIR, git_revision, make_pantries, run_load
+
+# --------------------------------
+# Worker scaling benchmark
+# --------------------------------
+# Starts serve.py with 1, 2, 4, ... workers and measures /agent/recipes
+# throughput at each size. The server runs with AGENT_CORPUS_MODE=only, so
+# every request is CPU work in the agent (corpus search or the fallback
+# generator, validation, serialization) and no provider is involved. Load
+# comes from several client processes so the driver is not the bottleneck.
+#
+#   python bench/scaling.py --workers 1 2 4 8 --requests 4000
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def client(url: str, pantries, concurrency: int, timeout: float) -> dict:
+    return asyncio.run(run_load(url, "recipes", pantries, concurrency, timeout))
+
+
+def wait_ready(url: str, deadline: float) -> None:
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+def measure(workers: int, args) -> dict:
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, AGENT_CORPUS_MODE="only", AGENT_STORE_PATH="", AGENT_WORKER_MAX_REQUESTS="0")
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(args.port), "--host", "127.0.0.1"],
+        cwd=AGENT_DIR, env=env,
+    )
+    try:
+        wait_ready(url, time.monotonic() + 30)
+        # Every worker has to be up, not just the first one to answer
+        time.sleep(1 + 0.5 * workers)
+
+        per_client = args.requests // args.clients
+        batches = [make_pantries(per_client, args.distinct, args.seed + n) for n in range(args.clients)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(args.clients) as pool:
+            summaries = list(pool.map(
+                client, [url] * args.clients, batches,
+                [args.concurrency] * args.clients, [args.timeout] * args.clients,
+            ))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    requests = sum(s["requests"] for s in summaries)
+    return {
+        "workers": workers,
+        "requests": requests,
+        "errors": sum(s["errors"] for s in summaries),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(sum(s["p50_ms"] for s in summaries) / len(summaries), 1),
+        "p99_ms": max(s["p99_ms"] for s in summaries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput as serve.py workers are added")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=4, help="Load generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="Connections per client process")
+    parser.add_argument("--distinct", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}")
+    rows = []
+    for workers in args.workers:
+        row = measure(workers, args)
+        rows.append(row)
+        speedup = row["throughput_rps"] / rows[0]["throughput_rps"]
+        print(f"workers={workers:<3} {row['throughput_rps']:>9} req/s  x{speedup:.2f}  "
+              f"p50 {row['p50_ms']}ms  p99 {row['p99_ms']}ms  errors {row['errors']}")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"scaling-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"git_revision": git_revision(), "cpu_count": os.cpu_count(), "results": rows}, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
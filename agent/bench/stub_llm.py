@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+# --------------------------------
+# Stub LLM server
+# --------------------------------
+# Local stand-in for the OpenAI chat-completions and Hugging Face inference
+# endpoints, with scriptable latency and failure profiles (profiles.json).
+# Point the agent at it with:
+#
+#   OPENAI_API_KEY=stub
+#   OPENAI_API_URL=http://127.0.0.1:9000/v1/chat/completions
+#   HF_API_URL=http://127.0.0.1:9000/hf
+#
+# and start it with `python bench/stub_llm.py --profile flaky`.
+# The active profile can be switched at runtime with POST /__profile.
+
+PROFILES_PATH = os.getenv("STUB_PROFILES", os.path.join(os.path.dirname(__file__), "profiles.json"))
+
+with open(PROFILES_PATH, "r", encoding="utf-8") as f:
+    PROFILES = json.load(f)
+
+state = {"profile": os.getenv("STUB_PROFILE", "healthy"), "calls": {"openai": 0, "hf": 0}}
+
+app = FastAPI(title="Stub LLM", version="1.0.0")
+
+HF_401_PAGE = "<!doctype html><html><body><h1>401</h1><p>Unauthorized access. Please check your credentials or authorization</p></body></html>"
+
+
+def provider_profile(provider: str) -> dict:
+    return PROFILES[state["profile"]].get(provider, {})
+
+
+def sample_latency(spec: dict) -> float:
+    dist = spec.get("dist", "fixed")
+    if dist == "uniform":
+        return random.uniform(spec["min_ms"], spec["max_ms"]) / 1000
+    if dist == "lognormal":
+        return random.lognormvariate(0, spec.get("sigma", 0.5)) * spec["median_ms"] / 1000
+    return spec.get("ms", 0) / 1000
+
+
+def sample_error(profile: dict):
+    roll = random.random()
+    for status, rate in profile.get("errors", {}).items():
+        if roll < rate:
+            return int(status)
+        roll -= rate
+    return None
+
+
+def prompt_ingredients(prompt: str) -> List[str]:
+    match = re.search(r"these ingredients: (.*?)\.(?: |\n)", prompt)
+    if not match:
+        return ["ingredients"]
+    return [i.strip() for i in match.group(1).split(",") if i.strip()]
+
+
+def completion_payload(prompt: str, attributes: bool = False) -> dict:
+    """
+    Build a plausible recipe list or recipe detail payload for the prompt,
+    declaring cuisine, meal type and time when the (filtered) format asks.
+    """
+    ingredients = prompt_ingredients(prompt)
+    main = ingredients[0]
+
+    detail = re.search(r'complete recipe for "(.*?)"', prompt)
+    if detail:
+        return {
+            "title": detail.group(1).replace("_", " ").title(),
+            "ingredients": [{"name": i, "required": True} for i in ingredients] + [{"name": "salt", "required": False}],
+            "steps": [f"Step {n}: Prepare the {main} and cook for {n * 3} minutes" for n in range(1, 7)],
+            "tips": ["Season to taste", f"Fresh {main} works best"],
+        }
+
+    styles = ["Stir Fry", "Bake", "Salad", "Soup", "Bowl", "Skillet", "Wrap", "Curry", "Frittata", "Tacos"]
+    recipes = []
+    for n, style in enumerate(styles):
+        recipe = {
+            "id": f"stub_{main.replace(' ', '_')}_{n}",
+            "title": f"{main.title()} {style}",
+            "missing": ["salt", "pepper"][: n % 3],
+            "reason": "Generated by the stub LLM",
+        }
+        if attributes:
+            recipe.update({"cuisine": "american", "meal_type": "dinner", "time_minutes": 10 + 5 * n})
+        recipes.append(recipe)
+    return {"recipes": recipes}
+
+
+def completion_text(prompt: str, profile: dict) -> str:
+    # Combined prompts number their requests one per line ("1. Suggest ...")
+    requests = re.findall(r"^(\d+)\. (.*)$", prompt, flags=re.MULTILINE)
+    attributes = '"time_minutes"' in prompt
+    if requests:
+        payload = {
+            "results": [
+                {"request": int(number), "answer": completion_payload(task + "\n", attributes)}
+                for number, task in requests
+            ]
+        }
+    else:
+        payload = completion_payload(prompt, attributes)
+
+    text = json.dumps(payload, indent=2)
+    if random.random() < profile.get("malformed_rate", 0):
+        text = text[: random.randint(1, len(text) - 2)]
+    if profile.get("chatter"):
+        text = f"Sure! Here are some ideas:\n{text}\nLet me know if you want more."
+    return text
+
+
+async def chunked(text: str, size: int = 24):
+    for start in range(0, len(text), size):
+        await asyncio.sleep(0.01)
+        yield text[start:start + size]
+
+
+async def simulate(provider: str):
+    state["calls"][provider] += 1
+    profile = provider_profile(provider)
+    await asyncio.sleep(sample_latency(profile.get("latency", {})))
+    return profile, sample_error(profile)
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    body = await request.json()
+    profile, error = await simulate("openai")
+    if error:
+        return JSONResponse({"error": {"message": f"stub error {error}", "code": error}}, status_code=error)
+
+    prompt = body["messages"][-1]["content"]
+    text = completion_text(prompt, profile)
+
+    if body.get("stream"):
+        async def events():
+            async for piece in chunked(text):
+                yield "data: " + json.dumps({"choices": [{"delta": {"content": piece}}]}) + "\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(text) // 4
+    return {
+        "choices": [{"message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.post("/hf")
+async def huggingface_inference(request: Request):
+    body = await request.json()
+    profile, error = await simulate("hf")
+    if error == 401:
+        return HTMLResponse(HF_401_PAGE, status_code=401)
+    if error:
+        return JSONResponse({"error": f"stub error {error}"}, status_code=error)
+
+    if isinstance(body["inputs"], list):
+        # Batched inputs: one generation per prompt, in order
+        return [[{"generated_text": completion_text(prompt, profile)}] for prompt in body["inputs"]]
+
+    text = completion_text(body["inputs"], profile)
+
+    if body.get("stream"):
+        async def events():
+            async for piece in chunked(text):
+                yield "data:" + json.dumps({"token": {"text": piece, "special": False}}) + "\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return [{"generated_text": text}]
+
+
+@app.post("/__profile")
+async def set_profile(request: Request):
+    name = (await request.json()).get("profile")
+    if name not in PROFILES:
+        raise HTTPException(status_code=404, detail=f"Unknown profile {name}")
+    state["profile"] = name
+    return {"profile": name}
+
+
+@app.get("/__stats")
+def stats():
+    return {"profile": state["profile"], "calls": state["calls"], "profiles": sorted(PROFILES)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI/Hugging Face server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--profile", default=state["profile"], choices=sorted(PROFILES))
+    args = parser.parse_args()
+
+    state["profile"] = args.profile
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,280 @@
+import asyncio
+import fcntl
+import math
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from metrics import observe_stage, provider_calls
+
+# --------------------------------
+# Circuit breaker settings
+# --------------------------------
+# A provider's circuit opens after BREAKER_FAILURES consecutive failures, or
+# when its smoothed error rate reaches BREAKER_ERROR_RATE over at least
+# BREAKER_MIN_SAMPLES calls. After BREAKER_COOLDOWN seconds one probe call is
+# let through (half-open); its outcome closes or re-opens the circuit.
+BREAKER_FAILURES = int(os.getenv("AGENT_BREAKER_FAILURES", "3"))
+BREAKER_ERROR_RATE = float(os.getenv("AGENT_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_MIN_SAMPLES = int(os.getenv("AGENT_BREAKER_MIN_SAMPLES", "10"))
+BREAKER_COOLDOWN = float(os.getenv("AGENT_BREAKER_COOLDOWN", "30"))
+EWMA_ALPHA = float(os.getenv("AGENT_EWMA_ALPHA", "0.2"))
+
+# When set (serve.py does this for its workers), circuit state lives in this
+# memory-mapped file so every worker process sees the same circuits.
+BREAKER_SHARED_PATH = os.getenv("AGENT_BREAKER_SHARED_PATH", "")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+# --------------------------------
+# Cross-process circuit state
+# --------------------------------
+class SharedHealthTable:
+    """
+    Fixed-size table of provider health records in a memory-mapped file.
+
+    Each record is read into a ProviderHealth before a decision and written
+    back after an update while holding an exclusive flock, so concurrent
+    workers never interleave read-modify-write cycles. Timestamps use the
+    monotonic clock, which is system-wide on Linux.
+    """
+
+    # name, state, samples, consecutive failures, opened_at, probe_started_at,
+    # ewma latency, error rate (NaN stands for None)
+    RECORD = struct.Struct("<32sBxxxxxxxqqdddd")
+    SLOTS = 16
+
+    def __init__(self, path: str):
+        self.path = path
+        size = self.RECORD.size * self.SLOTS
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._slots: Dict[str, int] = {}
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot(self, name: str) -> int:
+        # Caller holds the lock. Slots are claimed by name on first use.
+        slot = self._slots.get(name)
+        if slot is not None:
+            return slot
+        encoded = name.encode("utf-8")[:32]
+        for slot in range(self.SLOTS):
+            stored = self.RECORD.unpack_from(self._map, slot * self.RECORD.size)[0].rstrip(b"\0")
+            if stored == encoded or not stored:
+                if not stored:
+                    self.RECORD.pack_into(self._map, slot * self.RECORD.size, encoded, 0, 0, 0, 0.0, math.nan, math.nan, 0.0)
+                self._slots[name] = slot
+                return slot
+        raise RuntimeError("Shared circuit table is full")
+
+    def load(self, health: "ProviderHealth") -> None:
+        _, state, samples, failures, opened_at, probe, latency, error_rate = self.RECORD.unpack_from(
+            self._map, self._slot(health.name) * self.RECORD.size
+        )
+        health.state = _STATES[state]
+        health.samples = samples
+        health.consecutive_failures = failures
+        health.opened_at = opened_at
+        health.probe_started_at = None if math.isnan(probe) else probe
+        health.ewma_latency = None if math.isnan(latency) else latency
+        health.error_rate = error_rate
+
+    def store(self, health: "ProviderHealth") -> None:
+        self.RECORD.pack_into(
+            self._map, self._slot(health.name) * self.RECORD.size,
+            health.name.encode("utf-8")[:32],
+            _STATES.index(health.state),
+            health.samples,
+            health.consecutive_failures,
+            health.opened_at,
+            math.nan if health.probe_started_at is None else health.probe_started_at,
+            math.nan if health.ewma_latency is None else health.ewma_latency,
+            health.error_rate,
+        )
+
+
+shared_table: Optional[SharedHealthTable] = SharedHealthTable(BREAKER_SHARED_PATH) if BREAKER_SHARED_PATH else None
+
+
+class ProviderHealth:
+    """
+    Latency/error tracking and a closed -> open -> half-open circuit for one provider.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+
+    @contextmanager
+    def _synced(self) -> Iterator[None]:
+        # Pull the shared record before and push it back after, under the lock
+        if shared_table is None:
+            yield
+            return
+        with shared_table.locked():
+            shared_table.load(self)
+            yield
+            shared_table.store(self)
+
+    def _probe_free(self, now: float) -> bool:
+        # Call with the record synced. Moves an open circuit whose cooldown
+        # has passed to half-open, then reports whether the probe slot is free.
+        if self.state == OPEN:
+            if now - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            self.state = HALF_OPEN
+            self.probe_started_at = None
+        # One probe at a time; a probe that never reported back expires
+        return self.probe_started_at is None or now - self.probe_started_at >= BREAKER_COOLDOWN
+
+    def available(self) -> bool:
+        """
+        Whether a call may be routed to this provider right now. Only checks;
+        the half-open probe is claimed by acquire() when the call starts.
+        """
+        with self._synced():
+            return self.state == CLOSED or self._probe_free(time.monotonic())
+
+    def acquire(self) -> bool:
+        """
+        Claim the right to start a call now. Closed circuits always admit;
+        a half-open circuit admits the one probe call.
+        """
+        with self._synced():
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if not self._probe_free(now):
+                return False
+            self.probe_started_at = now
+            return True
+
+    def record_success(self, latency: float) -> None:
+        with self._synced():
+            self.samples += 1
+            self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+            self.ewma_latency = latency if self.ewma_latency is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+            )
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                print(f"Circuit for {self.name} closed")
+            self.state = CLOSED
+            self.probe_started_at = None
+
+    def record_failure(self) -> None:
+        with self._synced():
+            self.samples += 1
+            self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+            self.consecutive_failures += 1
+            self.probe_started_at = None
+
+            tripped = self.consecutive_failures >= BREAKER_FAILURES or (
+                self.samples >= BREAKER_MIN_SAMPLES and self.error_rate >= BREAKER_ERROR_RATE
+            )
+            if self.state == HALF_OPEN or (self.state == CLOSED and tripped):
+                print(f"Circuit for {self.name} opened")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # Call abandoned (e.g. lost a hedge race): no outcome to record
+        with self._synced():
+            self.probe_started_at = None
+
+    def snapshot(self) -> dict:
+        with self._synced():
+            return {
+                "state": self.state,
+                "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+                "error_rate": round(self.error_rate, 3),
+                "consecutive_failures": self.consecutive_failures,
+                "samples": self.samples,
+            }
+
+
+provider_health: Dict[str, ProviderHealth] = {}
+
+
+def get_health(name: str) -> ProviderHealth:
+    health = provider_health.get(name)
+    if health is None:
+        health = provider_health[name] = ProviderHealth(name)
+    return health
+
+
+def route(names: List[str]) -> List[str]:
+    """
+    Order providers for a request: open circuits are skipped, closed circuits
+    come before half-open probes, and within each group the lowest smoothed
+    latency wins. Providers with no latency samples yet keep their priority
+    position ahead of measured ones so they get explored.
+    """
+    ranked = []
+    for priority, name in enumerate(names):
+        health = get_health(name)
+        if not health.available():
+            continue
+        latency = health.ewma_latency if health.ewma_latency is not None else 0.0
+        ranked.append((health.state != CLOSED, latency, priority, name))
+    return [name for *_, name in sorted(ranked)]
+
+
+async def tracked_call(name: str, fn: Callable[..., Awaitable[Optional[Any]]], *args, **kwargs) -> Optional[Any]:
+    """
+    Call a provider function and record its latency and outcome.
+    A None result counts as a failure, matching the provider call contract.
+    """
+    health = get_health(name)
+    if not health.acquire():
+        # Another call holds the half-open probe, or the circuit opened since
+        # the request was routed
+        provider_calls.inc(name, "skipped")
+        return None
+    started = time.perf_counter()
+    try:
+        result = await fn(*args, **kwargs)
+    except asyncio.CancelledError:
+        health.release()
+        provider_calls.inc(name, "cancelled")
+        raise
+    except Exception:
+        health.record_failure()
+        provider_calls.inc(name, "error")
+        raise
+    finally:
+        observe_stage("provider_call", time.perf_counter() - started, name)
+
+    if result is None:
+        health.record_failure()
+        provider_calls.inc(name, "failure")
+    else:
+        health.record_success(time.perf_counter() - started)
+        provider_calls.inc(name, "success")
+    return result
+
+
+def health_snapshot() -> dict:
+    return {name: health.snapshot() for name, health in provider_health.items()}
@@ -0,0 +1,41 @@
+import argparse
+import os
+import time
+
+from corpus import RecipeCorpus
+
+# --------------------------------
+# Corpus build tool
+# --------------------------------
+# Compiles a recipes.json-style file into the memory-mapped binary corpus
+# read by the agent. Point AGENT_CORPUS_PATH at the output file.
+#
+#   python build_corpus.py recipes.json recipes.bin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a JSON recipe corpus into the binary mmap format")
+    parser.add_argument("source", help="JSON file with a list of recipes (or {\"recipes\": [...]})")
+    parser.add_argument("output", help="Binary corpus file to write")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    corpus = RecipeCorpus.from_json(args.source)
+    parsed = time.perf_counter()
+    corpus.save_binary(args.output)
+    written = time.perf_counter()
+
+    check = RecipeCorpus.from_binary(args.output)
+    opened = time.perf_counter()
+
+    print(f"Recipes:      {len(corpus)}")
+    print(f"Ingredients:  {len(corpus.vocab)}")
+    print(f"Links:        {corpus.indices.size} required, {corpus.opt_indices.size} optional")
+    print(f"Output size:  {os.path.getsize(args.output) / 1024:.1f} KiB")
+    print(f"Parse JSON:   {(parsed - started) * 1000:.1f}ms")
+    print(f"Write binary: {(written - parsed) * 1000:.1f}ms")
+    print(f"Open binary:  {(opened - written) * 1000:.1f}ms ({len(check)} recipes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Tuple
+
+# --------------------------------
+# Cache settings
+# --------------------------------
+RESULT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "2048"))
+RESULT_CACHE_TTL = float(os.getenv("AGENT_CACHE_TTL", "3600"))
+FALLBACK_CACHE_SIZE = int(os.getenv("AGENT_FALLBACK_CACHE_SIZE", "512"))
+FALLBACK_CACHE_TTL = float(os.getenv("AGENT_FALLBACK_CACHE_TTL", "60"))
+
+
+def normalize_ingredients(ingredients: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Lowercase, trim and de-duplicate ingredients into a sorted tuple so the
+    same pantry always produces the same key regardless of input order.
+    """
+    return tuple(sorted({i.strip().lower() for i in ingredients if i and i.strip()}))
+
+
+def cache_key(ingredients: Iterable[str], recipe_id: Optional[str] = None, filters: Optional[str] = None) -> Tuple:
+    """
+    Build a cache key from the normalized ingredient set and optional recipe ID.
+    Filtered recipe lists carry the filter signature in the ID slot, so they
+    never share entries with unfiltered ones.
+    """
+    return (recipe_id or (f"filters:{filters}" if filters else ""), normalize_ingredients(ingredients))
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a per-entry time-to-live.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        # Remove and return an unexpired entry without touching hit/miss counters
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Membership check that does not touch hit/miss counters or LRU order
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Validated AI results and degraded fallback results live in separate caches
+# so an outage cannot pin fallback answers for the full result TTL.
+recipe_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+detail_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+fallback_cache = TTLCache(FALLBACK_CACHE_SIZE, FALLBACK_CACHE_TTL)
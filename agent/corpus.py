@@ -0,0 +1,432 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from filters import RecipeFilter, minutes, recipe_attrs
+from scoring import ScoringEngine, top_k, weighted_score
+
+# --------------------------------
+# Corpus settings
+# --------------------------------
+# "first" serves from the corpus when it has enough good matches and otherwise
+# calls the providers, "only" never calls a provider, "off" disables the corpus.
+CORPUS_PATH = os.getenv("AGENT_CORPUS_PATH", os.path.join(os.path.dirname(__file__), "recipes.json"))
+CORPUS_MODE = os.getenv("AGENT_CORPUS_MODE", "first")
+CORPUS_MIN_COVERAGE = float(os.getenv("AGENT_CORPUS_MIN_COVERAGE", "0.5"))
+CORPUS_MIN_RESULTS = int(os.getenv("AGENT_CORPUS_MIN_RESULTS", "5"))
+
+
+# --------------------------------
+# Binary corpus format
+# --------------------------------
+# Header, then a table of (offset, element count) per section in _SECTIONS
+# order, then each section 8-byte aligned. Strings are offset tables plus
+# UTF-8 blobs; ingredient lists are CSR indptr/indices arrays and the
+# inverted index is stored pre-built so workers never rebuild it, as are
+# the per-recipe filter attribute masks and cooking times.
+BINARY_MAGIC = b"RCORPUS\0"
+BINARY_VERSION = 2
+_HEADER = struct.Struct("<8sII")
+_SECTION_ENTRY = struct.Struct("<QQ")
+_SECTIONS = [
+    ("id_offsets", np.int64),
+    ("id_blob", np.uint8),
+    ("title_offsets", np.int64),
+    ("title_blob", np.uint8),
+    ("vocab_offsets", np.int64),
+    ("vocab_blob", np.uint8),
+    ("indptr", np.int64),
+    ("indices", np.int32),
+    ("opt_indptr", np.int64),
+    ("opt_indices", np.int32),
+    ("post_indptr", np.int64),
+    ("post_indices", np.int32),
+    ("opt_post_indptr", np.int64),
+    ("opt_post_indices", np.int32),
+    ("attrs", np.uint64),
+    ("minutes", np.int32),
+]
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def _slug(title: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_") or "recipe"
+
+
+def _names(items: Iterable) -> List[str]:
+    # Accept both [{"name": "egg"}] and ["egg"]
+    names = []
+    for item in items or []:
+        name = item.get("name") if isinstance(item, dict) else item
+        if name:
+            names.append(normalize_name(name))
+    return names
+
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as a UTF-8 blob plus an offset table.
+    Entries are decoded on access, so a memory-mapped table costs no RSS until used.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringTable":
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(offsets, b"".join(encoded))
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+class RecipeCorpus:
+    """
+    Local recipe corpus with an inverted index from ingredient to recipe rows.
+
+    Required and optional ingredients are stored CSR-style (indptr/indices
+    over interned ingredient IDs) and the inverted index is the transposed
+    CSC view, so a single pantry lookup only touches the posting lists of its
+    own ingredients. Batch lookups go through the vectorized ScoringEngine.
+
+    Each recipe also has a filter attribute mask (see filters.py) and a
+    cooking time, so filtered lookups drop excluded recipes before scoring.
+
+    The vocabulary is sorted so ingredient IDs are found by binary search,
+    which lets a memory-mapped corpus (see from_binary) serve lookups without
+    building any per-process index.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        titles: Sequence[str],
+        vocab: Sequence[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        opt_indptr: np.ndarray,
+        opt_indices: np.ndarray,
+        postings: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+        attrs: Optional[np.ndarray] = None,
+        minutes: Optional[np.ndarray] = None,
+    ):
+        self.ids = ids
+        self.titles = titles
+        self.vocab = vocab
+        self.indptr = indptr
+        self.indices = indices
+        self.opt_indptr = opt_indptr
+        self.opt_indices = opt_indices
+        self.attrs = attrs if attrs is not None else np.zeros(len(ids), dtype=np.uint64)
+        self.minutes = minutes if minutes is not None else np.zeros(len(ids), dtype=np.int32)
+        self._engine: Optional[ScoringEngine] = None
+
+        if postings is None:
+            postings = (
+                *_transpose(indptr, indices, len(vocab)),
+                *_transpose(opt_indptr, opt_indices, len(vocab)),
+            )
+        self.post_indptr, self.post_indices, self.opt_post_indptr, self.opt_post_indices = postings
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def engine(self) -> ScoringEngine:
+        # Built on first batch use only; single lookups never need the sparse matrices
+        if self._engine is None:
+            self._engine = ScoringEngine(len(self.vocab), self.indptr, self.indices, self.opt_indptr, self.opt_indices)
+        return self._engine
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "RecipeCorpus":
+        vocab_index: Dict[str, int] = {}
+        ids, titles = [], []
+        attrs, times = [], []
+        indptr, indices = [0], []
+        opt_indptr, opt_indices = [0], []
+        seen_ids = set()
+
+        def intern(name: str) -> int:
+            idx = vocab_index.get(name)
+            if idx is None:
+                idx = vocab_index[name] = len(vocab_index)
+            return idx
+
+        for record in records:
+            title = record.get("title")
+            if not title:
+                continue
+
+            recipe_id = record.get("id") or _slug(title)
+            if recipe_id in seen_ids:
+                recipe_id = f"{recipe_id}_{len(ids)}"
+            seen_ids.add(recipe_id)
+            ids.append(recipe_id)
+            titles.append(title)
+
+            required_names = _names(record.get("ingredients"))
+            attrs.append(recipe_attrs(record, required_names))
+            times.append(minutes(record.get("time_minutes")))
+
+            required = {intern(n) for n in required_names}
+            indices.extend(required)
+            indptr.append(len(indices))
+
+            optional = {intern(n) for n in _names(record.get("optional_ingredients"))} - required
+            opt_indices.extend(optional)
+            opt_indptr.append(len(opt_indices))
+
+        # Renumber ingredients in sorted order so lookups can bisect
+        vocab = sorted(vocab_index)
+        remap = np.zeros(len(vocab), dtype=np.int32)
+        for new_id, name in enumerate(vocab):
+            remap[vocab_index[name]] = new_id
+
+        return cls(
+            ids,
+            titles,
+            vocab,
+            np.asarray(indptr, dtype=np.int64),
+            remap[np.asarray(indices, dtype=np.int64)],
+            np.asarray(opt_indptr, dtype=np.int64),
+            remap[np.asarray(opt_indices, dtype=np.int64)],
+            attrs=np.asarray(attrs, dtype=np.uint64),
+            minutes=np.asarray(times, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_json(cls, path: str) -> "RecipeCorpus":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("recipes", [])
+        return cls.from_records(data)
+
+    @classmethod
+    def from_binary(cls, path: str) -> "RecipeCorpus":
+        """
+        Open a corpus compiled by build_corpus.py. Every array is a zero-copy
+        view over a shared read-only mmap, so pages are shared by all worker
+        processes and opening costs only the header parse.
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_sections = _HEADER.unpack_from(mm, 0)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION or n_sections != len(_SECTIONS):
+            raise ValueError(f"{path} is not a version {BINARY_VERSION} recipe corpus")
+
+        table = _SECTION_ENTRY.size
+        sections = {}
+        for i, (name, dtype) in enumerate(_SECTIONS):
+            offset, count = _SECTION_ENTRY.unpack_from(mm, _HEADER.size + i * table)
+            sections[name] = np.frombuffer(mm, dtype=dtype, count=count, offset=offset)
+
+        return cls(
+            StringTable(sections["id_offsets"], sections["id_blob"]),
+            StringTable(sections["title_offsets"], sections["title_blob"]),
+            StringTable(sections["vocab_offsets"], sections["vocab_blob"]),
+            sections["indptr"],
+            sections["indices"],
+            sections["opt_indptr"],
+            sections["opt_indices"],
+            postings=(
+                sections["post_indptr"],
+                sections["post_indices"],
+                sections["opt_post_indptr"],
+                sections["opt_post_indices"],
+            ),
+            attrs=sections["attrs"],
+            minutes=sections["minutes"],
+        )
+
+    def save_binary(self, path: str) -> None:
+        """
+        Write the corpus in the memory-mappable binary format read by from_binary.
+        """
+        tables = {}
+        for prefix, strings in (("id", self.ids), ("title", self.titles), ("vocab", self.vocab)):
+            table = strings if isinstance(strings, StringTable) else StringTable.from_strings(strings)
+            tables[f"{prefix}_offsets"] = table.offsets
+            tables[f"{prefix}_blob"] = np.frombuffer(bytes(table.blob), dtype=np.uint8)
+
+        arrays = {
+            **tables,
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "opt_indptr": self.opt_indptr,
+            "opt_indices": self.opt_indices,
+            "post_indptr": self.post_indptr,
+            "post_indices": self.post_indices,
+            "opt_post_indptr": self.opt_post_indptr,
+            "opt_post_indices": self.opt_post_indices,
+            "attrs": self.attrs,
+            "minutes": self.minutes,
+        }
+
+        offset = _align(_HEADER.size + len(_SECTIONS) * _SECTION_ENTRY.size)
+        entries, payloads = [], []
+        for name, dtype in _SECTIONS:
+            data = np.ascontiguousarray(arrays[name], dtype=dtype)
+            entries.append(_SECTION_ENTRY.pack(offset, data.size))
+            payloads.append((offset, data))
+            offset = _align(offset + data.nbytes)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(_SECTIONS)))
+            f.write(b"".join(entries))
+            for start, data in payloads:
+                f.write(b"\0" * (start - f.tell()))
+                f.write(data.tobytes())
+        os.replace(tmp_path, path)
+
+    def ingredient_id(self, name: str) -> Optional[int]:
+        name = normalize_name(name)
+        pos = bisect.bisect_left(self.vocab, name)
+        if pos < len(self.vocab) and self.vocab[pos] == name:
+            return pos
+        return None
+
+    def ingredient_ids(self, ingredients: Iterable[str]) -> List[int]:
+        """
+        Map pantry names to interned ingredient IDs, ignoring unknown names.
+        """
+        ids = {self.ingredient_id(i) for i in ingredients}
+        ids.discard(None)
+        return sorted(ids)
+
+    def required(self, row: int) -> np.ndarray:
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def allowed(self, rows: np.ndarray, filters: RecipeFilter) -> np.ndarray:
+        """
+        Which of `rows` pass the filters, from the precomputed attribute masks.
+        """
+        return filters.allowed(self.attrs[rows], self.minutes[rows])
+
+    def _count(self, post_indptr: np.ndarray, post_indices: np.ndarray, pantry: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        # (rows, hit counts) over the posting lists of the pantry ingredients
+        postings = np.concatenate([post_indices[post_indptr[t]:post_indptr[t + 1]] for t in pantry])
+        if postings.size == 0:
+            return postings, postings
+
+        # Dense counting is O(recipes); sorting is cheaper when the postings are short
+        if postings.size * 16 < len(self.ids):
+            return np.unique(postings, return_counts=True)
+        counts = np.bincount(postings, minlength=len(self.ids))
+        rows = np.flatnonzero(counts)
+        return rows, counts[rows]
+
+    def search(self, ingredients: List[str], k: int = 10, min_coverage: float = 0.0,
+               filters: Optional[RecipeFilter] = None) -> List[dict]:
+        """
+        Rank recipes sharing at least one required ingredient with the pantry
+        by weighted coverage and return the top k as Recipe dicts. Recipes
+        the filters exclude are dropped before scoring.
+        """
+        pantry = self.ingredient_ids(ingredients)
+        if not pantry or k <= 0:
+            return []
+
+        candidates, hits = self._count(self.post_indptr, self.post_indices, pantry)
+        if filters is not None and candidates.size:
+            keep = self.allowed(candidates, filters)
+            candidates, hits = candidates[keep], hits[keep]
+        if candidates.size == 0:
+            return []
+
+        opt_rows, opt_counts = self._count(self.opt_post_indptr, self.opt_post_indices, pantry)
+        opt_hits = np.zeros(candidates.size, dtype=np.int64)
+        if opt_rows.size:
+            pos = np.searchsorted(candidates, opt_rows)
+            found = (pos < candidates.size) & (candidates[np.minimum(pos, candidates.size - 1)] == opt_rows)
+            opt_hits[pos[found]] = opt_counts[found]
+
+        totals = self.indptr[candidates + 1] - self.indptr[candidates]
+        opt_totals = self.opt_indptr[candidates + 1] - self.opt_indptr[candidates]
+        scores = weighted_score(hits, totals, opt_hits, opt_totals)
+        scores[hits < min_coverage * totals] = -np.inf
+
+        top = top_k(scores, k)
+        return self._results(candidates[top], hits[top], totals[top], set(pantry))
+
+    def search_batch(self, pantries: Sequence[List[str]], k: int = 10, min_coverage: float = 0.0,
+                     filters: Optional[Sequence[Optional[RecipeFilter]]] = None) -> List[List[dict]]:
+        """
+        Score many pantries at once through the vectorized engine, with
+        optional per-pantry filters.
+        """
+        ids = [self.ingredient_ids(ingredients) for ingredients in pantries]
+        allow = None
+        if filters is not None and any(f is not None for f in filters):
+            allow = [None if f is None else (lambda rows, f=f: self.allowed(rows, f)) for f in filters]
+        ranked = self.engine.top_k_batch(self.engine.pantry_matrix(ids), k, min_coverage, allow)
+        return [
+            self._results(rows, hits, self.engine.totals[rows], set(pantry))
+            for pantry, (rows, hits) in zip(ids, ranked)
+        ]
+
+    def _results(self, rows: np.ndarray, hits: np.ndarray, totals: np.ndarray, pantry: set) -> List[dict]:
+        results = []
+        for row, hit, total in zip(rows.tolist(), hits.tolist(), totals.tolist()):
+            missing = [self.vocab[t] for t in self.required(row).tolist() if t not in pantry]
+            results.append({
+                "id": self.ids[row],
+                "title": self.titles[row],
+                "missing": missing,
+                "reason": f"Uses {int(hit)} of {int(total)} ingredients you already have"
+            })
+        return results
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _transpose(indptr: np.ndarray, indices: np.ndarray, n_cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    # CSR (recipe -> ingredients) to CSC (ingredient -> recipes)
+    rows = np.repeat(np.arange(indptr.size - 1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    post_indptr = np.zeros(n_cols + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=n_cols), out=post_indptr[1:])
+    return post_indptr, rows[order]
+
+
+def load_corpus(path: str = CORPUS_PATH) -> Optional[RecipeCorpus]:
+    """
+    Load the configured corpus, or return None if it is disabled or unreadable.
+    """
+    if CORPUS_MODE == "off" or not path:
+        return None
+
+    started = time.perf_counter()
+    try:
+        if path.endswith(".json"):
+            corpus = RecipeCorpus.from_json(path)
+        else:
+            corpus = RecipeCorpus.from_binary(path)
+    except Exception as e:
+        print(f"Recipe corpus unavailable ({path}): {str(e)}")
+        return None
+
+    print(f"Loaded {len(corpus)} recipes from {path} in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return corpus
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from breaker import get_health, tracked_call
+from metrics import client_disconnects, provider_retries
+
+# --------------------------------
+# Request budget settings
+# --------------------------------
+# Every request gets a time budget: the remaining milliseconds sent in the
+# DEADLINE_HEADER (capped at MAX_REQUEST_DEADLINE), or REQUEST_DEADLINE
+# seconds. Provider timeouts, admission waits and the provider race are all
+# cut to what is left of it, so no call outlives the caller's patience.
+REQUEST_DEADLINE = float(os.getenv("AGENT_REQUEST_DEADLINE", "12"))
+MAX_REQUEST_DEADLINE = float(os.getenv("AGENT_MAX_REQUEST_DEADLINE", "30"))
+DEADLINE_HEADER = os.getenv("AGENT_DEADLINE_HEADER", "x-request-deadline-ms").lower().encode("latin-1")
+
+# When the client goes away the request is cancelled, which cancels its
+# provider calls unless another request is waiting on the same result.
+CANCEL_ON_DISCONNECT = os.getenv("AGENT_CANCEL_ON_DISCONNECT", "on") == "on"
+
+# A failed provider call is retried up to PROVIDER_RETRIES times after a
+# full-jitter backoff (uniform over 0..RETRY_BACKOFF * 2^attempt, capped at
+# RETRY_BACKOFF_MAX), but only while the budget still covers the backoff plus
+# the provider's typical latency.
+PROVIDER_RETRIES = int(os.getenv("AGENT_PROVIDER_RETRIES", "1"))
+RETRY_BACKOFF = float(os.getenv("AGENT_RETRY_BACKOFF", "0.25"))
+RETRY_BACKOFF_MAX = float(os.getenv("AGENT_RETRY_BACKOFF_MAX", "2.0"))
+
+# Absolute time.monotonic() deadline of the current request, None outside one
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> float:
+    """
+    Seconds left in the current request's budget. Work outside a request
+    (prefetch, warm-up) gets the default budget from now.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return REQUEST_DEADLINE
+    return max(0.0, deadline - time.monotonic())
+
+
+def timeout_for(limit: float) -> float:
+    """
+    A provider timeout: the configured limit, cut to the remaining budget.
+    """
+    return max(0.001, min(limit, remaining()))
+
+
+def start_budget(seconds: Optional[float] = None):
+    """
+    Start a budget for the current context (the default when None).
+    Returns a token for reset_budget.
+    """
+    return _deadline.set(time.monotonic() + (REQUEST_DEADLINE if seconds is None else seconds))
+
+
+def reset_budget(token) -> None:
+    _deadline.reset(token)
+
+
+def clear_budget() -> None:
+    # Background work spawned from a request should not inherit its budget
+    _deadline.set(None)
+
+
+def parse_budget(value: Optional[bytes]) -> float:
+    if value:
+        try:
+            budget = float(value) / 1000
+        except ValueError:
+            budget = None
+        if budget is not None and budget == budget:
+            return min(max(budget, 0.0), MAX_REQUEST_DEADLINE)
+    return REQUEST_DEADLINE
+
+
+# --------------------------------
+# Budgeted retries
+# --------------------------------
+async def call_with_retries(name: str, fn: Callable[..., Awaitable[Optional[Any]]], *args, **kwargs) -> Optional[Any]:
+    """
+    tracked_call with bounded, jittered retries on failure. A retry is skipped
+    when the circuit has opened or the budget cannot fit another attempt.
+    """
+    health = get_health(name)
+    attempt = 0
+    while True:
+        result = await tracked_call(name, fn, *args, **kwargs)
+        if result is not None or attempt >= PROVIDER_RETRIES:
+            return result
+
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+        if remaining() < delay + (health.ewma_latency or 0.0) or not health.available():
+            return result
+
+        attempt += 1
+        provider_retries.inc(name)
+        print(f"Retrying {name} in {delay:.2f}s (attempt {attempt + 1})")
+        await asyncio.sleep(delay)
+
+
+# --------------------------------
+# ASGI middleware
+# --------------------------------
+class DeadlineMiddleware:
+    """
+    Starts each HTTP request's budget from the deadline header and cancels
+    the request when the client disconnects before the response is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = REQUEST_DEADLINE
+        for name, value in scope["headers"]:
+            if name == DEADLINE_HEADER:
+                budget = parse_budget(value)
+                break
+
+        token = start_budget(budget)
+        try:
+            if CANCEL_ON_DISCONNECT:
+                await self._cancellable(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            reset_budget(token)
+
+    async def _cancellable(self, scope, receive, send):
+        # The watcher owns the server's receive channel and relays messages to
+        # the app, so it sees a disconnect even while the app is not reading.
+        messages: asyncio.Queue = asyncio.Queue()
+        task = asyncio.current_task()
+        state = {"complete": False, "disconnected": False}
+
+        async def watch():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not state["complete"]:
+                        state["disconnected"] = True
+                        client_disconnects.inc()
+                        task.cancel()
+                    return
+
+        async def relay_receive():
+            return await messages.get()
+
+        async def tracked_send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await self.app(scope, relay_receive, tracked_send)
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                raise
+            # Nobody is left to answer; the server expects no response
+            task.uncancel()
+        finally:
+            watcher.cancel()
@@ -0,0 +1,70 @@
+import json
+from typing import Type, TypeVar, Union
+
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+
+from metrics import timed
+
+M = TypeVar("M", bound=BaseModel)
+
+_decoder = json.JSONDecoder()
+
+
+def decode_model_output(text: Union[str, bytes], model: Type[M]) -> M:
+    """
+    Validate model output straight into a response model in one pass.
+
+    Models sometimes wrap the JSON in chatter, so the payload is taken from the
+    first '{' to the last '}' (one forward and one backward scan) and handed to
+    pydantic's JSON validator, which parses and validates without building an
+    intermediate dict. Only if that span is not a single JSON value (e.g.
+    trailing chatter contains a brace) is the first object located exactly.
+    Raises ValueError when no usable object is found.
+
+    Timed as the "extract", "validate" and (fallback only) "parse" stages;
+    the single-pass path parses while validating, so it is all "validate".
+    """
+    with timed("extract"):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="replace")
+
+        start = text.find('{')
+        end = text.rfind('}') + 1
+    if start == -1 or end <= start:
+        raise ValueError("Model did not return valid JSON")
+
+    try:
+        with timed("validate"):
+            return model.model_validate_json(text[start:end])
+    except ValidationError as e:
+        if not any(err["type"] == "json_invalid" for err in e.errors()):
+            raise ValueError(f"Model response failed validation: {e.error_count()} errors") from None
+
+    try:
+        with timed("parse"):
+            obj, _ = _decoder.raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to parse model response as JSON: {str(e)}") from None
+
+    try:
+        with timed("validate"):
+            return model.model_validate(obj)
+    except ValidationError as e:
+        raise ValueError(f"Model response failed validation: {e.error_count()} errors") from None
+
+
+class ModelResponse(Response):
+    """
+    JSON response serialized by pydantic-core directly from a model.
+
+    Returning a Response from an endpoint skips FastAPI's second validation
+    and jsonable_encoder pass over the response_model.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json().encode("utf-8")
+        return super().render(content)
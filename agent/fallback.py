@@ -0,0 +1,332 @@
+import json
+import os
+import time
+from string import Formatter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from filters import DIET_MASK, RecipeFilter, ingredient_attrs, minutes, name_attrs, recipe_attrs
+
+# --------------------------------
+# Fallback rule settings
+# --------------------------------
+# The rule table is re-read when its modification time changes, checked at
+# most every AGENT_FALLBACK_RULES_CHECK seconds (0 disables the check).
+FALLBACK_RULES_PATH = os.getenv(
+    "AGENT_FALLBACK_RULES", os.path.join(os.path.dirname(__file__), "fallback_rules.json")
+)
+FALLBACK_RULES_CHECK = float(os.getenv("AGENT_FALLBACK_RULES_CHECK", "5"))
+
+TEMPLATE_FIELDS = {"match", "ingredients"}
+LOOKUP_MEMO_SIZE = 4096
+
+# (id, title template, missing, reason, filter attribute mask, minutes)
+Template = Tuple[str, str, Tuple[str, ...], str, int, int]
+# (steps, tips, extras as (name, required)) templates for one recipe
+DetailTemplate = Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[Tuple[str, bool], ...]]
+
+
+def singular(word: str) -> str:
+    """
+    Cheap English singularization, applied to both keywords and user input so
+    "eggs"/"egg" and "tomatoes"/"tomato" meet at the same index key.
+    """
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_keyword(text: str) -> str:
+    words = text.lower().split()
+    if not words:
+        return ""
+    words[-1] = singular(words[-1])
+    return " ".join(words)
+
+
+def _check_placeholders(text: str, where: str) -> str:
+    fields = {field for _, field, _, _ in Formatter().parse(text) if field is not None}
+    unknown = fields - TEMPLATE_FIELDS
+    if unknown:
+        raise ValueError(f"{where}: unknown placeholder(s) {sorted(unknown)} in {text!r}")
+    return text
+
+
+def _compile_templates(recipes: List[dict], where: str) -> List[Template]:
+    templates = []
+    for recipe in recipes:
+        _check_placeholders(recipe["title"], where)
+        missing = tuple(recipe.get("missing", []))
+        # Diets come from what the template adds; pantry items that break a
+        # requested diet are left out of the dish per request
+        required = [e["name"] for e in recipe.get("detail", {}).get("extras", []) if e.get("required")]
+        templates.append((
+            recipe["id"], recipe["title"], missing, recipe.get("reason", ""),
+            recipe_attrs(recipe, missing + tuple(required)), minutes(recipe.get("time_minutes")),
+        ))
+    return templates
+
+
+def _compile_detail(detail: dict, where: str) -> DetailTemplate:
+    steps = tuple(_check_placeholders(step, where) for step in detail.get("steps", []))
+    if not steps:
+        raise ValueError(f"{where}: detail has no steps")
+    tips = tuple(_check_placeholders(tip, where) for tip in detail.get("tips", []))
+    extras = tuple((extra["name"], bool(extra.get("required", False))) for extra in detail.get("extras", []))
+    return steps, tips, extras
+
+
+class FallbackRules:
+    """
+    A compiled rule table: keyword -> rule index hash map plus pre-parsed
+    recipe templates, so generating recipes is one pass over the pantry.
+    """
+
+    def __init__(self, rules: List[Tuple[str, List[Template]]], default: List[Template],
+                 index: Dict[str, Tuple[int, ...]], max_recipes: int,
+                 details: Optional[Dict[str, Tuple[Optional[int], Template, DetailTemplate]]] = None,
+                 generic_detail: Optional[DetailTemplate] = None):
+        self.rules = rules
+        self.default = default
+        self.index = index
+        self.max_recipes = max_recipes
+        # Recipe id -> (owning rule or None for defaults, template, detail)
+        self.details = details or {}
+        self.generic_detail = generic_detail
+        # Raw ingredient string -> triggered rules, so repeat pantry items
+        # skip normalization; dropped along with the table on reload
+        self._memo: Dict[str, Tuple[int, ...]] = {}
+
+    @classmethod
+    def compile(cls, data: dict) -> "FallbackRules":
+        """
+        Build the index from a rule table. Keywords and aliases are
+        normalized (lowercase, singular head word); an alias maps to every
+        rule its target keyword belongs to. Raises ValueError on a bad table.
+        """
+        rules = []
+        index: Dict[str, List[int]] = {}
+        details: Dict[str, Tuple[Optional[int], Template, DetailTemplate]] = {}
+
+        def add_details(recipes: List[dict], templates: List[Template], owner: Optional[int], where: str) -> None:
+            for recipe, template in zip(recipes, templates):
+                if "detail" not in recipe:
+                    continue
+                if template[0] in details:
+                    raise ValueError(f"{where}: duplicate recipe id {template[0]!r}")
+                details[template[0]] = (owner, template, _compile_detail(recipe["detail"], template[0]))
+
+        for position, rule in enumerate(data.get("rules", [])):
+            name = rule.get("name", f"rule {position}")
+            templates = _compile_templates(rule["recipes"], name)
+            rules.append((name, templates))
+            add_details(rule["recipes"], templates, position, name)
+            for keyword in rule["keywords"]:
+                ids = index.setdefault(normalize_keyword(keyword), [])
+                if position not in ids:
+                    ids.append(position)
+
+        for alias, target in data.get("aliases", {}).items():
+            ids = index.get(normalize_keyword(target))
+            if ids is None:
+                raise ValueError(f"Alias {alias!r} points at unknown keyword {target!r}")
+            merged = index.setdefault(normalize_keyword(alias), [])
+            merged.extend(i for i in ids if i not in merged)
+
+        default = _compile_templates(data.get("default", []), "default")
+        add_details(data.get("default", []), default, None, "default")
+        generic = data.get("generic_detail")
+        return cls(rules, default, {k: tuple(sorted(v)) for k, v in index.items()},
+                   int(data.get("max_recipes", 10)), details,
+                   _compile_detail(generic, "generic_detail") if generic else None)
+
+    def lookup(self, ingredient: str) -> Tuple[int, ...]:
+        """
+        Rules triggered by one ingredient: the whole name first, then its head
+        word, so "green bell peppers" still reaches the pepper rules.
+        """
+        rules = self._memo.get(ingredient)
+        if rules is not None:
+            return rules
+
+        key = normalize_keyword(ingredient)
+        rules = self.index.get(key)
+        if rules is None and " " in key:
+            rules = self.index.get(key.rsplit(" ", 1)[1])
+
+        if len(self._memo) >= LOOKUP_MEMO_SIZE:
+            self._memo.clear()
+        rules = self._memo[ingredient] = rules or ()
+        return rules
+
+    def generate(self, ingredients: List[str], filters: Optional[RecipeFilter] = None) -> List[dict]:
+        label = None
+        if filters is not None and filters.diet_bits:
+            # Pantry items the requested diet rules out (the chicken, under
+            # "vegetarian") are left out: they neither trigger rules nor
+            # appear in titles, so the rest of the pantry still gets recipes
+            usable = [i for i in ingredients if name_attrs(i) & filters.diet_bits == filters.diet_bits]
+            if not usable:
+                label = " ".join(d.replace("_", " ") for d in filters.diets).title()
+            ingredients = usable
+
+        # First user ingredient to trigger each rule fills its {match} slot
+        matched: Dict[int, str] = {}
+        for ingredient in ingredients:
+            for rule in self.lookup(ingredient):
+                if rule not in matched:
+                    matched[rule] = ingredient
+
+        label = label or ", ".join(ingredients[:3]).title()
+        first = ingredients[0].title() if ingredients else label
+        if matched:
+            groups = [(self.rules[rule][1], matched[rule].title()) for rule in sorted(matched)]
+        else:
+            groups = [(self.default, first)]
+
+        if filters is not None:
+            # Diets are the template's own (the pantry left in fits the
+            # filter); the pantry still makes a dish "seafood"
+            extra = ingredient_attrs(ingredients) & ~DIET_MASK
+
+            def allowed(templates: List[Template]) -> List[Template]:
+                return [t for t in templates if filters.allows(t[4] | extra, t[5])]
+
+            groups = [(allowed(templates), match) for templates, match in groups]
+            if matched and not any(templates for templates, _ in groups):
+                groups = [(allowed(self.default), first)]
+
+        recipes = []
+        for templates, match in groups:
+            for recipe_id, title, missing, reason, _, _ in templates:
+                if len(recipes) >= self.max_recipes:
+                    return recipes
+                recipes.append({
+                    "id": recipe_id,
+                    "title": title.format(match=match, ingredients=label),
+                    "missing": list(missing),
+                    "reason": reason,
+                })
+        return recipes
+
+    def detail(self, recipe_id: str, ingredients: List[str], generic: bool = False) -> Optional[dict]:
+        """
+        Render the detail template of a rule recipe for this pantry, or None
+        for an id the table does not know. With `generic`, unknown ids get the
+        generic method instead, titled from the id.
+        """
+        entry = self.details.get(recipe_id)
+        if entry is None:
+            if not generic or self.generic_detail is None:
+                return None
+            title = recipe_id.replace("_", " ").strip().title() or "Recipe"
+            owner, missing, (steps, tips, extras) = None, (), self.generic_detail
+            match = ingredients[0] if ingredients else ""
+        else:
+            owner, (_, title, missing, *_), (steps, tips, extras) = entry
+            # Same {match} the recipe list used: first ingredient to trigger the rule
+            match = next((i for i in ingredients if owner in self.lookup(i)), None) if owner is not None else None
+            if match is None:
+                match = ingredients[0] if ingredients else ""
+            title = title.format(match=match.title(), ingredients=", ".join(ingredients[:3]).title())
+
+        fields = {"match": match.lower(), "ingredients": ", ".join(ingredients).lower() or "ingredients"}
+        have = {normalize_keyword(i) for i in ingredients}
+        items = [{"name": i, "required": True} for i in ingredients]
+        items += [{"name": m, "required": True} for m in missing if normalize_keyword(m) not in have]
+        items += [{"name": n, "required": r} for n, r in extras if normalize_keyword(n) not in have]
+        return {
+            "title": title,
+            "ingredients": items,
+            "steps": [step.format(**fields) for step in steps],
+            "tips": [tip.format(**fields) for tip in tips],
+        }
+
+
+class FallbackEngine:
+    """
+    Serves the compiled rule table and swaps in a new one when the rule file
+    changes on disk. A file that fails to load or compile is reported and the
+    previous rules stay in service.
+    """
+
+    def __init__(self, path: str, check_interval: float = FALLBACK_RULES_CHECK):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self.reload_errors = 0
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.rules = self._load()
+
+    def _load(self) -> FallbackRules:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "r", encoding="utf-8") as f:
+            rules = FallbackRules.compile(json.load(f))
+        self._mtime = mtime
+        return rules
+
+    def reload(self) -> bool:
+        """
+        Re-read the rule file now. Returns whether the new rules were installed.
+        """
+        try:
+            rules = self._load()
+        except Exception as e:
+            self.reload_errors += 1
+            print(f"Fallback rules not reloaded ({self.path}): {str(e)}")
+            return False
+        self.rules = rules
+        self.reloads += 1
+        print(f"Reloaded {len(rules.rules)} fallback rules from {self.path}")
+        return True
+
+    def maybe_reload(self) -> None:
+        if self.check_interval <= 0:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            changed = os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            return
+        if changed:
+            self.reload()
+
+    def generate(self, ingredients: Iterable[str], filters: Optional[RecipeFilter] = None) -> List[dict]:
+        self.maybe_reload()
+        return self.rules.generate(list(ingredients), filters)
+
+    def detail(self, recipe_id: str, ingredients: Iterable[str], generic: bool = False) -> Optional[dict]:
+        self.maybe_reload()
+        return self.rules.detail(recipe_id, list(ingredients), generic)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "rules": len(self.rules.rules),
+            "keywords": len(self.rules.index),
+            "details": len(self.rules.details),
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+        }
+
+
+fallback_engine = FallbackEngine(FALLBACK_RULES_PATH)
+
+
+def generate_fallback_recipes(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> List[dict]:
+    """Generate diverse recipes programmatically when AI is unavailable"""
+    return fallback_engine.generate(ingredients, filters)
+
+
+def local_recipe_details(recipe_id: str, ingredients: List[str], generic: bool = False) -> Optional[dict]:
+    """Recipe details rendered from the rule table, or None for an unknown id"""
+    return fallback_engine.detail(recipe_id, ingredients, generic)
@@ -0,0 +1,345 @@
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# --------------------------------
+# Filter vocabulary
+# --------------------------------
+# Every recipe attribute is one bit of a uint64 mask: diets in bits 0-15,
+# cuisines in 16-47, meal types in 48-63. Corpus recipes and fallback
+# templates carry a precomputed mask (plus a time in minutes, 0 if unknown),
+# so a filter is a couple of AND/compare operations per recipe.
+DIETS = ("vegetarian", "vegan", "pescatarian", "gluten_free", "dairy_free", "nut_free", "keto", "low_carb")
+CUISINES = (
+    "american", "asian", "chinese", "french", "greek", "indian", "italian", "japanese",
+    "korean", "mediterranean", "mexican", "middle_eastern", "seafood", "spanish", "thai", "vietnamese",
+)
+MEAL_TYPES = ("breakfast", "lunch", "dinner", "snack", "dessert")
+
+DIET_BITS = {name: 1 << i for i, name in enumerate(DIETS)}
+CUISINE_BITS = {name: 1 << (16 + i) for i, name in enumerate(CUISINES)}
+MEAL_BITS = {name: 1 << (48 + i) for i, name in enumerate(MEAL_TYPES)}
+DIET_MASK = sum(DIET_BITS.values())
+
+# Umbrella cuisines also accept the cuisines under them
+CUISINE_GROUPS = {
+    "asian": ("chinese", "indian", "japanese", "korean", "thai", "vietnamese"),
+    "mediterranean": ("greek", "middle_eastern", "spanish"),
+}
+
+_ALIASES = {
+    "pescetarian": "pescatarian",
+    "ketogenic": "keto",
+    "glutenfree": "gluten_free",
+    "middle_east": "middle_eastern",
+    "breakfasts": "breakfast",
+    "lunches": "lunch",
+    "dinners": "dinner",
+    "snacks": "snack",
+    "desserts": "dessert",
+}
+
+
+def canonical(value: str) -> str:
+    """
+    "Gluten-Free", "gluten free" and "gluten_free" all become "gluten_free".
+    """
+    name = re.sub(r"[\s\-]+", "_", value.strip().lower())
+    return _ALIASES.get(name, name)
+
+
+def _values(value: Union[None, str, Sequence[str]]) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [canonical(v) for v in value if isinstance(v, str) and v.strip()]
+
+
+def to_bits(values: Union[None, str, Sequence[str]], table: Dict[str, int]) -> int:
+    """
+    OR of the bits of the known names in `values`; unknown names are ignored.
+    """
+    bits = 0
+    for name in _values(values):
+        bits |= table.get(name, 0)
+    return bits
+
+
+def minutes(value) -> int:
+    """
+    A cooking time in whole minutes from 25, "25" or "25 min", 0 if unknown.
+    """
+    if isinstance(value, bool) or value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return max(0, int(round(value)))
+    match = re.match(r"\s*(\d+(?:\.\d+)?)", str(value))
+    return int(round(float(match.group(1)))) if match else 0
+
+
+# --------------------------------
+# Diets from ingredient names
+# --------------------------------
+# Ingredient words that rule a diet out. A name is checked whole first (so
+# "peanut butter" is a nut, not dairy), then word by word in singular form.
+_GROUP_WORDS = {
+    "meat": "chicken beef pork turkey lamb veal duck goose venison bacon ham sausage steak mince meat "
+            "meatball salami pepperoni prosciutto pancetta chorizo brisket rib lard gelatin",
+    "fish": "fish salmon tuna cod shrimp prawn crab lobster scallop clam mussel oyster anchovy sardine "
+            "tilapia haddock trout halibut squid calamari octopus mackerel seafood",
+    "dairy": "milk cheese butter cream yogurt yoghurt ghee parmesan mozzarella cheddar feta ricotta "
+             "brie gouda mascarpone whey buttermilk",
+    "egg": "egg mayo mayonnaise meringue",
+    "honey": "honey",
+    "gluten": "bread flour pasta noodle spaghetti linguine penne macaroni fettuccine couscous barley rye "
+              "wheat breadcrumb cracker tortilla dough pizza bagel baguette pita sourdough croissant bun "
+              "cake cookie biscuit ramen udon seitan beer panko toast pastry",
+    "nut": "nut almond walnut pecan cashew pistachio hazelnut peanut macadamia",
+    "carb": "rice pasta noodle spaghetti linguine penne macaroni fettuccine bread flour potato sugar oat "
+            "corn quinoa couscous tortilla barley dough pizza bagel baguette pita toast breadcrumb "
+            "cracker honey syrup lentil bean chickpea ramen udon cake cookie",
+}
+_WORD_GROUPS: Dict[str, Tuple[str, ...]] = {}
+for group, words in _GROUP_WORDS.items():
+    for word in words.split():
+        _WORD_GROUPS[word] = _WORD_GROUPS.get(word, ()) + (group,)
+
+_NAME_GROUPS = {
+    "peanut butter": ("nut",),
+    "almond butter": ("nut",),
+    "almond milk": ("nut",),
+    "cashew milk": ("nut",),
+    "coconut milk": (),
+    "coconut cream": (),
+    "oat milk": (),
+    "soy milk": (),
+    "rice milk": ("carb",),
+    "cocoa butter": (),
+    "cream of tartar": (),
+    "soy sauce": ("gluten",),
+    "corn tortilla": ("carb",),
+    "rice noodle": ("carb",),
+    "rice paper": ("carb",),
+}
+
+# Qualifiers that cancel groups: "vegan cheese", "gluten-free pasta"
+_QUALIFIERS = {
+    "vegan": ("meat", "fish", "dairy", "egg", "honey"),
+    "plant": ("meat", "fish", "dairy", "egg"),
+    "gluten_free": ("gluten",),
+    "dairy_free": ("dairy",),
+}
+
+_BREAKS = {
+    "meat": ("vegetarian", "vegan", "pescatarian"),
+    "fish": ("vegetarian", "vegan"),
+    "dairy": ("vegan", "dairy_free"),
+    "egg": ("vegan",),
+    "honey": ("vegan",),
+    "gluten": ("gluten_free",),
+    "nut": ("nut_free",),
+    "carb": ("keto", "low_carb"),
+}
+_BREAK_BITS = {group: sum(DIET_BITS[d] for d in diets) for group, diets in _BREAKS.items()}
+
+NAME_MEMO_SIZE = 4096
+_name_memo: Dict[str, int] = {}
+
+
+def _singulars(word: str) -> Tuple[str, ...]:
+    forms = (word,)
+    if len(word) > 3 and word.endswith("ies"):
+        forms += (word[:-3] + "y",)
+    if len(word) > 3 and word.endswith("es"):
+        forms += (word[:-2],)
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        forms += (word[:-1],)
+    return forms
+
+
+def _groups(name: str) -> Tuple[str, ...]:
+    text = " ".join(re.sub(r"[^a-z]+", " ", name.lower()).split())
+    qualified = text.replace("gluten free", "gluten_free").replace("dairy free", "dairy_free")
+    words = qualified.split()
+    singular = " ".join(w[:-1] if w.endswith("s") and not w.endswith("ss") else w for w in words)
+    for key in (text, singular):
+        if key in _NAME_GROUPS:
+            return _NAME_GROUPS[key]
+
+    groups = set()
+    for word in words:
+        for form in _singulars(word):
+            if form in _WORD_GROUPS:
+                groups.update(_WORD_GROUPS[form])
+                break
+    for word in words:
+        groups.difference_update(_QUALIFIERS.get(word, ()))
+    return tuple(groups)
+
+
+def name_attrs(name: str) -> int:
+    """
+    Attribute bits one ingredient allows: every diet it does not rule out,
+    plus "seafood" for fish and shellfish.
+    """
+    attrs = _name_memo.get(name)
+    if attrs is None:
+        groups = _groups(name)
+        attrs = DIET_MASK
+        for group in groups:
+            attrs &= ~_BREAK_BITS[group]
+        if "fish" in groups:
+            attrs |= CUISINE_BITS["seafood"]
+        if len(_name_memo) >= NAME_MEMO_SIZE:
+            _name_memo.clear()
+        _name_memo[name] = attrs
+    return attrs
+
+
+def ingredient_attrs(names: Iterable[str]) -> int:
+    """
+    Attribute bits of a dish made from these ingredients: the diets none of
+    them rules out, plus "seafood" if any of them is fish or shellfish.
+    """
+    diets, other = DIET_MASK, 0
+    for name in names:
+        attrs = name_attrs(name)
+        diets &= attrs
+        other |= attrs & ~DIET_MASK
+    return diets | other
+
+
+def recipe_attrs(record: dict, ingredients: Iterable[str] = ()) -> int:
+    """
+    Attribute mask of a recipe record with optional "diet", "cuisine" and
+    "meal_type" fields (a name or a list). Without "diet", diets are derived
+    from `ingredients`; fish in them always adds "seafood".
+    """
+    derived = ingredient_attrs(ingredients)
+    diets = to_bits(record.get("diet"), DIET_BITS) if "diet" in record else derived & DIET_MASK
+    return (
+        diets
+        | (derived & ~DIET_MASK)
+        | to_bits(record.get("cuisine"), CUISINE_BITS)
+        | to_bits(record.get("meal_type"), MEAL_BITS)
+    )
+
+
+# --------------------------------
+# Compiled filters
+# --------------------------------
+class RecipeFilter:
+    """
+    A request's filters as bitmasks: a recipe passes when it has every
+    requested diet bit, at least one requested cuisine bit and meal-type bit
+    (when any are requested), and a known time within max_time. Recipes that
+    do not declare an attribute a filter asks about do not pass.
+    """
+
+    def __init__(self, diets: Sequence[str], cuisines: Sequence[str], meal_types: Sequence[str],
+                 max_time: Optional[int]):
+        self.diets = tuple(sorted(set(diets), key=DIETS.index))
+        self.cuisines = tuple(sorted(set(cuisines), key=CUISINES.index))
+        self.meal_types = tuple(sorted(set(meal_types), key=MEAL_TYPES.index))
+        self.max_time = max_time or None
+
+        self.diet_bits = to_bits(self.diets, DIET_BITS)
+        expanded = [c for name in self.cuisines for c in (name,) + CUISINE_GROUPS.get(name, ())]
+        self.cuisine_bits = to_bits(expanded, CUISINE_BITS)
+        self.meal_bits = to_bits(self.meal_types, MEAL_BITS)
+
+    @property
+    def key(self) -> str:
+        """
+        Canonical signature, used to keep filtered results apart in caches.
+        """
+        parts = [
+            f"{label}={','.join(names)}"
+            for label, names in (("diet", self.diets), ("cuisine", self.cuisines), ("meal", self.meal_types))
+            if names
+        ]
+        if self.max_time:
+            parts.append(f"time={self.max_time}")
+        return ";".join(parts)
+
+    @property
+    def spec(self) -> dict:
+        """
+        Request values that compile_filter turns back into this filter.
+        """
+        return {"diet": list(self.diets), "cuisine": list(self.cuisines),
+                "meal_type": list(self.meal_types), "max_time": self.max_time}
+
+    def allows(self, attrs: int, time: int) -> bool:
+        return (
+            attrs & self.diet_bits == self.diet_bits
+            and (not self.cuisine_bits or attrs & self.cuisine_bits)
+            and (not self.meal_bits or attrs & self.meal_bits)
+            and (not self.max_time or 0 < time <= self.max_time)
+        )
+
+    def allowed(self, attrs: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """
+        Vectorized allows() over per-recipe mask and time arrays.
+        """
+        keep = (attrs & np.uint64(self.diet_bits)) == np.uint64(self.diet_bits)
+        if self.cuisine_bits:
+            keep &= (attrs & np.uint64(self.cuisine_bits)) != 0
+        if self.meal_bits:
+            keep &= (attrs & np.uint64(self.meal_bits)) != 0
+        if self.max_time:
+            keep &= (times > 0) & (times <= self.max_time)
+        return keep
+
+    def describe(self) -> str:
+        """
+        The filters as one prompt sentence.
+        """
+        parts = []
+        if self.diets:
+            parts.append(" and ".join(d.replace("_", " ") for d in self.diets))
+        if self.cuisines:
+            parts.append(" or ".join(c.replace("_", " ").title() for c in self.cuisines) + " cuisine")
+        if self.meal_types:
+            parts.append("suitable for " + " or ".join(self.meal_types))
+        if self.max_time:
+            parts.append(f"ready in {self.max_time} minutes or less")
+        return f"Every recipe must be {', '.join(parts)}."
+
+    def check(self, title: str, missing: Iterable[str], cuisine=None, meal_type=None, time=None) -> bool:
+        """
+        Cheap check of a generated recipe. Diets are derived from the title
+        and missing ingredients; cuisine, meal type and time are checked when
+        the model declared them (it is asked to).
+        """
+        if self.diet_bits:
+            diets = ingredient_attrs([title, *missing])
+            if diets & self.diet_bits != self.diet_bits:
+                return False
+        if self.cuisine_bits and cuisine is not None and not to_bits(cuisine, CUISINE_BITS) & self.cuisine_bits:
+            return False
+        if self.meal_bits and meal_type is not None and not to_bits(meal_type, MEAL_BITS) & self.meal_bits:
+            return False
+        if self.max_time and time is not None and minutes(time) > self.max_time:
+            return False
+        return True
+
+
+def compile_filter(diet: Sequence[str] = (), cuisine: Sequence[str] = (), meal_type: Sequence[str] = (),
+                   max_time: Optional[int] = None) -> Optional[RecipeFilter]:
+    """
+    Build a filter from request values, or None when nothing is filtered.
+    Raises ValueError naming any value outside the vocabulary.
+    """
+    values = {"diet": _values(diet), "cuisine": _values(cuisine), "meal_type": _values(meal_type)}
+    for field, known in (("diet", DIET_BITS), ("cuisine", CUISINE_BITS), ("meal_type", MEAL_BITS)):
+        unknown = [v for v in values[field] if v not in known]
+        if unknown:
+            raise ValueError(f"Unknown {field} filter value(s) {unknown}; expected one of {sorted(known)}")
+    if max_time is not None and max_time <= 0:
+        raise ValueError("max_time must be a positive number of minutes")
+    if not any(values.values()) and not max_time:
+        return None
+    return RecipeFilter(values["diet"], values["cuisine"], values["meal_type"], max_time)
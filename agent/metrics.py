@@ -0,0 +1,330 @@
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# --------------------------------
+# Metrics settings
+# --------------------------------
+# Server-Timing headers expose per-stage timings to the browser dev tools;
+# they are off by default because they reveal backend detail to clients.
+SERVER_TIMING = os.getenv("AGENT_SERVER_TIMING", "off").lower() in ("1", "on", "true", "yes")
+
+# Seconds. Stages range from microseconds (prompt build, validation) to
+# provider calls of several seconds.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values: str) -> float:
+        return self._values.get(values, 0)
+
+    def samples(self) -> Iterator[str]:
+        for values, total in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(total)}"
+
+
+class Gauge(Counter):
+    """
+    Point-in-time value, set when /metrics is scraped.
+    """
+
+    kind = "gauge"
+
+    def set(self, *values: str, value: float) -> None:
+        self._values[values] = value
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus layout.
+
+    Observations only bump one bucket slot plus the sum and count; buckets
+    are accumulated when rendering, so recording stays O(log buckets).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *values: str) -> None:
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *values: str) -> int:
+        series = self._series.get(values)
+        return series[2] if series else 0
+
+    def samples(self) -> Iterator[str]:
+        bounds = self.buckets + (float("inf"),)
+        for values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, hits in zip(bounds, counts):
+                cumulative += hits
+                le = _format_labels(self.labels, values, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every registered metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --------------------------------
+# Agent metrics
+# --------------------------------
+stage_seconds = registry.register(Histogram(
+    "agent_stage_duration_seconds",
+    "Time spent in each request handling stage",
+    ("stage", "provider"),
+))
+request_seconds = registry.register(Histogram(
+    "agent_request_duration_seconds",
+    "End-to-end request latency by route",
+    ("path",),
+))
+provider_calls = registry.register(Counter(
+    "agent_provider_calls_total",
+    "Provider calls by outcome (success, failure, error, cancelled, skipped)",
+    ("provider", "outcome"),
+))
+provider_rejections = registry.register(Counter(
+    "agent_provider_rejected_total",
+    "Provider responses that arrived but failed extraction or validation",
+    ("provider",),
+))
+fallbacks = registry.register(Counter(
+    "agent_fallback_total",
+    "Responses served by the programmatic fallback generator",
+    ("endpoint",),
+))
+tokens = registry.register(Counter(
+    "agent_provider_tokens_total",
+    "Token usage reported by providers",
+    ("provider", "kind"),
+))
+cache_events = registry.register(Gauge(
+    "agent_cache_events",
+    "Cache hits, misses and evictions since startup",
+    ("cache", "event"),
+))
+cache_size = registry.register(Gauge(
+    "agent_cache_entries",
+    "Entries currently held in each cache",
+    ("cache",),
+))
+shed_total = registry.register(Counter(
+    "agent_shed_total",
+    "Provider calls shed by admission control",
+    ("provider", "reason"),
+))
+rate_limited = registry.register(Counter(
+    "agent_rate_limited_total",
+    "Requests rejected by the per-client rate limit",
+))
+provider_retries = registry.register(Counter(
+    "agent_provider_retries_total",
+    "Provider calls retried after a failure",
+    ("provider",),
+))
+client_disconnects = registry.register(Counter(
+    "agent_client_disconnects_total",
+    "Requests cancelled because the client disconnected",
+))
+provider_queue = registry.register(Gauge(
+    "agent_provider_queue",
+    "Provider calls in flight and waiting for a slot",
+    ("provider", "state"),
+))
+similarity_scores = registry.register(Histogram(
+    "agent_similarity_best_score",
+    "Best Jaccard similarity found by each similarity-cache lookup",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0),
+))
+filter_rejections = registry.register(Counter(
+    "agent_filter_rejected_recipes_total",
+    "Generated recipes dropped because they failed the request's filters",
+))
+batch_size = registry.register(Histogram(
+    "agent_batch_size",
+    "Requests combined into each micro-batched provider call",
+    ("provider",),
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+))
+batch_wait_seconds = registry.register(Histogram(
+    "agent_batch_wait_seconds",
+    "Time a request waited in the micro-batch window before its call was sent",
+    ("provider",),
+))
+batch_tokens_saved = registry.register(Counter(
+    "agent_batch_prompt_tokens_saved_total",
+    "Estimated prompt tokens saved by stating shared instructions once per batch",
+    ("provider",),
+))
+circuit_open = registry.register(Gauge(
+    "agent_circuit_open",
+    "1 when a provider's circuit is open or half-open",
+    ("provider",),
+))
+
+# --------------------------------
+# Stage timing
+# --------------------------------
+# Per-request list of (stage, provider, seconds) for the Server-Timing header.
+# None outside a request or when the header is disabled.
+_request_timings: ContextVar[Optional[list]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float, provider: str = "") -> None:
+    stage_seconds.observe(seconds, stage, provider)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, provider, seconds))
+
+
+class timed:
+    """
+    Time a block as one observation of `stage` (recorded even if it raises).
+
+    A plain class rather than @contextmanager: it skips the generator
+    machinery, which is most of the cost on sub-millisecond stages.
+    """
+
+    __slots__ = ("stage", "provider", "started")
+
+    def __init__(self, stage: str, provider: str = ""):
+        self.stage = stage
+        self.provider = provider
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        observe_stage(self.stage, time.perf_counter() - self.started, self.provider)
+
+
+def record_usage(provider: str, usage: Optional[dict]) -> None:
+    """
+    Count prompt/completion tokens from an OpenAI-style `usage` object.
+    """
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = usage.get(kind)
+        if count:
+            tokens.inc(provider, kind.split("_")[0], amount=count)
+
+
+def _server_timing(timings: list, total: float) -> bytes:
+    entries = []
+    for stage, provider, seconds in timings:
+        name = f"{stage}_{provider}" if provider else stage
+        name = "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+        entries.append(f"{name};dur={seconds * 1000:.2f}")
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request latency per route and, when
+    AGENT_SERVER_TIMING is on, attaching a Server-Timing header that lists
+    the stages timed while handling the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = [] if SERVER_TIMING else None
+        token = _request_timings.set(timings)
+
+        async def send_with_timing(message):
+            if timings is not None and message["type"] == "http.response.start":
+                header = _server_timing(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Label by the matched route's template so path parameters such
+            # as session ids do not create a series each; unmatched paths
+            # (scanners) share one label
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "other"
+            request_seconds.observe(time.perf_counter() - started, path)
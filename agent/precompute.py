@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Set, Tuple
+
+from cache import cache_key
+from deadline import start_budget
+from fallback import fallback_engine
+from providers import close_client
+from recipe_agent import RecipeDetailResponse, RecipeListResponse, recipe_details, recommend_recipes
+from store import STORE_MAX_ENTRIES, STORE_PATH, STORE_THREADS, STORE_TTL, ResultStore
+
+# --------------------------------
+# Bulk precompute tool
+# --------------------------------
+# Generates recipe lists (and details for the first few recipes of each) for
+# a file of pantries, e.g. the most common ones mined from access logs, and
+# writes them to the result store the agent reads on a cache miss and warms
+# from at startup. Entries expire after AGENT_STORE_TTL like any other, so
+# rerun it (with --fresh) on a schedule shorter than that.
+#
+# The pantry file has one pantry per line: comma-separated ingredients, or a
+# JSON list / {"ingredients": [...]} object. Blank lines and # comments are
+# skipped, and duplicate pantries are generated once. Every finished pantry
+# is appended to the checkpoint file, so an interrupted run picks up where it
+# stopped. With --corpus-out the recipes are also written as a JSON corpus
+# (build_corpus.py compiles it), which serves them with no store lookup.
+#
+#   python precompute.py pantries.txt --concurrency 8 --details 3
+
+
+def read_pantries(path: str) -> List[List[str]]:
+    pantries, seen = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line[0] in "[{":
+                data = json.loads(line)
+                ingredients = data.get("ingredients", []) if isinstance(data, dict) else data
+            else:
+                ingredients = line.split(",")
+            ingredients = [str(i).strip() for i in ingredients if str(i).strip()]
+            if not ingredients:
+                print(f"Skipping line {number}: no ingredients")
+                continue
+            key = cache_key(ingredients)
+            if key not in seen:
+                seen.add(key)
+                pantries.append(ingredients)
+    return pantries
+
+
+def read_checkpoint(path: str) -> Tuple[Set[Tuple], List[dict]]:
+    """
+    Pantry keys already done, and the corpus records they produced.
+    """
+    done, records = set(), []
+    if not os.path.exists(path):
+        return done, records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted write
+                continue
+            done.add(cache_key(entry["ingredients"]))
+            records.extend(entry.get("records", []))
+    return done, records
+
+
+def corpus_records(ingredients: List[str], recipes: RecipeListResponse,
+                   details: Dict[str, RecipeDetailResponse]) -> List[dict]:
+    """
+    Corpus entries for one pantry. Detailed recipes keep their required and
+    optional split; for the rest, the pantry plus the missing list is required.
+    """
+    records = []
+    for recipe in recipes.recipes:
+        detail = details.get(recipe.id)
+        if detail is not None:
+            required = [i.name for i in detail.ingredients if i.required]
+            optional = [i.name for i in detail.ingredients if not i.required]
+        else:
+            required, optional = list(ingredients) + list(recipe.missing), []
+        records.append({
+            "id": recipe.id,
+            "title": recipe.title,
+            "ingredients": [{"name": name} for name in required],
+            "optional_ingredients": optional,
+        })
+    return records
+
+
+def _identity(record: dict) -> Tuple:
+    # Two records describe the same recipe when title and ingredients match
+    names = lambda items: tuple(sorted(
+        (i.get("name", "") if isinstance(i, dict) else str(i)).strip().lower() for i in items or []
+    ))
+    return (
+        str(record.get("title", "")).strip().lower(),
+        names(record.get("ingredients")),
+        names(record.get("optional_ingredients")),
+    )
+
+
+def write_corpus(path: str, records: List[dict]) -> Tuple[int, int]:
+    """
+    Merge records into a JSON corpus file. Model-chosen ids such as
+    "fried_rice" repeat across pantries, so a record replaces an existing
+    entry only when it is the same recipe (same title and ingredients); a
+    different recipe with a taken id is stored as "<id>_2", "<id>_3", ...
+    Returns the corpus size and the number of records renamed this way.
+    """
+    merged: Dict[str, dict] = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        if isinstance(existing, dict):
+            existing = existing.get("recipes", [])
+        merged = {record.get("id") or record.get("title"): record for record in existing}
+
+    renamed = 0
+    for record in records:
+        base, identity = record["id"], _identity(record)
+        recipe_id, n = base, 1
+        while recipe_id in merged and _identity(merged[recipe_id]) != identity:
+            n += 1
+            recipe_id = f"{base}_{n}"
+        if recipe_id != base and recipe_id not in merged:
+            renamed += 1
+        merged[recipe_id] = dict(record, id=recipe_id)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(list(merged.values()), f, indent=2)
+    os.replace(tmp, path)
+    return len(merged), renamed
+
+
+class Precompute:
+    """
+    Runs pantries through the agent's provider path with `concurrency`
+    pantries in flight, each within its own time budget.
+    """
+
+    def __init__(self, store: ResultStore, checkpoint: str, details: int, budget: float, corpus: bool):
+        self.store = store
+        self.checkpoint_path = checkpoint
+        self.details = details
+        self.budget = budget
+        self.corpus = corpus
+        self.completed = 0
+        self.failed = 0
+        self.detail_count = 0
+        self.detail_failed = 0
+        self.records: List[dict] = []
+        self._checkpoint = None
+
+    async def pantry(self, ingredients: List[str]) -> bool:
+        start_budget(self.budget)
+        key = cache_key(ingredients)
+        recipes, from_ai = await recommend_recipes(ingredients)
+        if not from_ai:
+            # Fallback answers are not worth storing; a later run retries
+            return False
+        self.store.put("recipes", key, recipes.model_dump_json())
+
+        # Fallback recipe ids are rendered locally and never need a provider
+        wanted = [r.id for r in recipes.recipes if r.id not in fallback_engine.rules.details][:self.details]
+        details: Dict[str, RecipeDetailResponse] = {}
+        for recipe_id in wanted:
+            start_budget(self.budget)
+            detail, detail_from_ai = await recipe_details(recipe_id, ingredients)
+            if not detail_from_ai:
+                self.detail_failed += 1
+                continue
+            self.detail_count += 1
+            details[recipe_id] = detail
+            self.store.put("details", cache_key(ingredients, recipe_id), detail.model_dump_json())
+
+        entry = {"ingredients": ingredients, "recipes": len(recipes.recipes), "details": len(details)}
+        if self.corpus:
+            entry["records"] = corpus_records(ingredients, recipes, details)
+            self.records.extend(entry["records"])
+        self._checkpoint.write(json.dumps(entry) + "\n")
+        self._checkpoint.flush()
+        return True
+
+    async def worker(self, queue: "asyncio.Queue[List[str]]", total: int, started: float) -> None:
+        while True:
+            try:
+                ingredients = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                ok = await self.pantry(ingredients)
+            except Exception as e:
+                print(f"Failed {', '.join(ingredients)}: {str(e)}")
+                ok = False
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            finished = self.completed + self.failed
+            if finished % 10 == 0 or finished == total:
+                rate = finished / max(time.perf_counter() - started, 1e-9)
+                print(f"{finished}/{total} pantries ({self.failed} failed, {rate:.2f}/s)")
+
+    async def run(self, pantries: List[List[str]], concurrency: int) -> None:
+        queue: "asyncio.Queue[List[str]]" = asyncio.Queue()
+        for ingredients in pantries:
+            queue.put_nowait(ingredients)
+        started = time.perf_counter()
+        with open(self.checkpoint_path, "a", encoding="utf-8") as self._checkpoint:
+            await asyncio.gather(*(
+                self.worker(queue, len(pantries), started) for _ in range(max(1, concurrency))
+            ))
+
+
+async def run(args) -> None:
+    pantries = read_pantries(args.pantries)
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    done, records = read_checkpoint(args.checkpoint)
+    todo = [p for p in pantries if cache_key(p) not in done]
+    print(f"Pantries: {len(pantries)} ({len(pantries) - len(todo)} already done, {len(todo)} to generate)")
+
+    store = ResultStore(args.store, STORE_MAX_ENTRIES, STORE_TTL, STORE_THREADS)
+    store.open()
+    if not store.enabled and not args.corpus_out:
+        raise SystemExit("No result store to write to; pass --store or --corpus-out")
+
+    job = Precompute(store, args.checkpoint, args.details, args.budget, bool(args.corpus_out))
+    started = time.perf_counter()
+    try:
+        await job.run(todo, args.concurrency)
+    finally:
+        await close_client()
+        # Waits for queued store writes
+        store.close()
+        if args.corpus_out:
+            total, renamed = write_corpus(args.corpus_out, records + job.records)
+            print(f"Corpus:   {args.corpus_out} ({total} recipes, {renamed} colliding ids renamed)")
+
+    print(f"Generated {job.completed} pantries, {job.detail_count} details in {time.perf_counter() - started:.1f}s")
+    print(f"Failed:   {job.failed} pantries, {job.detail_failed} details (rerun to retry)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute recipe lists and details for common pantries")
+    parser.add_argument("pantries", help="File with one pantry per line (comma-separated or JSON)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pantries generated at once")
+    parser.add_argument("--details", type=int, default=3, help="Recipes per pantry to generate details for")
+    parser.add_argument("--budget", type=float, default=60, help="Seconds allowed per provider request")
+    parser.add_argument("--store", default=STORE_PATH, help="Result store to write (default: AGENT_STORE_PATH)")
+    parser.add_argument("--corpus-out", help="Also merge the recipes into this JSON corpus file")
+    parser.add_argument("--checkpoint", help="Progress file (default: <pantries>.done)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args()
+    args.checkpoint = args.checkpoint or f"{args.pantries}.done"
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun to resume from {args.checkpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Hashable, List, Set
+
+from cache import TTLCache
+from deadline import clear_budget
+
+# --------------------------------
+# Speculative prefetch settings
+# --------------------------------
+# After a recipe list is served, details for its first PREFETCH_DEPTH recipes
+# are generated in the background. Spend is capped by PREFETCH_CONCURRENCY
+# running jobs and a PREFETCH_BUDGET jobs-per-minute token bucket.
+PREFETCH_ENABLED = os.getenv("AGENT_PREFETCH", "off") == "on"
+PREFETCH_DEPTH = int(os.getenv("AGENT_PREFETCH_DEPTH", "3"))
+PREFETCH_CONCURRENCY = int(os.getenv("AGENT_PREFETCH_CONCURRENCY", "4"))
+PREFETCH_BUDGET = float(os.getenv("AGENT_PREFETCH_BUDGET", "60"))
+
+
+class Prefetcher:
+    """
+    Schedules speculative detail generation and measures whether it pays off.
+
+    A prefetched key counts as a hit, once, when the first real detail
+    request arrives for it, whether it is served from the cache or joins the
+    still-running job. Repeat requests for the key are not prefetch wins.
+    """
+
+    def __init__(self, enabled: bool, depth: int, concurrency: int, budget_per_minute: float):
+        self.enabled = enabled
+        self.depth = depth
+        self.concurrency = concurrency
+        self.capacity = budget_per_minute
+        self.tokens = budget_per_minute
+        self.refill_rate = budget_per_minute / 60.0
+        self.refilled_at = time.monotonic()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.hits = 0
+        self._running: Set[asyncio.Task] = set()
+        # Keys prefetched recently, remembered long enough to attribute hits
+        self._prefetched = TTLCache(4096, 1800)
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.refill_rate)
+        self.refilled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def schedule(self, keys: List[Hashable], job: Callable[[Hashable], Awaitable[object]]) -> None:
+        """
+        Start background jobs for up to `depth` keys, skipping keys the caller
+        already has and anything over the concurrency or rate budget.
+        """
+        if not self.enabled:
+            return
+
+        for key in keys[:self.depth]:
+            if len(self._running) >= self.concurrency or not self._take_token():
+                self.skipped += 1
+                continue
+
+            self.scheduled += 1
+            self._prefetched.set(key, True)
+            task = asyncio.ensure_future(self._run(key, job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, job: Callable[[Hashable], Awaitable[object]]) -> None:
+        # Not bound by the budget of the request that triggered it
+        clear_budget()
+        try:
+            await job(key)
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            print(f"Prefetch failed: {str(e)}")
+
+    def record_request(self, key: Hashable) -> None:
+        """
+        Note a real detail request so prefetch hit rate can be measured.
+        """
+        if self._prefetched.pop(key) is not None:
+            self.hits += 1
+
+    async def close(self) -> None:
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "depth": self.depth,
+            "running": len(self._running),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped_budget": self.skipped,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.scheduled, 4) if self.scheduled else 0.0,
+        }
+
+
+prefetcher = Prefetcher(PREFETCH_ENABLED, PREFETCH_DEPTH, PREFETCH_CONCURRENCY, PREFETCH_BUDGET)
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from deadline import timeout_for
+from metrics import provider_rejections, record_usage
+
+# --------------------------------
+# API Configuration
+# --------------------------------
+# OpenAI Configuration
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+
+# Hugging Face Configuration
+HF_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
+HF_API_URL = os.getenv("HF_API_URL", "https://router.huggingface.co/hf-inference/models/mistralai/Mistral-7B-Instruct-v0.2")
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "10"))
+
+# --------------------------------
+# Connection pool settings
+# --------------------------------
+# One pool is shared by every request so TLS sessions to the providers are reused.
+HTTP_MAX_CONNECTIONS = int(os.getenv("AGENT_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("AGENT_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AGENT_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("AGENT_HTTP_CONNECT_TIMEOUT", "5"))
+
+# --------------------------------
+# Execution settings
+# --------------------------------
+# "race" hedges to the next provider after AGENT_HEDGE_DELAY seconds;
+# "sequential" only moves on when the current provider fails.
+EXECUTION_MODE = os.getenv("AGENT_EXECUTION_MODE", "race")
+HEDGE_DELAY = float(os.getenv("AGENT_HEDGE_DELAY", "2.0"))
+
+T = TypeVar("T")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared keep-alive client, creating it on first use.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """
+    Close the shared client and release its pooled connections.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _openai_request(prompt: str, max_tokens: int) -> Tuple[dict, dict]:
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "model": "gpt-3.5-turbo",  # or "gpt-4" for better results
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a creative recipe assistant. Always respond with valid JSON only, no additional text."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.7
+    }
+    return headers, payload
+
+
+async def call_openai_model(prompt: str, max_tokens: int = 1500) -> Optional[str]:
+    """
+    Call OpenAI API (GPT-3.5-turbo or GPT-4)
+    """
+    if not OPENAI_API_KEY:
+        print("OpenAI API key not configured")
+        return None
+
+    headers, payload = _openai_request(prompt, max_tokens)
+
+    try:
+        response = await get_client().post(
+            OPENAI_API_URL, headers=headers, json=payload, timeout=timeout_for(OPENAI_TIMEOUT)
+        )
+
+        if response.status_code != 200:
+            print(f"OpenAI API Error: {response.status_code} - {response.text}")
+            return None
+
+        result = response.json()
+        record_usage("OpenAI", result.get("usage"))
+
+        if "choices" in result and len(result["choices"]) > 0:
+            return result["choices"][0]["message"]["content"]
+
+        return None
+    except Exception as e:
+        print(f"OpenAI API Exception: {str(e)}")
+        return None
+
+
+async def stream_openai_model(prompt: str, max_tokens: int = 1500) -> AsyncIterator[str]:
+    """
+    Stream OpenAI completion text as it is generated.
+    Yields nothing if the provider is unavailable; raises if the stream breaks.
+    """
+    if not OPENAI_API_KEY:
+        print("OpenAI API key not configured")
+        return
+
+    headers, payload = _openai_request(prompt, max_tokens)
+    payload["stream"] = True
+    # Ask for a final usage chunk so streamed calls are counted too
+    payload["stream_options"] = {"include_usage": True}
+
+    async with get_client().stream(
+        "POST", OPENAI_API_URL, headers=headers, json=payload, timeout=timeout_for(OPENAI_TIMEOUT)
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            print(f"OpenAI API Error: {response.status_code} - {response.text}")
+            return
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+
+            event = json.loads(data)
+            record_usage("OpenAI", event.get("usage"))
+            choices = event.get("choices") or []
+            if choices:
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+def _huggingface_request(prompt: str, max_tokens: int) -> Tuple[dict, dict]:
+    headers = {}
+    if HF_API_KEY:
+        headers["Authorization"] = f"Bearer {HF_API_KEY}"
+
+    payload = {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": max_tokens,
+            "temperature": 0.7,
+            "return_full_text": False,
+            "top_p": 0.95
+        }
+    }
+    return headers, payload
+
+
+async def call_huggingface_model(prompt: str, max_tokens: int = 1000) -> Optional[str]:
+    """
+    Call Hugging Face Inference API with timeout and fallback
+    """
+    headers, payload = _huggingface_request(prompt, max_tokens)
+
+    try:
+        response = await get_client().post(
+            HF_API_URL, headers=headers, json=payload, timeout=timeout_for(HF_TIMEOUT)
+        )
+
+        if response.status_code != 200:
+            print(f"HF API Error: {response.status_code} - {response.text}")
+            return None
+
+        result = response.json()
+
+        # Handle different response formats
+        if isinstance(result, list) and len(result) > 0:
+            return result[0].get("generated_text", "")
+        elif isinstance(result, dict):
+            return result.get("generated_text", "")
+
+        return None
+    except Exception as e:
+        print(f"HF API Exception: {str(e)}")
+        return None
+
+
+async def call_huggingface_batch(prompts: List[str], max_tokens: int = 1000) -> Optional[List[Optional[str]]]:
+    """
+    Call the Hugging Face Inference API with several prompts in one request.
+    Returns one text (or None) per prompt, or None if the call failed.
+    """
+    headers, payload = _huggingface_request("", max_tokens)
+    payload["inputs"] = prompts
+
+    try:
+        response = await get_client().post(
+            HF_API_URL, headers=headers, json=payload, timeout=timeout_for(HF_TIMEOUT)
+        )
+
+        if response.status_code != 200:
+            print(f"HF API Error: {response.status_code} - {response.text}")
+            return None
+
+        result = response.json()
+        if not isinstance(result, list) or len(result) != len(prompts):
+            return None
+
+        # One entry per input: a generation dict, or a list holding one
+        texts = []
+        for entry in result:
+            if isinstance(entry, list):
+                entry = entry[0] if entry else {}
+            texts.append(entry.get("generated_text") if isinstance(entry, dict) else None)
+        return texts
+    except Exception as e:
+        print(f"HF API Exception: {str(e)}")
+        return None
+
+
+async def stream_huggingface_model(prompt: str, max_tokens: int = 1000) -> AsyncIterator[str]:
+    """
+    Stream Hugging Face generated tokens (text-generation SSE format).
+    Yields nothing if the provider is unavailable; raises if the stream breaks.
+    """
+    headers, payload = _huggingface_request(prompt, max_tokens)
+    payload["stream"] = True
+
+    async with get_client().stream(
+        "POST", HF_API_URL, headers=headers, json=payload, timeout=timeout_for(HF_TIMEOUT)
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            print(f"HF API Error: {response.status_code} - {response.text}")
+            return
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+
+            token = json.loads(line[5:]).get("token") or {}
+            if token.get("text") and not token.get("special"):
+                yield token["text"]
+
+
+# --------------------------------
+# Provider registry
+# --------------------------------
+# Default priority order; routing may reorder by health and latency.
+PROVIDER_CALLS = {
+    "OpenAI": call_openai_model,
+    "Hugging Face": call_huggingface_model,
+}
+# Providers that accept several prompts in one request
+PROVIDER_BATCH_CALLS = {
+    "Hugging Face": call_huggingface_batch,
+}
+PROVIDER_STREAMS = {
+    "OpenAI": stream_openai_model,
+    "Hugging Face": stream_huggingface_model,
+}
+
+
+def configured_providers() -> List[str]:
+    """
+    Providers worth routing to. OpenAI needs a key; the HF endpoint is tried either way.
+    """
+    return [name for name in PROVIDER_CALLS if name != "OpenAI" or OPENAI_API_KEY]
+
+
+# --------------------------------
+# Hedged execution
+# --------------------------------
+async def race_providers(
+    attempts: List[Tuple[str, Callable[[], Awaitable[Optional[str]]]]],
+    validate: Callable[[str], Optional[T]],
+    hedge_delay: Optional[float],
+    deadline: float,
+) -> Optional[Tuple[str, T]]:
+    """
+    Run provider attempts in priority order and return (provider, result) for
+    the first response that validates, or None once every attempt has failed
+    or the deadline has passed.
+
+    The next attempt starts as soon as a running one fails, or after
+    hedge_delay seconds if the running ones are still slow (None disables
+    hedging, giving plain sequential failover). Calls still running when a
+    winner is picked or the deadline expires are cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    queue = list(attempts)
+    pending: Dict[asyncio.Task, str] = {}
+    next_hedge_at = None
+
+    def launch():
+        nonlocal next_hedge_at
+        name, factory = queue.pop(0)
+        pending[asyncio.ensure_future(factory())] = name
+        if hedge_delay is not None:
+            next_hedge_at = loop.time() + hedge_delay
+
+    if queue:
+        launch()
+
+    try:
+        while pending:
+            now = loop.time()
+            if now >= end:
+                print(f"Provider deadline of {deadline}s exceeded")
+                return None
+
+            timeout = end - now
+            if queue and next_hedge_at is not None:
+                timeout = min(timeout, max(0.0, next_hedge_at - now))
+
+            done, _ = await asyncio.wait(
+                pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                if queue and next_hedge_at is not None and loop.time() >= next_hedge_at:
+                    print(f"Hedging request to {queue[0][0]}")
+                    launch()
+                continue
+
+            for task in done:
+                name = pending.pop(task)
+                result = None
+                if not task.cancelled() and task.exception() is None:
+                    text = task.result()
+                    if text is not None:
+                        try:
+                            result = validate(text)
+                        except Exception as e:
+                            provider_rejections.inc(name)
+                            print(f"{name} response rejected: {str(e)}")
+                if result is not None:
+                    return name, result
+                if queue:
+                    launch()
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
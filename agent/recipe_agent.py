@@ -1,342 +1,79 @@
-import os
+import asyncio
 import json
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import math
+import os
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, Union
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from admission import LoadShed, admission_stats, admitted_call, client_limiter, get_limiter
+from batcher import batcher
+from breaker import get_health, health_snapshot, route
+from cache import cache_key, detail_cache, fallback_cache, recipe_cache
+from corpus import CORPUS_MIN_COVERAGE, CORPUS_MIN_RESULTS, CORPUS_MODE, RecipeCorpus, load_corpus
+from deadline import DeadlineMiddleware, call_with_retries, remaining
+from decoding import ModelResponse, decode_model_output
+from fallback import fallback_engine, generate_fallback_recipes, local_recipe_details
+from filters import RecipeFilter, compile_filter
+from metrics import (
+    MetricsMiddleware,
+    cache_events,
+    cache_size,
+    circuit_open,
+    fallbacks,
+    filter_rejections,
+    observe_stage,
+    provider_calls,
+    provider_queue,
+    registry,
+    timed,
+)
+from prefetch import prefetcher
+from providers import (
+    EXECUTION_MODE,
+    HEDGE_DELAY,
+    HF_API_KEY,
+    OPENAI_API_KEY,
+    PROVIDER_CALLS,
+    PROVIDER_STREAMS,
+    close_client,
+    configured_providers,
+    get_client,
+    race_providers,
+)
+from sessions import SESSION_SAVE_ATTEMPTS, Session, recipe_diff, session_store
+from similarity import SIMILAR_ENABLED, recompute_missing, similar_index
+from singleflight import inflight
+from store import STORE_WARM_ENTRIES, result_store
+from streaming import RecipeStreamParser
 
 # --------------------------------
-# API Configuration
+# FastAPI app
 # --------------------------------
-# OpenAI Configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
-
-# Hugging Face Configuration
-HF_API_KEY = os.getenv("HUGGINGFACE_API_KEY")  
-HF_API_URL = "https://router.huggingface.co/hf-inference/models/mistralai/Mistral-7B-Instruct-v0.2"
+corpus: Optional[RecipeCorpus] = None
 
-def call_openai_model(prompt: str, max_tokens: int = 1500) -> str:
-    """
-    Call OpenAI API (GPT-3.5-turbo or GPT-4)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     """
-    if not OPENAI_API_KEY:
-        print("OpenAI API key not configured")
-        return None
-    
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": "gpt-3.5-turbo",  # or "gpt-4" for better results
-        "messages": [
-            {
-                "role": "system",
-                "content": "You are a creative recipe assistant. Always respond with valid JSON only, no additional text."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        "max_tokens": max_tokens,
-        "temperature": 0.7
-    }
-    
-    try:
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"OpenAI API Error: {response.status_code} - {response.text}")
-            return None
-        
-        result = response.json()
-        
-        if "choices" in result and len(result["choices"]) > 0:
-            return result["choices"][0]["message"]["content"]
-        
-        return None
-    except Exception as e:
-        print(f"OpenAI API Exception: {str(e)}")
-        return None
-
-def call_huggingface_model(prompt: str, max_tokens: int = 1000) -> str:
+    Open the shared provider connection pool, load the local recipe corpus and
+    warm the result caches from the persistent store on startup, and drain the
+    pool on shutdown.
     """
-    Call Hugging Face Inference API with timeout and fallback
-    """
-    headers = {}
-    if HF_API_KEY:
-        headers["Authorization"] = f"Bearer {HF_API_KEY}"
-    
-    payload = {
-        "inputs": prompt,
-        "parameters": {
-            "max_new_tokens": max_tokens,
-            "temperature": 0.7,
-            "return_full_text": False,
-            "top_p": 0.95
-        }
-    }
-    
-    try:
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=10)
-        
-        if response.status_code != 200:
-            print(f"HF API Error: {response.status_code} - {response.text}")
-            return None
-        
-        result = response.json()
-        
-        # Handle different response formats
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "")
-        elif isinstance(result, dict):
-            return result.get("generated_text", "")
-        
-        return None
-    except Exception as e:
-        print(f"HF API Exception: {str(e)}")
-        return None
-
-    return str(result)
-
-# --------------------------------
-# Fallback Recipe Generator
-# --------------------------------
-def generate_fallback_recipes(ingredients: List[str]) -> List[dict]:
-    """Generate diverse recipes programmatically when AI is unavailable"""
-    recipes = []
-    ing_lower = [i.lower() for i in ingredients]
-    ing_str = ', '.join(ingredients[:3])
-    
-    # Recipe templates based on common ingredients with MORE variety
-    
-    # Protein-based recipes
-    if any(i in ing_lower for i in ['chicken', 'beef', 'pork', 'turkey', 'lamb']):
-        protein = next((i for i in ingredients if i.lower() in ['chicken', 'beef', 'pork', 'turkey', 'lamb']), ingredients[0])
-        recipes.extend([
-            {
-                "id": "protein_stir_fry",
-                "title": f"{protein.title()} Stir Fry",
-                "missing": ["soy sauce", "ginger"],
-                "reason": "Quick Asian-inspired meal ready in 20 minutes"
-            },
-            {
-                "id": "protein_grilled",
-                "title": f"Grilled {protein.title()} with Herbs",
-                "missing": ["herbs", "lemon"],
-                "reason": "Healthy grilled option with simple seasoning"
-            },
-            {
-                "id": "protein_curry",
-                "title": f"{protein.title()} Curry",
-                "missing": ["curry powder", "coconut milk"],
-                "reason": "Flavorful one-pot meal with rich spices"
-            }
-        ])
-    
-    # Pasta dishes
-    if any(i in ing_lower for i in ['pasta', 'noodles', 'spaghetti', 'linguine', 'penne']):
-        recipes.extend([
-            {
-                "id": "pasta_aglio_olio",
-                "title": f"{ing_str.title()} Aglio e Olio",
-                "missing": ["garlic", "olive oil", "chili flakes"],
-                "reason": "Classic Italian pasta, simple and delicious"
-            },
-            {
-                "id": "pasta_baked",
-                "title": f"Baked {ing_str.title()} Casserole",
-                "missing": ["cheese", "breadcrumbs"],
-                "reason": "Comforting baked pasta perfect for meal prep"
-            },
-            {
-                "id": "pasta_primavera",
-                "title": f"{ing_str.title()} Primavera",
-                "missing": ["mixed vegetables", "cream"],
-                "reason": "Light and fresh pasta with seasonal vegetables"
-            }
-        ])
-    
-    # Rice dishes
-    if any(i in ing_lower for i in ['rice', 'quinoa', 'couscous']):
-        grain = next((i for i in ingredients if i.lower() in ['rice', 'quinoa', 'couscous']), 'rice')
-        recipes.extend([
-            {
-                "id": "rice_bowl",
-                "title": f"{ing_str.title()} Power Bowl",
-                "missing": ["avocado", "sesame seeds"],
-                "reason": "Nutritious and filling bowl with balanced ingredients"
-            },
-            {
-                "id": "fried_rice",
-                "title": f"{ing_str.title()} Fried Rice",
-                "missing": ["soy sauce", "egg", "green onions"],
-                "reason": "Popular Asian dish, great for using leftovers"
-            },
-            {
-                "id": "rice_pilaf",
-                "title": f"{grain.title()} Pilaf",
-                "missing": ["onion", "broth"],
-                "reason": "Aromatic side dish that pairs with any protein"
-            }
-        ])
-    
-    # Egg dishes
-    if any(i in ing_lower for i in ['egg', 'eggs']):
-        recipes.extend([
-            {
-                "id": "egg_omelette",
-                "title": f"{ing_str.title()} Omelette",
-                "missing": ["butter", "cheese"],
-                "reason": "Quick protein-packed breakfast or lunch"
-            },
-            {
-                "id": "egg_frittata",
-                "title": f"{ing_str.title()} Frittata",
-                "missing": ["milk", "herbs"],
-                "reason": "Italian-style baked egg dish, great for brunch"
-            },
-            {
-                "id": "egg_scramble",
-                "title": f"{ing_str.title()} Scramble",
-                "missing": ["cream", "chives"],
-                "reason": "Fluffy scrambled eggs with your ingredients"
-            }
-        ])
-    
-    # Vegetable-based recipes
-    if any(i in ing_lower for i in ['tomato', 'tomatoes', 'pepper', 'onion', 'carrot', 'broccoli', 'spinach']):
-        recipes.extend([
-            {
-                "id": "veggie_salad",
-                "title": f"Fresh {ing_str.title()} Salad",
-                "missing": ["olive oil", "vinegar"],
-                "reason": "Crisp and refreshing raw vegetable salad"
-            },
-            {
-                "id": "veggie_roasted",
-                "title": f"Roasted {ing_str.title()}",
-                "missing": ["olive oil", "herbs"],
-                "reason": "Caramelized roasted vegetables with herbs"
-            },
-            {
-                "id": "veggie_soup",
-                "title": f"{ing_str.title()} Soup",
-                "missing": ["broth", "garlic"],
-                "reason": "Warming soup perfect for any season"
-            }
-        ])
-    
-    # Fish and seafood
-    if any(i in ing_lower for i in ['fish', 'salmon', 'tuna', 'cod', 'shrimp', 'prawns']):
-        seafood = next((i for i in ingredients if i.lower() in ['fish', 'salmon', 'tuna', 'cod', 'shrimp', 'prawns']), ingredients[0])
-        recipes.extend([
-            {
-                "id": "seafood_baked",
-                "title": f"Baked {seafood.title()} with Lemon",
-                "missing": ["lemon", "butter", "herbs"],
-                "reason": "Healthy baked seafood with citrus flavors"
-            },
-            {
-                "id": "seafood_pan_seared",
-                "title": f"Pan-Seared {seafood.title()}",
-                "missing": ["garlic", "white wine"],
-                "reason": "Restaurant-quality seafood in minutes"
-            }
-        ])
-    
-    # Bread-based
-    if any(i in ing_lower for i in ['bread', 'toast', 'baguette']):
-        recipes.extend([
-            {
-                "id": "toast_avocado",
-                "title": f"{ing_str.title()} Toast",
-                "missing": ["avocado", "seasoning"],
-                "reason": "Trendy and nutritious breakfast or snack"
-            },
-            {
-                "id": "sandwich",
-                "title": f"{ing_str.title()} Sandwich",
-                "missing": ["lettuce", "mayo"],
-                "reason": "Classic sandwich packed with your ingredients"
-            }
-        ])
-    
-    # Default/mixed recipes if none of the above match
-    if not recipes:
-        recipes = [
-            {
-                "id": "mixed_sauté",
-                "title": f"{ing_str.title()} Sauté",
-                "missing": ["oil", "seasoning"],
-                "reason": "Simple sautéed dish highlighting your ingredients"
-            },
-            {
-                "id": "mixed_stew",
-                "title": f"{ing_str.title()} Stew",
-                "missing": ["broth", "herbs"],
-                "reason": "Hearty stew combining your ingredients"
-            },
-            {
-                "id": "mixed_casserole",
-                "title": f"{ing_str.title()} Casserole",
-                "missing": ["cheese", "breadcrumbs"],
-                "reason": "Comforting baked casserole dish"
-            },
-            {
-                "id": "mixed_bowl",
-                "title": f"{ing_str.title()} Buddha Bowl",
-                "missing": ["tahini", "greens"],
-                "reason": "Nutritious bowl with balanced ingredients"
-            },
-            {
-                "id": "mixed_wrap",
-                "title": f"{ing_str.title()} Wrap",
-                "missing": ["tortilla", "sauce"],
-                "reason": "Quick and portable wrap with your ingredients"
-            },
-            {
-                "id": "mixed_skillet",
-                "title": f"One-Pan {ing_str.title()} Skillet",
-                "missing": ["onion", "garlic"],
-                "reason": "Easy one-pan meal, minimal cleanup"
-            },
-            {
-                "id": "mixed_mediterranean",
-                "title": f"Mediterranean {ing_str.title()} Plate",
-                "missing": ["olive oil", "lemon"],
-                "reason": "Healthy Mediterranean-inspired dish"
-            },
-            {
-                "id": "mixed_tacos",
-                "title": f"{ing_str.title()} Tacos",
-                "missing": ["tortillas", "salsa"],
-                "reason": "Fun and customizable taco night"
-            },
-            {
-                "id": "mixed_grain_bowl",
-                "title": f"{ing_str.title()} Grain Bowl",
-                "missing": ["quinoa", "dressing"],
-                "reason": "Wholesome grain bowl packed with nutrition"
-            },
-            {
-                "id": "mixed_pizza",
-                "title": f"{ing_str.title()} Pizza",
-                "missing": ["dough", "cheese"],
-                "reason": "Homemade pizza with your favorite toppings"
-            }
-        ]
-    
-    return recipes[:10]  # Return max 10 recipes
+    global corpus
+    corpus = load_corpus()
+    get_client()
+    result_store.open()
+    await warm_caches()
+    yield
+    await prefetcher.close()
+    await batcher.close()
+    await close_client()
+    result_store.close()
 
-# --------------------------------
-# FastAPI app
-# --------------------------------
-app = FastAPI(title="Recipe Agent API (Hugging Face)", version="1.0.0")
+app = FastAPI(title="Recipe Agent API (Hugging Face)", version="1.0.0", lifespan=lifespan)
 
 # --------------------------------
 # CORS Configuration
@@ -348,17 +85,50 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Outermost, so a client disconnect cancels everything below it
+app.add_middleware(DeadlineMiddleware)
+
+# --------------------------------
+# Per-client rate limiting
+# --------------------------------
+def client_id(request: Request) -> str:
+    """
+    Identify the caller. The agent sits behind the Node backend, so an
+    explicit X-Client-Id or the first X-Forwarded-For hop wins over the peer address.
+    """
+    forwarded = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+    return request.headers.get("x-client-id") or forwarded or (request.client.host if request.client else "unknown")
+
+def rate_limit(request: Request) -> None:
+    if not client_limiter.enabled:
+        return
+    retry_after = client_limiter.allow(client_id(request))
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(retry_after))}
+        )
 
 # --------------------------------
 # Request models
 # --------------------------------
+class RecipeFilters(BaseModel):
+    diet: List[str] = []
+    cuisine: List[str] = []
+    meal_type: List[str] = []
+    max_time: Optional[int] = None
+
 class IngredientRequest(BaseModel):
     ingredients: List[str]
+    filters: Optional[RecipeFilters] = None
 
 class RecipeDetailRequest(BaseModel):
     recipe_id: str
     ingredients: List[str]
 
+class BatchIngredientRequest(BaseModel):
+    requests: List[IngredientRequest]
+
 # --------------------------------
 # Response models
 # --------------------------------
@@ -371,6 +141,46 @@ class Recipe(BaseModel):
 class RecipeListResponse(BaseModel):
     recipes: List[Recipe]
 
+class BatchRecipeListResponse(BaseModel):
+    results: List[RecipeListResponse]
+
+class SessionCreateRequest(BaseModel):
+    ingredients: List[str] = []
+    k: int = Field(10, ge=1, le=10)
+    filters: Optional[RecipeFilters] = None
+
+class SessionDeltaRequest(BaseModel):
+    add: List[str] = []
+    remove: List[str] = []
+
+class SessionResponse(BaseModel):
+    session_id: str
+    version: int
+    ingredients: List[str]
+    recipes: List[Recipe]
+
+class RankedRecipe(BaseModel):
+    rank: int
+    recipe: Recipe
+
+class SessionDiffResponse(BaseModel):
+    session_id: str
+    version: int
+    ingredients: List[str]
+    entered: List[RankedRecipe]
+    left: List[str]
+    updated: List[RankedRecipe]
+    order: List[str]
+
+class FilteredRecipe(Recipe):
+    # Attributes a filtered prompt asks the model to declare, for verification
+    cuisine: Optional[Union[str, List[str]]] = None
+    meal_type: Optional[Union[str, List[str]]] = None
+    time_minutes: Optional[Union[float, str]] = None
+
+class FilteredRecipeListResponse(BaseModel):
+    recipes: List[FilteredRecipe]
+
 class Ingredient(BaseModel):
     name: str
     required: bool = True
@@ -381,33 +191,86 @@ class RecipeDetailResponse(BaseModel):
     steps: List[str]
     tips: Optional[List[str]] = []
 
+def request_filters(filters: Optional[RecipeFilters]) -> Optional[RecipeFilter]:
+    """
+    Compile request filters, or None when nothing is filtered.
+    """
+    if filters is None:
+        return None
+    try:
+        return compile_filter(filters.diet, filters.cuisine, filters.meal_type, filters.max_time)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def filters_key(filters: Optional[RecipeFilter]) -> Optional[str]:
+    return filters.key if filters is not None else None
+
 # --------------------------------
-# Generate recipe list
+# Persistent results
 # --------------------------------
-@app.post("/agent/recipes", response_model=RecipeListResponse)
-def generate_recipe_list(req: IngredientRequest):
+async def stored_result(kind: str, key: Tuple, model):
     """
-    Generate a list of recipe suggestions based on user ingredients.
-    Uses AI when available, falls back to programmatic generation.
+    Read a validated result from the persistent store, or None.
     """
-    if not req.ingredients:
-        raise HTTPException(status_code=400, detail="Ingredients list cannot be empty")
-    
-    prompt = f"""You are a creative recipe discovery agent. Suggest 10 diverse and realistic recipes using mostly these ingredients: {', '.join(req.ingredients)}.
+    with timed("store_read"):
+        value = await result_store.get(kind, key)
+    if value is None:
+        return None
+    try:
+        return model.model_validate_json(value)
+    except ValueError:
+        return None
 
-Return ONLY valid JSON in this exact format (no other text):
-{{
+async def warm_caches() -> None:
+    """
+    Load the most recently used stored results into the in-process caches.
+    """
+    for kind, cache, model in (("recipes", recipe_cache, RecipeListResponse), ("details", detail_cache, RecipeDetailResponse)):
+        warmed = 0
+        for key, value in await result_store.recent(kind, STORE_WARM_ENTRIES):
+            try:
+                response = model.model_validate_json(value)
+            except ValueError:
+                continue
+            if kind == "recipes":
+                remember_recipes(key, response)
+            else:
+                cache.set(key, response)
+            warmed += 1
+        if warmed:
+            print(f"Warmed {warmed} {kind} results from {result_store.path}")
+
+# --------------------------------
+# Prompt builders
+# --------------------------------
+# Each prompt is a role line, a per-request task, an answer format and rules.
+# Only the task differs between requests, so batched prompts state the rest once.
+RECIPE_LIST_ROLE = "You are a creative recipe discovery agent."
+RECIPE_LIST_FORMAT = """{
   "recipes": [
-    {{
+    {
       "id": "short_stable_id",
       "title": "Recipe Title",
       "missing": ["ingredient1", "ingredient2"],
       "reason": "Why this recipe is good"
-    }}
+    }
   ]
-}}
-
-Rules:
+}"""
+# Filtered requests also get each recipe's attributes back, to verify them
+RECIPE_LIST_FILTERED_FORMAT = """{
+  "recipes": [
+    {
+      "id": "short_stable_id",
+      "title": "Recipe Title",
+      "missing": ["ingredient1", "ingredient2"],
+      "reason": "Why this recipe is good",
+      "cuisine": "italian",
+      "meal_type": "dinner",
+      "time_minutes": 25
+    }
+  ]
+}"""
+RECIPE_LIST_RULES = """Rules:
 - Generate 10 different recipes with variety (different cuisines, cooking methods, meal types)
 - Use mostly provided ingredients
 - Include options for breakfast, lunch, dinner, and snacks
@@ -417,63 +280,569 @@ Rules:
 - Each recipe should feel distinct from the others
 - Return ONLY the JSON, nothing else"""
 
+RECIPE_DETAILS_ROLE = "You are a cooking assistant."
+RECIPE_DETAILS_FORMAT = """{
+  "title": "Recipe Title",
+  "ingredients": [
+    { "name": "ingredient name", "required": true }
+  ],
+  "steps": [
+    "Step 1: First instruction",
+    "Step 2: Second instruction"
+  ],
+  "tips": ["Helpful tip 1", "Helpful tip 2"]
+}"""
+RECIPE_DETAILS_RULES = """Rules:
+- Include clear step-by-step instructions
+- Prefer user's ingredients
+- Mention substitutions if needed
+- Return ONLY the JSON, nothing else"""
+
+def recipe_list_task(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> str:
+    task = f"Suggest 10 diverse and realistic recipes using mostly these ingredients: {', '.join(ingredients)}."
+    if filters is not None:
+        task += f" {filters.describe()}"
+    return task
+
+def recipe_details_task(recipe_id: str, ingredients: List[str]) -> str:
+    return f"Generate a complete recipe for \"{recipe_id}\" using these ingredients: {', '.join(ingredients)}."
+
+def build_prompt(role: str, task: str, answer_format: str, rules: str) -> str:
+    return f"""{role} {task}
+
+Return ONLY valid JSON in this exact format (no other text):
+{answer_format}
+
+{rules}"""
+
+def build_batch_prompt(role: str, tasks: List[str], answer_format: str, rules: str) -> str:
+    numbered = "\n".join(f"{n}. {task}" for n, task in enumerate(tasks, 1))
+    return f"""{role} Answer each of these {len(tasks)} requests independently:
+
+{numbered}
+
+Return ONLY valid JSON in this exact format (no other text), with one result per request:
+{{
+  "results": [
+    {{ "request": 1, "answer": ANSWER }}
+  ]
+}}
+
+Each ANSWER must be in this format:
+{answer_format}
+
+{rules}"""
+
+def build_recipe_list_prompt(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> str:
+    answer_format = RECIPE_LIST_FORMAT if filters is None else RECIPE_LIST_FILTERED_FORMAT
+    return build_prompt(RECIPE_LIST_ROLE, recipe_list_task(ingredients, filters), answer_format, RECIPE_LIST_RULES)
+
+def build_recipe_details_prompt(recipe_id: str, ingredients: List[str]) -> str:
+    return build_prompt(
+        RECIPE_DETAILS_ROLE, recipe_details_task(recipe_id, ingredients), RECIPE_DETAILS_FORMAT, RECIPE_DETAILS_RULES
+    )
+
+batcher.register(
+    "recipes", lambda tasks: build_batch_prompt(RECIPE_LIST_ROLE, tasks, RECIPE_LIST_FORMAT, RECIPE_LIST_RULES)
+)
+batcher.register(
+    "recipes_filtered",
+    lambda tasks: build_batch_prompt(RECIPE_LIST_ROLE, tasks, RECIPE_LIST_FILTERED_FORMAT, RECIPE_LIST_RULES),
+)
+batcher.register(
+    "details", lambda tasks: build_batch_prompt(RECIPE_DETAILS_ROLE, tasks, RECIPE_DETAILS_FORMAT, RECIPE_DETAILS_RULES)
+)
+
+# --------------------------------
+# Recipe generation
+# --------------------------------
+MAX_RECIPES = 10
+
+def fallback_recipe_list(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> RecipeListResponse:
+    fallbacks.inc("recipes")
+    with timed("fallback"):
+        return RecipeListResponse(recipes=generate_fallback_recipes(ingredients, filters))
+
+def _corpus_response(ingredients: List[str], matches: List[dict],
+                     filters: Optional[RecipeFilter] = None) -> Optional[RecipeListResponse]:
+    if CORPUS_MODE == "only":
+        return RecipeListResponse(recipes=matches) if matches else fallback_recipe_list(ingredients, filters)
+    if len(matches) >= CORPUS_MIN_RESULTS:
+        return RecipeListResponse(recipes=matches)
+    return None
+
+def corpus_recipe_list(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> Optional[RecipeListResponse]:
+    """
+    Serve a recipe list straight from the local corpus when it has enough good
+    matches (or always, in "only" mode). Filters are applied to the corpus
+    attribute masks before scoring. Returns None to defer to the providers.
+    """
+    if corpus is None:
+        return None
+
+    matches = corpus.search(ingredients, k=MAX_RECIPES, min_coverage=CORPUS_MIN_COVERAGE, filters=filters)
+    return _corpus_response(ingredients, matches, filters)
+
+def corpus_recipe_lists(pantries: List[List[str]],
+                        filters: List[Optional[RecipeFilter]]) -> List[Optional[RecipeListResponse]]:
+    """
+    Batch form of corpus_recipe_list, scoring every pantry in one vectorized pass.
+    """
+    if corpus is None or not pantries:
+        return [None] * len(pantries)
+
+    batches = corpus.search_batch(pantries, k=MAX_RECIPES, min_coverage=CORPUS_MIN_COVERAGE, filters=filters)
+    return [
+        _corpus_response(ingredients, matches, f)
+        for ingredients, matches, f in zip(pantries, batches, filters)
+    ]
+
+def remember_recipes(key: Tuple, response: RecipeListResponse) -> None:
+    """
+    Cache a validated provider answer by exact key and make it available to
+    similar pantries. Filtered answers (keyed by their filters) are not
+    offered to other pantries.
+    """
+    recipe_cache.set(key, response)
+    if SIMILAR_ENABLED and not key[0]:
+        similar_index.add(key[1], response)
+
+def similar_recipe_list(ingredients: List[str]) -> Optional[RecipeListResponse]:
+    """
+    Reuse the answer for a near-identical pantry, with each recipe's missing
+    list recomputed for this one. Returns None when nothing is similar enough.
+    """
+    if not SIMILAR_ENABLED:
+        return None
+
+    with timed("similarity"):
+        match = similar_index.lookup(ingredients)
+        if match is None:
+            return None
+        score, answered, response = match
+        recipes = [
+            recipe.model_copy(update={"missing": recompute_missing(recipe.missing, answered, ingredients)})
+            for recipe in response.recipes
+        ]
+    print(f"Reusing recipes from a pantry with {score:.2f} similarity")
+    return RecipeListResponse(recipes=recipes)
+
+def parse_recipe_list(response_text: str) -> Optional[RecipeListResponse]:
+    """
+    Extract and validate a recipe list from model output, or return None if unusable.
+    """
     try:
-        # Try OpenAI first (usually faster and more reliable)
-        print("Attempting OpenAI API...")
-        response_text = call_openai_model(prompt, max_tokens=2500)
-        
-        # If OpenAI failed, try Hugging Face
-        if response_text is None:
-            print("OpenAI unavailable, trying Hugging Face...")
-            response_text = call_huggingface_model(prompt, max_tokens=2500)
-        else:
-            print("✓ Using OpenAI-generated recipes")
-                
-        # If AI failed, use fallback
-        if response_text is None:
-            print("AI unavailable, using fallback recipe generator")
-            fallback_recipes = generate_fallback_recipes(req.ingredients)
-            return RecipeListResponse(recipes=fallback_recipes)
-        
-        # Extract JSON from response (sometimes models add extra text)
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        
-        if json_start == -1 or json_end == 0:
-            print("AI response invalid, using fallback")
-            fallback_recipes = generate_fallback_recipes(req.ingredients)
-            return RecipeListResponse(recipes=fallback_recipes)
-        
-        json_str = response_text[json_start:json_end]
-        
-        # Parse and validate JSON
-        try:
-            result = json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"JSON parse error: {str(e)}, using fallback")
-            fallback_recipes = generate_fallback_recipes(req.ingredients)
-            return RecipeListResponse(recipes=fallback_recipes)
-        
-        # Validate response structure
-        if "recipes" not in result:
-            print("Invalid AI response structure, using fallback")
-            fallback_recipes = generate_fallback_recipes(req.ingredients)
-            return RecipeListResponse(recipes=fallback_recipes)
-        
-        # Validate with Pydantic
-        validated_response = RecipeListResponse(**result)
-        return validated_response
-
-    except HTTPException:
-        raise
+        return decode_model_output(response_text, RecipeListResponse)
+    except ValueError as e:
+        print(f"AI response invalid: {str(e)}")
+        return None
+
+def verified_recipes(recipes: List[FilteredRecipe], filters: RecipeFilter) -> List[Recipe]:
+    """
+    Generated recipes that pass a cheap check against the filters, as plain
+    Recipes. Dropped ones are counted.
+    """
+    with timed("verify"):
+        passed = [
+            Recipe(id=r.id, title=r.title, missing=r.missing, reason=r.reason)
+            for r in recipes
+            if filters.check(r.title, r.missing, r.cuisine, r.meal_type, r.time_minutes)
+        ]
+    if len(passed) < len(recipes):
+        filter_rejections.inc(amount=len(recipes) - len(passed))
+        print(f"Dropped {len(recipes) - len(passed)} generated recipes that failed the filters")
+    return passed
+
+def parse_filtered_recipe_list(response_text: str, filters: RecipeFilter) -> Optional[RecipeListResponse]:
+    """
+    parse_recipe_list for a filtered prompt: recipes failing the filters are
+    dropped, and an answer with none left is unusable.
+    """
+    try:
+        decoded = decode_model_output(response_text, FilteredRecipeListResponse)
+    except ValueError as e:
+        print(f"AI response invalid: {str(e)}")
+        return None
+    recipes = verified_recipes(decoded.recipes, filters)
+    return RecipeListResponse(recipes=recipes) if recipes else None
+
+def provider_attempts(kind: str, task: str, prompt: str, max_tokens: int) -> List[Tuple[str, Callable]]:
+    """
+    Race attempts for a prompt. Healthy, fastest provider first; the next one
+    is the hedge. Open circuits are skipped, and a provider whose queue cannot
+    take the call within the remaining budget is shed so the race moves on.
+    A failed call is retried while the budget allows. With micro-batching on,
+    calls go through the batcher, which needs the bare task as well.
+    """
+    def attempt(name: str) -> Awaitable[Optional[str]]:
+        if batcher.enabled:
+            return batcher.submit(name, kind, task, prompt, max_tokens)
+        return admitted_call(
+            name, remaining(), call_with_retries, name, PROVIDER_CALLS[name], prompt, max_tokens=max_tokens
+        )
+
+    return [(name, lambda name=name: attempt(name)) for name in route(configured_providers())]
+
+async def recommend_recipes(ingredients: List[str],
+                            filters: Optional[RecipeFilter] = None) -> Tuple[RecipeListResponse, bool]:
+    """
+    Generate recipe suggestions for an ingredient list. Filters go into the
+    prompt and each answer is checked against them.
+    Returns the response and whether it came from an AI provider (False means fallback).
+    """
+    with timed("prompt_build"):
+        task = recipe_list_task(ingredients, filters)
+        prompt = build_recipe_list_prompt(ingredients, filters)
+
+    if filters is None:
+        kind, parse = "recipes", parse_recipe_list
+    else:
+        kind, parse = "recipes_filtered", lambda text: parse_filtered_recipe_list(text, filters)
+    attempts = provider_attempts(kind, task, prompt, max_tokens=2500)
+    hedge_delay = HEDGE_DELAY if EXECUTION_MODE == "race" else None
+
+    try:
+        winner = await race_providers(attempts, parse, hedge_delay, remaining())
     except Exception as e:
         print(f"Unexpected error: {str(e)}, using fallback")
-        fallback_recipes = generate_fallback_recipes(req.ingredients)
-        return RecipeListResponse(recipes=fallback_recipes)
-@app.post("/agent/recipe/details", response_model=RecipeDetailResponse)
-def generate_recipe_details(req: RecipeDetailRequest):
+        winner = None
+
+    if winner is None:
+        print("AI unavailable, using fallback recipe generator")
+        return fallback_recipe_list(ingredients, filters), False
+
+    provider, response = winner
+    print(f"✓ Using {provider}-generated recipes")
+    return response, True
+
+def parse_recipe_details(response_text: str) -> Optional[RecipeDetailResponse]:
+    """
+    Extract and validate recipe details from model output, or return None if unusable.
+    """
+    try:
+        return decode_model_output(response_text, RecipeDetailResponse)
+    except ValueError as e:
+        print(f"AI response invalid: {str(e)}")
+        return None
+
+def local_detail_response(recipe_id: str, ingredients: List[str], generic: bool = False) -> Optional[RecipeDetailResponse]:
+    """
+    Render details for a fallback recipe ID from the rule table, or None for
+    an ID it does not know. With `generic`, unknown IDs get a general method.
+    """
+    with timed("local_detail"):
+        detail = local_recipe_details(recipe_id, ingredients, generic)
+        return None if detail is None else RecipeDetailResponse(**detail)
+
+async def recipe_details(recipe_id: str, ingredients: List[str]) -> Tuple[RecipeDetailResponse, bool]:
+    """
+    Generate detailed recipe instructions for a recipe ID the rule table does
+    not know, with the same provider failover as recipe lists.
+    Returns the response and whether it came from an AI provider (False means
+    the generic local method).
+    """
+    with timed("prompt_build"):
+        task = recipe_details_task(recipe_id, ingredients)
+        prompt = build_recipe_details_prompt(recipe_id, ingredients)
+
+    attempts = provider_attempts("details", task, prompt, max_tokens=2000)
+    hedge_delay = HEDGE_DELAY if EXECUTION_MODE == "race" else None
+
+    try:
+        winner = await race_providers(attempts, parse_recipe_details, hedge_delay, remaining())
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}, using fallback")
+        winner = None
+
+    if winner is None:
+        print("AI unavailable, using generic recipe details")
+        fallbacks.inc("recipe/details")
+        return local_detail_response(recipe_id, ingredients, generic=True), False
+
+    provider, response = winner
+    print(f"✓ Using {provider}-generated recipe details")
+    return response, True
+
+# --------------------------------
+# Generate recipe list
+# --------------------------------
+async def recipe_list(ingredients: List[str], use_corpus: bool = True,
+                      filters: Optional[RecipeFilter] = None) -> RecipeListResponse:
+    """
+    Serve from the local corpus when it has enough matches, otherwise from the
+    result cache or persistent store, otherwise reuse the answer for a
+    near-identical pantry (unfiltered requests only), otherwise generate and
+    cache by normalized ingredient set and filters.
+    """
+    if use_corpus:
+        local = corpus_recipe_list(ingredients, filters)
+        if local is not None:
+            return local
+
+    key = cache_key(ingredients, filters=filters_key(filters))
+    cached = recipe_cache.get(key)
+    if cached is None:
+        cached = fallback_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def generate() -> RecipeListResponse:
+        stored = await stored_result("recipes", key, RecipeListResponse)
+        if stored is not None:
+            remember_recipes(key, stored)
+            return stored
+
+        similar = similar_recipe_list(ingredients) if filters is None else None
+        if similar is not None:
+            recipe_cache.set(key, similar)
+            return similar
+
+        response, from_ai = await recommend_recipes(ingredients, filters)
+        if from_ai:
+            remember_recipes(key, response)
+            result_store.put("recipes", key, response.model_dump_json())
+        elif response.recipes:
+            # An empty list (nothing passed the filters) is not worth keeping
+            fallback_cache.set(key, response)
+        return response
+
+    # Concurrent requests for the same pantry share one provider call
+    return await inflight.do(("recipes", key), generate)
+
+@app.post("/agent/recipes", response_model=RecipeListResponse, dependencies=[Depends(rate_limit)])
+async def generate_recipe_list(req: IngredientRequest):
+    """
+    Generate a list of recipe suggestions based on user ingredients.
+    Serves from the local corpus when it has enough matches, otherwise uses AI
+    when available and falls back to programmatic generation. Optional
+    filters (diet, cuisine, meal_type, max_time) apply to every source.
+    Results are cached by normalized ingredient set and filters.
+    """
+    if not req.ingredients:
+        raise HTTPException(status_code=400, detail="Ingredients list cannot be empty")
+    
+    response = await recipe_list(req.ingredients, filters=request_filters(req.filters))
+    prefetch_details(req.ingredients, response)
+    return ModelResponse(response)
+
+# --------------------------------
+# Batch recipe lists
+# --------------------------------
+BATCH_MAX_ITEMS = int(os.getenv("AGENT_BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "8"))
+
+@app.post("/agent/recipes/batch", response_model=BatchRecipeListResponse, dependencies=[Depends(rate_limit)])
+async def generate_recipe_list_batch(req: BatchIngredientRequest):
+    """
+    Generate recipe lists for many pantries in one call, returned in request order.
+    Identical pantries (after normalization) are generated once, the rest run
+    concurrently up to AGENT_BATCH_CONCURRENCY, and a failing item falls back
+    to programmatic generation without failing the batch.
+    """
+    if not req.requests:
+        raise HTTPException(status_code=400, detail="Batch cannot be empty")
+
+    if len(req.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} requests")
+
+    filters = [request_filters(item.filters) for item in req.requests]
+    keys = [cache_key(item.ingredients, filters=filters_key(f)) for item, f in zip(req.requests, filters)]
+    unique = {}
+    for key, item, f in zip(keys, req.requests, filters):
+        if item.ingredients:
+            unique.setdefault(key, (item.ingredients, f))
+
+    pantries = [ingredients for ingredients, _ in unique.values()]
+    pantry_filters = [f for _, f in unique.values()]
+    local = corpus_recipe_lists(pantries, pantry_filters)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(ingredients: List[str], f: Optional[RecipeFilter],
+                  served: Optional[RecipeListResponse]) -> RecipeListResponse:
+        if served is not None:
+            return served
+        async with semaphore:
+            try:
+                return await recipe_list(ingredients, use_corpus=False, filters=f)
+            except Exception as e:
+                print(f"Batch item failed: {str(e)}, using fallback")
+                return fallback_recipe_list(ingredients, f)
+
+    results = await asyncio.gather(*(run(p, f, served) for p, f, served in zip(pantries, pantry_filters, local)))
+    by_key = dict(zip(unique, results))
+    empty = RecipeListResponse(recipes=[])
+    return ModelResponse(BatchRecipeListResponse(results=[by_key.get(key, empty) for key in keys]))
+
+# --------------------------------
+# Stream recipe list
+# --------------------------------
+def _ndjson(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+def _recipe_event(recipe: Recipe) -> str:
+    return '{"type": "recipe", "recipe": ' + recipe.model_dump_json() + '}\n'
+
+async def _next_chunk(stream: AsyncIterator[str]) -> Optional[str]:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def recipe_stream_lines(ingredients: List[str], filters: Optional[RecipeFilter] = None) -> AsyncIterator[str]:
+    """
+    Yield NDJSON events: one {"type": "recipe"} line per recipe as soon as the
+    model closes its object, then a {"type": "done"} summary. If the stream
+    breaks, the remaining slots are filled from the fallback generator. With
+    filters, each streamed recipe is checked before it is sent.
+    """
+    key = cache_key(ingredients, filters=filters_key(filters))
+    cached = recipe_cache.get(key)
+    if cached is not None:
+        for recipe in cached.recipes:
+            yield _recipe_event(recipe)
+        yield _ndjson({"type": "done", "ai": len(cached.recipes), "fallback": 0, "cached": True})
+        return
+
+    with timed("prompt_build"):
+        prompt = build_recipe_list_prompt(ingredients, filters)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + remaining()
+    recipes: List[Recipe] = []
+    seen = set()
+
+    for provider in route(configured_providers()):
+        health = get_health(provider)
+        if not health.acquire():
+            continue
+        started = loop.time()
+        produced = len(recipes)
+        parser = RecipeStreamParser()
+        stream = PROVIDER_STREAMS[provider](prompt, max_tokens=2500)
+        try:
+            async with get_limiter(provider).slot(deadline - loop.time()), aclosing(stream):
+                while not parser.done and len(recipes) < MAX_RECIPES:
+                    chunk = await asyncio.wait_for(_next_chunk(stream), timeout=deadline - loop.time())
+                    if chunk is None:
+                        break
+                    for obj in parser.feed(chunk):
+                        try:
+                            with timed("validate"):
+                                recipe = Recipe(**obj) if filters is None else FilteredRecipe(**obj)
+                        except Exception:
+                            continue
+                        if filters is not None:
+                            verified = verified_recipes([recipe], filters)
+                            if not verified:
+                                continue
+                            recipe = verified[0]
+                        if recipe.id in seen or len(recipes) >= MAX_RECIPES:
+                            continue
+                        seen.add(recipe.id)
+                        recipes.append(recipe)
+                        yield _recipe_event(recipe)
+        except LoadShed as e:
+            # Not the provider's fault: no breaker outcome, try the next one
+            health.release()
+            print(str(e))
+            continue
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away (task cancelled, or the response closed the
+            # generator at a yield): give back a half-open probe, as tracked_call does
+            health.release()
+            provider_calls.inc(provider, "cancelled")
+            raise
+        except Exception as e:
+            print(f"{provider} stream interrupted: {type(e).__name__} {str(e)}")
+
+        observe_stage("provider_stream", loop.time() - started, provider)
+        if len(recipes) > produced:
+            health.record_success(loop.time() - started)
+            provider_calls.inc(provider, "success")
+        else:
+            health.record_failure()
+            provider_calls.inc(provider, "failure")
+
+        if recipes or loop.time() >= deadline:
+            break
+
+    ai_count = len(recipes)
+    if ai_count < MAX_RECIPES:
+        print(f"Stream produced {ai_count} recipes, filling the rest from fallback")
+        fallbacks.inc("recipes/stream")
+        with timed("fallback"):
+            fill = generate_fallback_recipes(ingredients, filters)
+        for item in fill:
+            if len(recipes) >= MAX_RECIPES:
+                break
+            if item["id"] in seen:
+                continue
+            seen.add(item["id"])
+            recipes.append(Recipe(**item))
+            yield _ndjson({"type": "recipe", "recipe": item})
+    else:
+        response = RecipeListResponse(recipes=recipes)
+        remember_recipes(key, response)
+        result_store.put("recipes", key, response.model_dump_json())
+
+    yield _ndjson({"type": "done", "ai": ai_count, "fallback": len(recipes) - ai_count, "cached": False})
+
+@app.post("/agent/recipes/stream", dependencies=[Depends(rate_limit)])
+async def stream_recipe_list(req: IngredientRequest):
+    """
+    Streaming variant of /agent/recipes that emits recipes as NDJSON while the model generates them.
+    """
+    if not req.ingredients:
+        raise HTTPException(status_code=400, detail="Ingredients list cannot be empty")
+
+    filters = request_filters(req.filters)
+    return StreamingResponse(recipe_stream_lines(req.ingredients, filters), media_type="application/x-ndjson")
+
+# --------------------------------
+# Generate recipe details
+# --------------------------------
+async def detail_for_key(key: Tuple) -> RecipeDetailResponse:
+    """
+    Serve details from the cache, or join/start the single in-flight generation
+    for this (recipe_id, ingredient set) key, which checks the persistent
+    store before calling a provider. Only provider answers are cached.
+    """
+    cached = detail_cache.get(key)
+    if cached is not None:
+        return cached
+
+    recipe_id, ingredients = key
+
+    async def generate() -> RecipeDetailResponse:
+        response = await stored_result("details", key, RecipeDetailResponse)
+        if response is None:
+            response, from_ai = await recipe_details(recipe_id, list(ingredients))
+            if not from_ai:
+                return response
+            result_store.put("details", key, response.model_dump_json())
+        detail_cache.set(key, response)
+        return response
+
+    return await inflight.do(("details", key), generate)
+
+def prefetch_details(ingredients: List[str], response: RecipeListResponse) -> None:
+    """
+    Speculatively generate details for the first recipes of a list response.
+    Fallback recipe IDs are skipped; their details are rendered locally.
+    """
+    keys = [cache_key(ingredients, recipe.id) for recipe in response.recipes[:prefetcher.depth]]
+    keys = [
+        key for key in keys
+        if key[0] not in fallback_engine.rules.details
+        and key not in detail_cache and not inflight.in_flight(("details", key))
+    ]
+    prefetcher.schedule(keys, detail_for_key)
+
+@app.post("/agent/recipe/details", response_model=RecipeDetailResponse, dependencies=[Depends(rate_limit)])
+async def generate_recipe_details(req: RecipeDetailRequest):
     """
     Generate detailed recipe instructions based on recipe ID and user ingredients.
+    Fallback recipe IDs are served from local templates; other IDs go to the
+    providers, with a generic method if none of them answers.
     """
     if not req.recipe_id:
         raise HTTPException(status_code=400, detail="Recipe ID cannot be empty")
@@ -481,65 +850,121 @@ def generate_recipe_details(req: RecipeDetailRequest):
     if not req.ingredients:
         raise HTTPException(status_code=400, detail="Ingredients list cannot be empty")
     
-    prompt = f"""You are a cooking assistant. Generate a complete recipe for "{req.recipe_id}" using these ingredients: {', '.join(req.ingredients)}.
+    # Fallback recipe IDs are rendered from the rule table for the pantry as
+    # given, so {match} agrees with the title in the recipe list
+    local = local_detail_response(req.recipe_id, req.ingredients)
+    if local is not None:
+        return ModelResponse(local)
 
-Return ONLY valid JSON in this exact format (no other text):
-{{
-  "title": "Recipe Title",
-  "ingredients": [
-    {{ "name": "ingredient name", "required": true }}
-  ],
-  "steps": [
-    "Step 1: First instruction",
-    "Step 2: Second instruction"
-  ],
-  "tips": ["Helpful tip 1", "Helpful tip 2"]
-}}
+    key = cache_key(req.ingredients, req.recipe_id)
+    prefetcher.record_request(key)
+    return ModelResponse(await detail_for_key(key))
 
-Rules:
-- Include clear step-by-step instructions
-- Prefer user's ingredients
-- Mention substitutions if needed
-- Return ONLY the JSON, nothing else"""
+# --------------------------------
+# Pantry sessions
+# --------------------------------
+async def session_recipes(session: Session) -> List[dict]:
+    """
+    The session's recipe list: its incremental corpus ranking when that
+    qualifies under the corpus settings, otherwise the regular list path
+    (cache, store, similar pantries, providers, fallback).
+    """
+    if not session.ingredients:
+        return []
+    response = None
+    if session.ranking is not None:
+        response = _corpus_response(session.ingredients, session.ranking.results(), session.filters)
+    if response is None:
+        response = await recipe_list(session.ingredients, use_corpus=False, filters=session.filters)
+    return [recipe.model_dump() for recipe in response.recipes[:session.k]]
+
+async def get_session(session_id: str) -> Session:
+    session = await session_store.get(session_id, corpus, CORPUS_MIN_COVERAGE)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+def session_response(session: Session) -> SessionResponse:
+    return SessionResponse(
+        session_id=session.id, version=session.version,
+        ingredients=session.ingredients, recipes=session.recipes,
+    )
 
+@app.post("/agent/sessions", response_model=SessionResponse, dependencies=[Depends(rate_limit)])
+async def create_session(req: SessionCreateRequest):
+    """
+    Start a pantry session and return its full recipe list. Later changes go
+    through /agent/sessions/{session_id}/delta; filters hold for the session.
+    """
+    filters = request_filters(req.filters)
+    session = session_store.create(req.k, corpus, CORPUS_MIN_COVERAGE, filters)
     try:
-        response_text = call_huggingface_model(prompt, max_tokens=2000)
-        
-        # Extract JSON from response
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        
-        if json_start == -1 or json_end == 0:
-            raise HTTPException(
-                status_code=500,
-                detail="Model did not return valid JSON"
-            )
-        
-        json_str = response_text[json_start:json_end]
-        
-        # Parse and validate JSON
-        try:
-            result = json.loads(json_str)
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to parse model response as JSON: {str(e)}"
+        session.update(add=req.ingredients)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Not listed until saved, so nothing else can reach it yet
+    session.recipes = await session_recipes(session)
+    session.version = 1
+    await session_store.save(session, 0)
+    return session_response(session)
+
+@app.get("/agent/sessions/{session_id}", response_model=SessionResponse, dependencies=[Depends(rate_limit)])
+async def read_session(session_id: str):
+    """
+    Return a session's current pantry and recipe list, e.g. to resync a client.
+    """
+    return session_response(await get_session(session_id))
+
+@app.post("/agent/sessions/{session_id}/delta", response_model=SessionDiffResponse, dependencies=[Depends(rate_limit)])
+async def apply_session_delta(session_id: str, req: SessionDeltaRequest):
+    """
+    Add and/or remove pantry ingredients. Only recipes using the changed
+    ingredients are rescored, and the response lists what entered or left
+    the top k and which listed recipes changed, plus the new order.
+    """
+    for _ in range(SESSION_SAVE_ATTEMPTS):
+        session = await get_session(session_id)
+        async with session.lock:
+            base = session.version
+            before = session.recipes
+            try:
+                session.update(add=req.add, remove=req.remove)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            session.recipes = await session_recipes(session)
+            session.version = base + 1
+            if not await session_store.save(session, base):
+                # Another worker changed (or deleted) the session meanwhile;
+                # apply the delta again on top of its state
+                continue
+            session_store.deltas += 1
+
+            entered, left, updated = recipe_diff(before, session.recipes)
+            return SessionDiffResponse(
+                session_id=session.id,
+                version=session.version,
+                ingredients=session.ingredients,
+                entered=[RankedRecipe(rank=rank, recipe=recipe) for rank, recipe in entered],
+                left=left,
+                updated=[RankedRecipe(rank=rank, recipe=recipe) for rank, recipe in updated],
+                order=[recipe["id"] for recipe in session.recipes],
             )
-        
-        # Validate with Pydantic
-        validated_response = RecipeDetailResponse(**result)
-        return validated_response
+    raise HTTPException(status_code=409, detail="Session is being changed concurrently; retry the delta")
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+@app.delete("/agent/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """
+    End a session early instead of waiting for idle expiry.
+    """
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"deleted": True}
 
 # --------------------------------
 # Health check
 # --------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     """
     Health check endpoint to verify the API is running.
     """
@@ -553,5 +978,46 @@ def health_check():
         "status": "healthy",
         "message": "Recipe Agent API is running",
         "ai_providers": apis_configured if apis_configured else ["Programmatic Fallback Only"],
-        "model_priority": "OpenAI → Hugging Face → Programmatic"
-    }
\ No newline at end of file
+        "model_priority": "OpenAI → Hugging Face → Programmatic",
+        "execution_mode": EXECUTION_MODE,
+        "corpus": {"mode": CORPUS_MODE, "recipes": len(corpus) if corpus is not None else 0},
+        "cache": {
+            "recipes": recipe_cache.stats(),
+            "details": detail_cache.stats(),
+            "fallback": fallback_cache.stats(),
+        },
+        "coalescing": inflight.stats(),
+        "providers": health_snapshot(),
+        "prefetch": prefetcher.stats(),
+        "fallback_rules": fallback_engine.stats(),
+        "store": await result_store.stats(),
+        "similarity": similar_index.stats(),
+        "admission": admission_stats(),
+        "batching": batcher.stats(),
+        "sessions": session_store.stats(),
+        "client_rate_limit": client_limiter.stats(),
+    }
+
+# --------------------------------
+# Metrics
+# --------------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus text-format metrics: stage latency histograms, provider
+    outcome and token counters, cache and circuit state.
+    """
+    for name, cache in (("recipes", recipe_cache), ("details", detail_cache), ("fallback", fallback_cache)):
+        stats = cache.stats()
+        cache_size.set(name, value=stats["size"])
+        for event in ("hits", "misses", "evictions"):
+            cache_events.set(name, event, value=stats[event])
+
+    for name, stats in admission_stats().items():
+        provider_queue.set(name, "active", value=stats["active"])
+        provider_queue.set(name, "waiting", value=stats["waiting"])
+
+    for name, snapshot in health_snapshot().items():
+        circuit_open.set(name, value=0 if snapshot["state"] == "closed" else 1)
+
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
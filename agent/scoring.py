@@ -0,0 +1,187 @@
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# --------------------------------
+# Scoring settings
+# --------------------------------
+# score = coverage + OPTIONAL_WEIGHT * optional_coverage - MISSING_PENALTY * missing
+OPTIONAL_WEIGHT = float(os.getenv("AGENT_SCORE_OPTIONAL_WEIGHT", "0.1"))
+MISSING_PENALTY = float(os.getenv("AGENT_SCORE_MISSING_PENALTY", "0.01"))
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den > 0)
+
+
+def weighted_score(
+    hits: np.ndarray, totals: np.ndarray, opt_hits: np.ndarray, opt_totals: np.ndarray
+) -> np.ndarray:
+    """
+    Combine required coverage, optional coverage and missing count into one score.
+    """
+    return _ratio(hits, totals) + OPTIONAL_WEIGHT * _ratio(opt_hits, opt_totals) - MISSING_PENALTY * (totals - hits)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first. Entries scored -inf are
+    excluded, and equal scores rank by lower index (callers pass scores in
+    recipe row order, so ties always break by row).
+    """
+    valid = np.count_nonzero(scores > -np.inf)
+    k = min(k, valid)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        # argpartition picks arbitrarily among scores tied with the k-th, so
+        # take everything above it and fill up with the lowest tied indices
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > kth)
+        top = np.concatenate((above, np.flatnonzero(scores == kth)[:k - above.size]))
+    else:
+        top = np.arange(scores.size)
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class ScoringEngine:
+    """
+    Vectorized pantry-to-recipe scoring over a sparse recipe x ingredient matrix.
+
+    Recipes are rows of 0/1 CSR matrices over interned ingredient IDs (one for
+    required, one for optional ingredients). A pantry is a 0/1 vector over the
+    same vocabulary, so one sparse matrix-vector product yields the hit count
+    of every recipe. Stacking pantries as columns scores a whole batch with a
+    single sparse matrix-matrix product.
+    """
+
+    def __init__(
+        self,
+        n_ingredients: int,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        opt_indptr: np.ndarray,
+        opt_indices: np.ndarray,
+    ):
+        self.n_ingredients = n_ingredients
+        self.required = _matrix(indptr, indices, n_ingredients)
+        self.optional = _matrix(opt_indptr, opt_indices, n_ingredients)
+        self._required_t = self.required.T.tocsr()
+        self._optional_t = self.optional.T.tocsr()
+        self.totals = np.diff(indptr).astype(np.int32)
+        self.opt_totals = np.diff(opt_indptr).astype(np.int32)
+
+    @property
+    def n_recipes(self) -> int:
+        return self.totals.size
+
+    def pantry_vector(self, ingredient_ids: Iterable[int]) -> np.ndarray:
+        vec = np.zeros(self.n_ingredients, dtype=np.int32)
+        vec[list(ingredient_ids)] = 1
+        return vec
+
+    def pantry_matrix(self, pantries: Sequence[Iterable[int]]) -> sparse.csc_matrix:
+        """
+        Stack pantries as the columns of a sparse (ingredients x pantries) matrix.
+        """
+        rows = [i for ids in pantries for i in ids]
+        cols = [col for col, ids in enumerate(pantries) for _ in ids]
+        return sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(self.n_ingredients, len(pantries)),
+        )
+
+    def score(self, pantry) -> Dict[str, np.ndarray]:
+        """
+        Score every recipe against a pantry vector, or densely against an
+        (ingredients x pantries) matrix in which case every array is (recipes x pantries).
+        Returns hits, missing, coverage and score arrays.
+        """
+        hits = _dense(self.required @ pantry)
+        opt_hits = _dense(self.optional @ pantry)
+        shape = (-1, 1) if hits.ndim == 2 else (-1,)
+        totals = self.totals.reshape(shape)
+        return {
+            "hits": hits,
+            "missing": totals - hits,
+            "coverage": _ratio(hits, totals),
+            "score": weighted_score(hits, totals, opt_hits, self.opt_totals.reshape(shape)),
+        }
+
+    def top_k(self, pantry: np.ndarray, k: int, min_coverage: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best k recipe rows for one pantry vector and their required hit counts.
+        """
+        scored = self.score(pantry)
+        scores = scored["score"]
+        # Recipes without a single required hit, or under min_coverage, never rank
+        scores[(scored["hits"] == 0) | (scored["hits"] < min_coverage * self.totals)] = -np.inf
+        rows = top_k(scores, k)
+        return rows, scored["hits"][rows]
+
+    def top_k_batch(
+        self,
+        pantries: sparse.csc_matrix,
+        k: int,
+        min_coverage: float = 0.0,
+        allow: Optional[Sequence[Optional[Callable[[np.ndarray], np.ndarray]]]] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Best k recipe rows (and hit counts) for each pantry column of a matrix.
+
+        The batch stays sparse end to end: the (pantries x recipes) hit matrix
+        only holds recipes sharing an ingredient with a pantry, scores are
+        computed on its stored entries in one pass, and each pantry's top k
+        is an argpartition over its own row. `allow` optionally gives, per
+        pantry, a recipe-row predicate; entries it rejects are dropped before
+        scoring.
+        """
+        by_pantry = pantries.T.tocsr()
+        hits = (by_pantry @ self._required_t).tocsr()
+        hits.sort_indices()
+        present = hits.copy()
+        present.data = np.ones_like(present.data)
+        opt_hits = (by_pantry @ self._optional_t).multiply(present).tocsr()
+
+        # Align optional hits onto the required-hit structure
+        opt_data = np.zeros(hits.data.size, dtype=np.int32)
+        if opt_hits.nnz:
+            opt_hits.sort_indices()
+            opt_rows = np.repeat(np.arange(opt_hits.shape[0]), np.diff(opt_hits.indptr))
+            keys = np.repeat(np.arange(hits.shape[0]), np.diff(hits.indptr)).astype(np.int64) * self.n_recipes + hits.indices
+            opt_keys = opt_rows.astype(np.int64) * self.n_recipes + opt_hits.indices
+            opt_data[np.searchsorted(keys, opt_keys)] = opt_hits.data
+
+        cols, hit_data, indptr = hits.indices, hits.data, hits.indptr
+        if allow is not None:
+            keep = np.ones(cols.size, dtype=bool)
+            for row, allowed in enumerate(allow):
+                if allowed is not None:
+                    lo, hi = indptr[row], indptr[row + 1]
+                    keep[lo:hi] = allowed(cols[lo:hi])
+            cols, hit_data, opt_data = cols[keep], hit_data[keep], opt_data[keep]
+            indptr = np.concatenate(([0], np.cumsum(keep)))[indptr]
+
+        # Scored exactly like RecipeCorpus.search (float64 weighted_score), so
+        # equal scores tie and rank by row in both
+        totals = self.totals[cols]
+        scores = weighted_score(hit_data, totals, opt_data, self.opt_totals[cols])
+        scores[hit_data < min_coverage * totals] = -np.inf
+
+        results = []
+        for row in range(hits.shape[0]):
+            lo, hi = indptr[row], indptr[row + 1]
+            top = top_k(scores[lo:hi], k)
+            results.append((cols[lo:hi][top], hit_data[lo:hi][top]))
+        return results
+
+
+def _matrix(indptr: np.ndarray, indices: np.ndarray, n_cols: int) -> sparse.csr_matrix:
+    data = np.ones(indices.size, dtype=np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(indptr.size - 1, n_cols))
+
+
+def _dense(product) -> np.ndarray:
+    return product.toarray() if sparse.issparse(product) else np.asarray(product)
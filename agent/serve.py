@@ -0,0 +1,201 @@
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+# --------------------------------
+# Production server
+# --------------------------------
+# Runs the agent in N worker processes sharing one listening socket, so JSON
+# parsing, validation and the fallback generator are not serialized on one
+# GIL. Hot data is shared between workers rather than copied:
+#
+#   - the recipe corpus is memory-mapped (a JSON corpus is compiled to the
+#     binary format once, before the workers start)
+#   - validated results go through the SQLite store (when AGENT_STORE_PATH is
+#     set), which every worker reads through its memory map, with a
+#     per-worker in-process cache in front
+#   - provider circuit state and per-client rate-limit buckets live in shared
+#     memory-mapped tables, so a client's rate holds across all workers
+#   - pantry session state lives in a shared SQLite file, so any worker can
+#     serve any session (each rebuilds its own ranking from the pantry)
+#
+# Workers are recycled gracefully after --max-requests requests or --max-age
+# seconds (both jittered so workers do not restart together); a replacement
+# is started before the old worker is asked to finish its in-flight requests.
+# SIGHUP triggers a rolling restart of every worker, SIGTERM/SIGINT a
+# graceful shutdown.
+#
+#   python serve.py --workers 4 --port 8000
+
+multiprocessing.allow_connection_pickling()
+spawn = multiprocessing.get_context("spawn")
+
+GRACEFUL_TIMEOUT = int(os.getenv("AGENT_GRACEFUL_TIMEOUT", "30"))
+
+
+def run_worker(sockets: List[socket.socket], max_requests: Optional[int], log_level: str) -> None:
+    import uvicorn
+
+    config = uvicorn.Config(
+        "recipe_agent:app",
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        log_level=log_level,
+    )
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def jitter(value: Optional[float], spread: float = 0.1) -> Optional[float]:
+    if not value:
+        return None
+    return value * random.uniform(1 - spread, 1 + spread)
+
+
+def prepare_shared_state(workdir: str) -> None:
+    """
+    Set up the data every worker maps instead of loading its own copy.
+    Settings are passed to the workers through the environment.
+    """
+    from corpus import CORPUS_MODE, CORPUS_PATH, RecipeCorpus
+
+    if CORPUS_MODE != "off" and CORPUS_PATH.endswith(".json") and os.path.exists(CORPUS_PATH):
+        binary = os.path.join(workdir, "corpus.bin")
+        RecipeCorpus.from_json(CORPUS_PATH).save_binary(binary)
+        os.environ["AGENT_CORPUS_PATH"] = binary
+        print(f"Compiled {CORPUS_PATH} to {binary} for shared mapping")
+
+    os.environ.setdefault("AGENT_BREAKER_SHARED_PATH", os.path.join(workdir, "circuits"))
+    os.environ.setdefault("AGENT_CLIENT_SHARED_PATH", os.path.join(workdir, "clients"))
+    os.environ.setdefault("AGENT_SESSION_SHARED_PATH", os.path.join(workdir, "sessions.db"))
+
+
+class Supervisor:
+    """
+    Keeps `workers` processes serving and recycles them one at a time.
+    """
+
+    def __init__(self, sock: socket.socket, workers: int, max_requests: Optional[int],
+                 max_age: Optional[float], log_level: str):
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_age = max_age
+        self.log_level = log_level
+        self.stopping = False
+        self.recycled = 0
+        # pid -> (process, recycle deadline or None)
+        self._procs: Dict[int, list] = {}
+        self._retiring: Dict[int, multiprocessing.Process] = {}
+
+    def spawn_worker(self) -> None:
+        max_requests = jitter(self.max_requests)
+        process = spawn.Process(
+            target=run_worker,
+            args=([self.sock], int(max_requests) if max_requests else None, self.log_level),
+        )
+        process.start()
+        deadline = time.monotonic() + jitter(self.max_age) if self.max_age else None
+        self._procs[process.pid] = [process, deadline]
+        print(f"Started worker {process.pid}")
+
+    def retire(self, pid: int) -> None:
+        # Replacement first, so capacity never drops during a recycle
+        process, _ = self._procs.pop(pid)
+        self.spawn_worker()
+        process.terminate()
+        self._retiring[pid] = process
+        self.recycled += 1
+        print(f"Recycling worker {pid}")
+
+    def rolling_restart(self) -> None:
+        now = time.monotonic()
+        for offset, entry in enumerate(self._procs.values()):
+            entry[1] = now + offset * 2
+
+    def tick(self) -> None:
+        for pid, (process, _) in list(self._procs.items()):
+            if not process.is_alive():
+                del self._procs[pid]
+                print(f"Worker {pid} exited with code {process.exitcode}")
+        for pid, process in list(self._retiring.items()):
+            if not process.is_alive():
+                process.join()
+                del self._retiring[pid]
+
+        while len(self._procs) < self.workers:
+            self.spawn_worker()
+
+        # At most one age-based recycle in progress at a time
+        if not self._retiring:
+            now = time.monotonic()
+            for pid, (_, deadline) in list(self._procs.items()):
+                if deadline is not None and now >= deadline:
+                    self.retire(pid)
+                    break
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGHUP, lambda *_: self.rolling_restart())
+
+        while not self.stopping:
+            self.tick()
+            # Wake as soon as any worker exits so its replacement starts at once
+            sentinels = [entry[0].sentinel for entry in self._procs.values()]
+            sentinels += [process.sentinel for process in self._retiring.values()]
+            multiprocessing.connection.wait(sentinels, timeout=0.5)
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        print("Shutting down workers")
+        processes = [entry[0] for entry in self._procs.values()] + list(self._retiring.values())
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the recipe agent with multiple worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("AGENT_WORKER_MAX_REQUESTS", "10000")),
+                        help="Recycle a worker after about this many requests (0 disables)")
+    parser.add_argument("--max-age", type=float, default=float(os.getenv("AGENT_WORKER_MAX_AGE", "0")),
+                        help="Recycle a worker after about this many seconds (0 disables)")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="recipe-agent-")
+    prepare_shared_state(workdir)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+
+    supervisor = Supervisor(sock, args.workers, args.max_requests or None, args.max_age or None, args.log_level)
+    try:
+        supervisor.run()
+    finally:
+        sock.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from corpus import RecipeCorpus, normalize_name
+from filters import RecipeFilter, compile_filter
+from scoring import top_k, weighted_score
+
+# --------------------------------
+# Pantry session settings
+# --------------------------------
+# A session holds one user's pantry and its ranked candidates so that adding
+# or removing an ingredient only rescores the recipes that use it. At most
+# SESSION_MAX sessions are kept (least recently used dropped first), each
+# expires after SESSION_TTL idle seconds, and a pantry is capped at
+# SESSION_MAX_INGREDIENTS items.
+SESSION_MAX = int(os.getenv("AGENT_SESSION_MAX", "2000"))
+SESSION_TTL = float(os.getenv("AGENT_SESSION_TTL", "1800"))
+SESSION_MAX_INGREDIENTS = int(os.getenv("AGENT_SESSION_MAX_INGREDIENTS", "50"))
+
+# When set (serve.py does this for its workers), session state lives in this
+# SQLite file so any worker can serve any session. Each worker keeps its own
+# rankings and rebuilds one from the stored pantry when it sees a session (or
+# a newer version of it) for the first time.
+SESSION_SHARED_PATH = os.getenv("AGENT_SESSION_SHARED_PATH", "")
+
+# Reads refresh a shared session's idle timer at most this often
+_TOUCH_INTERVAL = 30
+# A delta that loses a race with another worker is applied again on top of
+# the winner's state this many times in all before the client gets a 409
+SESSION_SAVE_ATTEMPTS = 3
+
+
+class CorpusRanking:
+    """
+    Incremental corpus ranking for one pantry.
+
+    Keeps, for every recipe sharing an ingredient with the pantry, its
+    required and optional hit counts and score in arrays sorted by row. An
+    ingredient delta walks only that ingredient's posting lists, so only the
+    recipes using it are rescored. Recipes the session's filters exclude never
+    become candidates. Rankings match RecipeCorpus.search, including the
+    order of tied recipes (lower row first).
+    """
+
+    def __init__(self, corpus: RecipeCorpus, k: int, min_coverage: float, filters: Optional[RecipeFilter] = None):
+        self.corpus = corpus
+        self.k = k
+        self.min_coverage = min_coverage
+        self.filters = filters
+        self.rows = np.empty(0, dtype=np.int64)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.opt_hits = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0, dtype=np.float64)
+        # ingredient id -> pantry names mapping to it ("Egg" and "egg " share one)
+        self.pantry: Dict[int, int] = {}
+        self.top = np.empty(0, dtype=np.int64)
+        self._missing: Dict[int, List[str]] = {}
+
+    @property
+    def candidates(self) -> int:
+        return int(self.rows.size)
+
+    def _positions(self, rows: np.ndarray, insert: bool) -> np.ndarray:
+        # Positions of `rows` in self.rows, adding any that are not there yet
+        pos = np.searchsorted(self.rows, rows)
+        if self.rows.size:
+            found = (pos < self.rows.size) & (self.rows[np.minimum(pos, self.rows.size - 1)] == rows)
+        else:
+            found = np.zeros(rows.size, dtype=bool)
+        if insert and not found.all():
+            new = rows[~found]
+            at = pos[~found]
+            self.rows = np.insert(self.rows, at, new)
+            self.hits = np.insert(self.hits, at, 0)
+            self.opt_hits = np.insert(self.opt_hits, at, 0)
+            self.scores = np.insert(self.scores, at, -np.inf)
+            pos = np.searchsorted(self.rows, rows)
+        return pos
+
+    def apply(self, ingredient: int, sign: int) -> np.ndarray:
+        """
+        Add (sign 1) or remove (sign -1) one ingredient id and rescore the
+        recipes that use it. Returns the rows whose required hits changed.
+        """
+        c = self.corpus
+        required = c.post_indices[c.post_indptr[ingredient]:c.post_indptr[ingredient + 1]].astype(np.int64)
+        optional = c.opt_post_indices[c.opt_post_indptr[ingredient]:c.opt_post_indptr[ingredient + 1]].astype(np.int64)
+        if self.filters is not None:
+            required = required[c.allowed(required, self.filters)]
+            optional = optional[c.allowed(optional, self.filters)]
+
+        if sign > 0:
+            # Insert every new row first so the positions below stay valid
+            self._positions(np.union1d(required, optional), insert=True)
+        pos = self._positions(required, insert=False)
+        self.hits[pos] += sign
+        opt_pos = self._positions(optional, insert=False)
+        self.opt_hits[opt_pos] += sign
+
+        touched = np.union1d(pos, opt_pos)
+        rows = self.rows[touched]
+        totals = c.indptr[rows + 1] - c.indptr[rows]
+        opt_totals = c.opt_indptr[rows + 1] - c.opt_indptr[rows]
+        hits = self.hits[touched]
+        scores = weighted_score(hits, totals, self.opt_hits[touched], opt_totals)
+        # Same rule as search: only recipes with a required hit, at min_coverage
+        scores[(hits == 0) | (hits < self.min_coverage * totals)] = -np.inf
+        self.scores[touched] = scores
+
+        if sign > 0:
+            # Scores only went up, so the new top k is among the old top k and
+            # the rescored recipes
+            pool = np.union1d(self._positions(self.top, insert=False), touched)
+            self.top = self.rows[pool[top_k(self.scores[pool], self.k)]]
+        else:
+            # Rows that no longer share anything with the pantry are dropped
+            keep = (self.hits > 0) | (self.opt_hits > 0)
+            if not keep.all():
+                self.rows, self.hits = self.rows[keep], self.hits[keep]
+                self.opt_hits, self.scores = self.opt_hits[keep], self.scores[keep]
+            self.top = self.rows[top_k(self.scores, self.k)]
+
+        # Cached missing lists are kept for listed recipes that do not use
+        # this ingredient
+        listed = set(self.top.tolist())
+        self._missing = {
+            row: missing for row, missing in self._missing.items()
+            if row in listed and ingredient not in c.required(row)
+        }
+        return required
+
+    def add(self, name: str) -> Optional[np.ndarray]:
+        ingredient = self.corpus.ingredient_id(name)
+        if ingredient is None:
+            return None
+        self.pantry[ingredient] = self.pantry.get(ingredient, 0) + 1
+        if self.pantry[ingredient] > 1:
+            return None
+        return self.apply(ingredient, 1)
+
+    def remove(self, name: str) -> Optional[np.ndarray]:
+        ingredient = self.corpus.ingredient_id(name)
+        if ingredient is None or ingredient not in self.pantry:
+            return None
+        self.pantry[ingredient] -= 1
+        if self.pantry[ingredient] > 0:
+            return None
+        del self.pantry[ingredient]
+        return self.apply(ingredient, -1)
+
+    def results(self) -> List[dict]:
+        """
+        The current top k as Recipe dicts, in the format of RecipeCorpus.search.
+        """
+        c = self.corpus
+        pos = np.searchsorted(self.rows, self.top)
+        results = []
+        for row, hit in zip(self.top.tolist(), self.hits[pos].tolist()):
+            missing = self._missing.get(row)
+            if missing is None:
+                missing = self._missing[row] = [c.vocab[t] for t in c.required(row).tolist() if t not in self.pantry]
+            total = int(c.indptr[row + 1] - c.indptr[row])
+            results.append({
+                "id": c.ids[row],
+                "title": c.titles[row],
+                "missing": missing,
+                "reason": f"Uses {int(hit)} of {total} ingredients you already have"
+            })
+        return results
+
+
+class Session:
+    """
+    One pantry session: the pantry as the user typed it, its filters, the
+    corpus ranking (when a corpus is loaded) and the recipe list last
+    returned to the client.
+    """
+
+    def __init__(self, session_id: str, k: int, ranking: Optional[CorpusRanking],
+                 filters: Optional[RecipeFilter] = None):
+        self.id = session_id
+        self.k = k
+        self.ranking = ranking
+        self.filters = filters
+        self.ingredients: List[str] = []
+        self.recipes: List[dict] = []
+        self.version = 0
+        self.touched = time.monotonic()
+        # Deltas that wait on a provider must not interleave
+        self.lock = asyncio.Lock()
+
+    def _find(self, name: str) -> Optional[int]:
+        key = normalize_name(name)
+        for position, existing in enumerate(self.ingredients):
+            if normalize_name(existing) == key:
+                return position
+        return None
+
+    def update(self, add: Iterable[str] = (), remove: Iterable[str] = ()) -> None:
+        """
+        Apply one delta: removals first, then additions. Raises ValueError,
+        leaving the session untouched, if the pantry would grow past
+        SESSION_MAX_INGREDIENTS.
+        """
+        add = [name.strip() for name in add if name.strip()]
+        remaining = {normalize_name(i) for i in self.ingredients} - {normalize_name(n) for n in remove}
+        if len(remaining | {normalize_name(n) for n in add}) > SESSION_MAX_INGREDIENTS:
+            raise ValueError(f"A session holds at most {SESSION_MAX_INGREDIENTS} ingredients")
+
+        for name in remove:
+            position = self._find(name)
+            if position is not None:
+                name = self.ingredients.pop(position)
+                if self.ranking is not None:
+                    self.ranking.remove(name)
+        for name in add:
+            if self._find(name) is None:
+                self.ingredients.append(name)
+                if self.ranking is not None:
+                    self.ranking.add(name)
+
+
+def recipe_diff(before: List[dict], after: List[dict]) -> Tuple[List[Tuple[int, dict]], List[str], List[Tuple[int, dict]]]:
+    """
+    Compare two ranked recipe lists by id: (rank, recipe) pairs that entered,
+    ids that left, and (rank, recipe) pairs still listed whose contents changed.
+    """
+    old = {recipe["id"]: recipe for recipe in before}
+    new_ids = {recipe["id"] for recipe in after}
+    entered, updated = [], []
+    for rank, recipe in enumerate(after):
+        previous = old.get(recipe["id"])
+        if previous is None:
+            entered.append((rank, recipe))
+        elif previous != recipe:
+            updated.append((rank, recipe))
+    left = [recipe["id"] for recipe in before if recipe["id"] not in new_ids]
+    return entered, left, updated
+
+
+class SharedSessionTable:
+    """
+    Session state (pantry, filters, recipe list, version) in a SQLite file
+    shared by worker processes. Saves are compare-and-set on the version, so
+    when two workers apply deltas to one session at once only one wins and
+    the other retries against the winner's state.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY,
+        k INTEGER NOT NULL,
+        filters TEXT,
+        ingredients TEXT NOT NULL,
+        recipes TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        touched REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        # One connection per process, used from worker threads one at a time
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str, ttl: float) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT k, filters, ingredients, recipes, version, touched FROM sessions WHERE id = ? AND touched >= ?",
+                (session_id, now - ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[5] > _TOUCH_INTERVAL:
+                self._conn.execute("UPDATE sessions SET touched = ? WHERE id = ?", (now, session_id))
+        k, filters, ingredients, recipes, version, _ = row
+        return {
+            "id": session_id, "k": k, "filters": json.loads(filters) if filters else None,
+            "ingredients": json.loads(ingredients), "recipes": json.loads(recipes), "version": version,
+        }
+
+    def save(self, record: dict, base_version: int, maxsize: int, ttl: float) -> Tuple[bool, int, int]:
+        """
+        Insert a new session (base_version 0) or replace one still at
+        base_version. Returns whether it was saved, and how many sessions
+        expired and were evicted to make room for a new one.
+        """
+        now = time.time()
+        values = (json.dumps(record["ingredients"]), json.dumps(record["recipes"]), record["version"], now)
+        with self._lock:
+            if base_version:
+                saved = self._conn.execute(
+                    "UPDATE sessions SET ingredients = ?, recipes = ?, version = ?, touched = ? WHERE id = ? AND version = ?",
+                    values + (record["id"], base_version),
+                ).rowcount == 1
+                return saved, 0, 0
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute("DELETE FROM sessions WHERE touched < ?", (now - ttl,)).rowcount
+                (count,) = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+                evicted = 0
+                if count >= maxsize:
+                    evicted = self._conn.execute(
+                        "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY touched LIMIT ?)",
+                        (count - maxsize + 1,),
+                    ).rowcount
+                filters = json.dumps(record["filters"]) if record["filters"] else None
+                self._conn.execute(
+                    "INSERT INTO sessions (ingredients, recipes, version, touched, id, k, filters) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    values + (record["id"], record["k"], filters),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return True, expired, evicted
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def count(self, ttl: float) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE touched >= ?", (time.time() - ttl,)).fetchone()[0]
+
+
+class SessionStore:
+    """
+    Sessions by id in least-recently-used order, so idle expiry and the size
+    bound both evict from the front.
+
+    With a SharedSessionTable the table holds every session and the local
+    sessions are a cache of it: each lookup checks the stored version and
+    brings a stale local copy up to date before it is used.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, shared_path: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.deltas = 0
+        self.conflicts = 0
+        self.rebuilt = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.shared = SharedSessionTable(shared_path) if shared_path else None
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.touched <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            if self.shared is None:
+                self.expired += 1
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+            if self.shared is None:
+                self.evicted += 1
+
+    def create(self, k: int, corpus: Optional[RecipeCorpus], min_coverage: float,
+               filters: Optional[RecipeFilter] = None) -> Session:
+        """
+        A new, empty session. It is not listed until the first save().
+        """
+        ranking = CorpusRanking(corpus, k, min_coverage, filters) if corpus is not None else None
+        return Session(secrets.token_urlsafe(12), k, ranking, filters)
+
+    async def save(self, session: Session, base_version: int) -> bool:
+        """
+        List a new session (base_version 0) or record a change made to a
+        session at base_version. False when the session was deleted, expired
+        or changed by another worker meanwhile; the local copy is dropped so
+        the next get() loads the current state.
+        """
+        self._expire()
+        if self.shared is None:
+            if base_version and session.id not in self._sessions:
+                return False
+        else:
+            record = {
+                "id": session.id, "k": session.k, "filters": session.filters.spec if session.filters else None,
+                "ingredients": session.ingredients, "recipes": session.recipes, "version": session.version,
+            }
+            saved, expired, evicted = await asyncio.to_thread(self.shared.save, record, base_version, self.maxsize, self.ttl)
+            self.expired += expired
+            self.evicted += evicted
+            if not saved:
+                self.conflicts += 1
+                self._sessions.pop(session.id, None)
+                return False
+        if not base_version:
+            self.created += 1
+        session.touched = time.monotonic()
+        self._remember(session)
+        return True
+
+    def _restore(self, record: dict, session: Optional[Session], corpus: Optional[RecipeCorpus],
+                 min_coverage: float) -> Session:
+        # Rebuild the ranking from the stored pantry; an existing local
+        # session is updated in place so its lock stays the same
+        filters = compile_filter(**record["filters"]) if record["filters"] else None
+        if session is None:
+            session = Session(record["id"], record["k"], None, filters)
+        session.ranking = CorpusRanking(corpus, session.k, min_coverage, filters) if corpus is not None else None
+        session.ingredients = []
+        session.update(add=record["ingredients"])
+        session.recipes = record["recipes"]
+        session.version = record["version"]
+        self.rebuilt += 1
+        return session
+
+    async def get(self, session_id: str, corpus: Optional[RecipeCorpus] = None,
+                  min_coverage: float = 0.0) -> Optional[Session]:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if self.shared is not None:
+            record = await asyncio.to_thread(self.shared.load, session_id, self.ttl)
+            if record is None:
+                self._sessions.pop(session_id, None)
+                return None
+            # A delta running here saves (or retries) on its own
+            stale = session is None or (session.version != record["version"] and not session.lock.locked())
+            if stale:
+                session = self._restore(record, session, corpus, min_coverage)
+        if session is not None:
+            session.touched = time.monotonic()
+            self._remember(session)
+        return session
+
+    async def delete(self, session_id: str) -> bool:
+        deleted = self._sessions.pop(session_id, None) is not None
+        if self.shared is not None:
+            deleted = await asyncio.to_thread(self.shared.delete, session_id)
+        return deleted
+
+    def stats(self) -> dict:
+        self._expire()
+        return {
+            "active": self.shared.count(self.ttl) if self.shared is not None else len(self._sessions),
+            "shared": self.shared is not None,
+            "max_sessions": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "candidates": sum(s.ranking.candidates for s in self._sessions.values() if s.ranking is not None),
+            "created": self.created,
+            "deltas": self.deltas,
+            "conflicts": self.conflicts,
+            "rebuilt": self.rebuilt,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+session_store = SessionStore(SESSION_MAX, SESSION_TTL, SESSION_SHARED_PATH)
@@ -0,0 +1,166 @@
+import os
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from fallback import normalize_keyword
+from metrics import similarity_scores
+
+# --------------------------------
+# Similarity cache settings
+# --------------------------------
+# A pantry whose Jaccard similarity to a previously answered one reaches
+# SIMILAR_THRESHOLD reuses that answer. Candidates come from MinHash/LSH
+# (SIMILAR_BANDS bands of SIMILAR_PERMUTATIONS / SIMILAR_BANDS rows) and are
+# confirmed with the exact Jaccard similarity of the two ingredient sets.
+SIMILAR_ENABLED = os.getenv("AGENT_SIMILAR", "on") == "on"
+SIMILAR_THRESHOLD = float(os.getenv("AGENT_SIMILAR_THRESHOLD", "0.75"))
+SIMILAR_PERMUTATIONS = int(os.getenv("AGENT_SIMILAR_PERMUTATIONS", "64"))
+SIMILAR_BANDS = int(os.getenv("AGENT_SIMILAR_BANDS", "16"))
+SIMILAR_SIZE = int(os.getenv("AGENT_SIMILAR_SIZE", "5000"))
+
+_PRIME = (1 << 31) - 1
+
+
+def ingredient_tokens(ingredients: Iterable[str]) -> FrozenSet[str]:
+    """
+    Canonical ingredient set for similarity: lowercased, singular head word,
+    so "eggs" and "egg" count as the same ingredient.
+    """
+    return frozenset(t for t in (normalize_keyword(i) for i in ingredients if i) if t)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """
+    MinHash signatures from universal hashes (a*x + b) mod p over stable
+    CRC32 token hashes. a < 2^31 and x < 2^31 keep a*x inside uint64.
+    """
+
+    def __init__(self, permutations: int, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=permutations, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=permutations, dtype=np.uint64)
+
+    def signature(self, tokens: FrozenSet[str]) -> np.ndarray:
+        x = np.fromiter((zlib.crc32(t.encode("utf-8")) % _PRIME for t in tokens), dtype=np.uint64, count=len(tokens))
+        hashes = (np.outer(x, self.a) + self.b) % _PRIME
+        return hashes.min(axis=0)
+
+
+class SimilarityIndex:
+    """
+    LSH index over answered pantries. Each entry is filed under one bucket per
+    band; a lookup checks the exact Jaccard similarity of every entry sharing
+    at least one bucket and returns the best one at or above the threshold.
+    Bounded to `maxsize` entries, least recently matched evicted first.
+    """
+
+    def __init__(self, threshold: float, permutations: int, bands: int, maxsize: int):
+        if permutations % bands:
+            raise ValueError("AGENT_SIMILAR_PERMUTATIONS must be a multiple of AGENT_SIMILAR_BANDS")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.maxsize = maxsize
+        self.hasher = MinHasher(permutations)
+        self.lookups = 0
+        self.hits = 0
+        self.candidates = 0
+        self._entries: "OrderedDict[FrozenSet[str], Tuple[Tuple[bytes, ...], object]]" = OrderedDict()
+        self._buckets: Dict[bytes, Set[FrozenSet[str]]] = {}
+
+    def _band_keys(self, tokens: FrozenSet[str]) -> Tuple[bytes, ...]:
+        signature = self.hasher.signature(tokens)
+        return tuple(
+            band.to_bytes(1, "little") + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        )
+
+    def add(self, ingredients: Iterable[str], value: object) -> None:
+        tokens = ingredient_tokens(ingredients)
+        if not tokens or self.maxsize <= 0:
+            return
+        if tokens in self._entries:
+            bands, _ = self._entries[tokens]
+            self._entries[tokens] = (bands, value)
+            self._entries.move_to_end(tokens)
+            return
+
+        bands = self._band_keys(tokens)
+        self._entries[tokens] = (bands, value)
+        for band in bands:
+            self._buckets.setdefault(band, set()).add(tokens)
+
+        while len(self._entries) > self.maxsize:
+            old, (old_bands, _) = self._entries.popitem(last=False)
+            for band in old_bands:
+                members = self._buckets.get(band)
+                if members is not None:
+                    members.discard(old)
+                    if not members:
+                        del self._buckets[band]
+
+    def lookup(self, ingredients: Iterable[str]) -> Optional[Tuple[float, FrozenSet[str], object]]:
+        """
+        Return (similarity, matched ingredient set, value) for the most
+        similar answered pantry at or above the threshold, else None.
+        """
+        tokens = ingredient_tokens(ingredients)
+        if not tokens or not self._entries:
+            return None
+        self.lookups += 1
+
+        seen: Set[FrozenSet[str]] = set()
+        for band in self._band_keys(tokens):
+            seen.update(self._buckets.get(band, ()))
+        self.candidates += len(seen)
+
+        best, best_score = None, 0.0
+        for candidate in seen:
+            score = jaccard(tokens, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+
+        if best is not None:
+            similarity_scores.observe(best_score)
+        if best is None or best_score < self.threshold:
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(best)
+        return best_score, best, self._entries[best][1]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SIMILAR_ENABLED,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_candidates": round(self.candidates / self.lookups, 2) if self.lookups else 0.0,
+        }
+
+
+def recompute_missing(missing: List[str], answered: FrozenSet[str], ingredients: List[str]) -> List[str]:
+    """
+    Re-derive a recipe's missing list for a new pantry. The recipe is assumed
+    to use the answered pantry plus its missing items, so whatever of that the
+    new pantry lacks is now missing, and anything it has is no longer missing.
+    """
+    have = ingredient_tokens(ingredients)
+    result = [item for item in missing if normalize_keyword(item) not in have]
+    listed = {normalize_keyword(item) for item in result}
+    result.extend(sorted(token for token in answered if token not in have and token not in listed))
+    return result
+
+
+similar_index = SimilarityIndex(SIMILAR_THRESHOLD, SIMILAR_PERMUTATIONS, SIMILAR_BANDS, SIMILAR_SIZE)
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight task.
+
+    The first caller for a key starts the work as a separate task; callers
+    arriving while it runs await the same task and receive its result (or
+    exception). The shared task is shielded, so one caller being cancelled
+    does not cancel the work for the others; it is cancelled only once every
+    caller has gone (e.g. all their clients disconnected). The task runs with
+    the first caller's context, and so within its request budget.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        # key -> [task, callers still waiting]
+        self._calls: Dict[Hashable, list] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._calls.get(key)
+        if entry is not None:
+            self.coalesced += 1
+            entry[1] += 1
+        else:
+            entry = self._calls[key] = [asyncio.ensure_future(fn()), 1]
+            self.started += 1
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+
+        task = entry[0]
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                entry[1] -= 1
+                if entry[1] == 0:
+                    # Last caller gone: stop the work, and let a new caller start afresh
+                    self.abandoned += 1
+                    self._forget(key, entry)
+                    task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, entry: list) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+
+# Shared by the recipe list and detail paths; keys are prefixed per path
+inflight = SingleFlight()
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, List, Optional, Tuple
+
+# --------------------------------
+# Persistent store settings
+# --------------------------------
+# Validated provider results are written through to a SQLite file (WAL mode)
+# so restarts and deploys start warm. Several uvicorn workers can share one
+# file. The store is off unless AGENT_STORE_PATH names the database file,
+# which belongs in a data directory rather than next to the code.
+STORE_PATH = os.getenv("AGENT_STORE_PATH", "")
+STORE_MAX_ENTRIES = int(os.getenv("AGENT_STORE_MAX_ENTRIES", "50000"))
+STORE_TTL = float(os.getenv("AGENT_STORE_TTL", str(7 * 24 * 3600)))
+STORE_WARM_ENTRIES = int(os.getenv("AGENT_STORE_WARM_ENTRIES", "1000"))
+STORE_THREADS = int(os.getenv("AGENT_STORE_THREADS", "2"))
+# Reads go through a shared memory map of the database file, so workers
+# serve hot entries from the same page-cache pages instead of copying them
+STORE_MMAP_BYTES = int(float(os.getenv("AGENT_STORE_MMAP_MB", "256")) * 1024 * 1024)
+
+# Recording every read as an access would turn reads into writes; last-used
+# times only need to be good enough to order evictions.
+_TOUCH_INTERVAL = 300
+# Eviction runs once per this many writes rather than on every insert
+_EVICT_EVERY = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+"""
+
+
+def encode_key(key: Hashable) -> str:
+    # Cache keys are (recipe_id or filter signature, sorted ingredient tuple)
+    return json.dumps(key, separators=(",", ":"))
+
+
+def decode_key(text: str) -> Tuple:
+    recipe_id, ingredients = json.loads(text)
+    return recipe_id, tuple(ingredients)
+
+
+class ResultStore:
+    """
+    SQLite-backed result store keyed by (kind, cache key), holding JSON text.
+
+    All SQLite work runs on a small dedicated thread pool, one connection per
+    thread, so the event loop never waits on disk. Writes are fire-and-forget;
+    a failed read or write is logged and treated as a miss.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float, threads: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threads = max(1, threads)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self.evicted = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(f"PRAGMA mmap_size={STORE_MMAP_BYTES}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def open(self) -> None:
+        if not self.path or self._executor is not None:
+            return
+        try:
+            self._connection().executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            print(f"Result store unavailable ({self.path}): {str(e)}")
+            return
+        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="store")
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # --------------------------------
+    # Blocking operations (store threads only)
+    # --------------------------------
+    def _get(self, kind: str, key: str) -> Optional[str]:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, accessed FROM results WHERE kind = ? AND key = ? AND created >= ?",
+            (kind, key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > _TOUCH_INTERVAL:
+            conn.execute("UPDATE results SET accessed = ? WHERE kind = ? AND key = ?", (now, kind, key))
+        return row[0]
+
+    def _put(self, kind: str, key: str, value: str) -> None:
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (kind, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (kind, key, value, now, now),
+        )
+        # Writes run on several store threads; counters are updated under the lock
+        with self._lock:
+            self.writes += 1
+            evict = self.writes % _EVICT_EVERY == 0
+        if evict:
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """
+        Drop expired rows, then the least recently used rows over max_entries.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            (count,) = conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            excess = count - self.max_entries
+            overflow = 0
+            if excess > 0:
+                overflow = conn.execute(
+                    "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY accessed LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.evicted += expired + overflow
+
+    def _recent(self, kind: str, limit: int) -> List[Tuple[str, str]]:
+        return self._connection().execute(
+            "SELECT key, value FROM results WHERE kind = ? AND created >= ? ORDER BY accessed DESC LIMIT ?",
+            (kind, time.time() - self.ttl, limit),
+        ).fetchall()
+
+    def _count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    # --------------------------------
+    # Async API
+    # --------------------------------
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, kind: str, key: Hashable) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            value = await self._run(self._get, kind, encode_key(key))
+        except Exception as e:
+            self.errors += 1
+            print(f"Result store read failed: {str(e)}")
+            return None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, kind: str, key: Hashable, value: str) -> None:
+        """
+        Queue a write without waiting for it.
+        """
+        if not self.enabled:
+            return
+        future = self._executor.submit(self._put, kind, encode_key(key), value)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future) -> None:
+        # Runs on the store thread that did the write
+        if not future.cancelled() and future.exception() is not None:
+            with self._lock:
+                self.errors += 1
+            print(f"Result store write failed: {str(future.exception())}")
+
+    async def recent(self, kind: str, limit: int) -> List[Tuple[Tuple, str]]:
+        """
+        The most recently used (key, value) pairs of a kind, for cache warming.
+        """
+        if not self.enabled or limit <= 0:
+            return []
+        try:
+            rows = await self._run(self._recent, kind, limit)
+        except Exception as e:
+            self.errors += 1
+            print(f"Result store warm-up failed: {str(e)}")
+            return []
+        return [(decode_key(key), value) for key, value in rows]
+
+    async def stats(self) -> dict:
+        entries = None
+        if self.enabled:
+            try:
+                entries = await self._run(self._count)
+            except Exception:
+                pass
+        return {
+            "enabled": self.enabled,
+            "path": self.path or None,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+result_store = ResultStore(STORE_PATH, STORE_MAX_ENTRIES, STORE_TTL, STORE_THREADS)
@@ -0,0 +1,86 @@
+import json
+from typing import List
+
+
+class RecipeStreamParser:
+    """
+    Incremental parser for model output shaped like {"recipes": [{...}, {...}]}.
+
+    Text chunks are fed in as they arrive from the provider; each call to
+    feed() returns the recipe objects whose closing brace has been seen so
+    far. Already-consumed text is dropped so the buffer only ever holds the
+    object currently being generated.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._in_array = False
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self._obj_start = -1
+
+    def feed(self, chunk: str) -> List[dict]:
+        objects = []
+        if self.done:
+            return objects
+
+        self._buf += chunk
+
+        # Skip any leading chatter until the recipes array opens
+        if not self._in_array:
+            key = self._buf.find('"recipes"')
+            if key == -1:
+                return objects
+            bracket = self._buf.find('[', key)
+            if bracket == -1:
+                return objects
+            self._in_array = True
+            self._buf = self._buf[bracket + 1:]
+            self._pos = 0
+
+        buf = self._buf
+        i = self._pos
+        end = len(buf)
+
+        while i < end:
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{' or c == '[':
+                if self._depth == 0 and c == '{':
+                    self._obj_start = i
+                self._depth += 1
+            elif c == '}' or c == ']':
+                if self._depth == 0:
+                    # End of the recipes array
+                    self.done = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start != -1:
+                    try:
+                        objects.append(json.loads(buf[self._obj_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._obj_start = -1
+            i += 1
+
+        if self._obj_start == -1:
+            self._buf = buf[i:]
+            self._pos = 0
+        else:
+            self._buf = buf[self._obj_start:]
+            self._pos = i - self._obj_start
+            self._obj_start = 0
+
+        return objects
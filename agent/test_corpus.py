@@ -0,0 +1,66 @@
+import random
+import unittest
+
+from corpus import RecipeCorpus
+from filters import compile_filter
+
+# Run from agent/: python -m unittest test_corpus
+
+
+def tie_heavy_corpus(seed: int = 7, recipes: int = 400) -> RecipeCorpus:
+    """
+    Small vocabulary and equal-sized recipes, so many recipes score the same
+    for a pantry and ranking depends on how ties are broken.
+    """
+    rng = random.Random(seed)
+    vocab = [f"ingredient{i}" for i in range(20)]
+    records = []
+    for n in range(recipes):
+        records.append({
+            "id": f"r{n}",
+            "title": f"Recipe {n}",
+            "ingredients": [{"name": name} for name in rng.sample(vocab, rng.choice((2, 3, 4)))],
+            "optional_ingredients": rng.sample(vocab, rng.choice((0, 1, 2))),
+            "cuisine": rng.choice(("italian", "mexican", "thai")),
+            "time_minutes": rng.choice((10, 20, 45)),
+        })
+    return RecipeCorpus.from_records(records)
+
+
+class SearchBatchTest(unittest.TestCase):
+    """
+    search_batch must return exactly what search returns for each pantry:
+    the same recipes in the same order, ties included.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = tie_heavy_corpus()
+        rng = random.Random(11)
+        cls.pantries = [rng.sample(cls.corpus.vocab, rng.randint(1, 8)) for _ in range(200)]
+
+    def assert_batch_matches(self, k, min_coverage=0.0, filters=None):
+        batch = self.corpus.search_batch(self.pantries, k, min_coverage, filters)
+        for pantry, results, pantry_filters in zip(self.pantries, batch, filters or [None] * len(self.pantries)):
+            self.assertEqual(results, self.corpus.search(pantry, k, min_coverage, pantry_filters), pantry)
+
+    def test_matches_search(self):
+        for k in (1, 5, 10, 50):
+            self.assert_batch_matches(k)
+
+    def test_matches_search_with_min_coverage(self):
+        for min_coverage in (0.34, 0.5, 1.0):
+            self.assert_batch_matches(10, min_coverage)
+
+    def test_matches_search_with_filters(self):
+        options = [None, compile_filter(cuisine=["thai"]), compile_filter(max_time=20)]
+        self.assert_batch_matches(10, filters=[options[i % 3] for i in range(len(self.pantries))])
+
+    def test_sample_corpus(self):
+        corpus = RecipeCorpus.from_json("recipes.json")
+        pantries = [["egg", "rice"], ["Egg"], ["garlic", "egg", "rice"], ["nothing here"]]
+        self.assertEqual(corpus.search_batch(pantries), [corpus.search(p) for p in pantries])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,6 +20,32 @@ app.use(express.json());
 
 // Agent API URL (Python FastAPI service)
 const AGENT_API_URL = process.env.AGENT_API_URL || 'http://localhost:8000';
+// Time budget for one agent call; the agent cuts its provider calls to fit it
+const AGENT_TIMEOUT_MS = parseInt(process.env.AGENT_TIMEOUT_MS || '15000', 10);
+
+// Abort the agent call when our budget runs out or the browser goes away,
+// and tell the agent how long it has so it can stop waiting too.
+function agentCall(res, path, body) {
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), AGENT_TIMEOUT_MS);
+  const onClose = () => {
+    if (!res.writableFinished) controller.abort();
+  };
+  res.on('close', onClose);
+
+  return fetch(`${AGENT_API_URL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-Request-Deadline-Ms': String(AGENT_TIMEOUT_MS),
+    },
+    body: JSON.stringify(body),
+    signal: controller.signal,
+  }).finally(() => {
+    clearTimeout(timer);
+    res.off('close', onClose);
+  });
+}
 
 // Routes
 app.get('/', (req, res) => {
@@ -42,12 +68,14 @@ app.post('/api/recipes', async (req, res) => {
 
     console.log(`Calling agent with ingredients: ${ingredients.join(', ')}`);
 
-    // Call the Python FastAPI agent
-    const agentResponse = await fetch(`${AGENT_API_URL}/agent/recipes`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ ingredients }),
-    });
+    // Call the Python FastAPI agent. Diet and cuisine filters are applied by
+    // the agent; cooking style has no agent equivalent and is not forwarded.
+    const body = { ingredients };
+    const agentFilters = {};
+    if (filters && Array.isArray(filters.diet) && filters.diet.length) agentFilters.diet = filters.diet;
+    if (filters && Array.isArray(filters.cuisine) && filters.cuisine.length) agentFilters.cuisine = filters.cuisine;
+    if (Object.keys(agentFilters).length) body.filters = agentFilters;
+    const agentResponse = await agentCall(res, '/agent/recipes', body);
 
     if (!agentResponse.ok) {
       const errorText = await agentResponse.text();
@@ -96,11 +124,7 @@ app.post('/api/recipe/details', async (req, res) => {
     }
 
     // Call the Python FastAPI agent for details
-    const agentResponse = await fetch(`${AGENT_API_URL}/agent/recipe/details`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ recipe_id, ingredients }),
-    });
+    const agentResponse = await agentCall(res, '/agent/recipe/details', { recipe_id, ingredients });
 
     if (!agentResponse.ok) {
       const errorText = await agentResponse.text();